@@ -2,9 +2,11 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from app.core.security import authenticate_user, create_access_token, get_current_user
 from app.schemas.token import Token
-from app.core.database import SessionLocal
+from app.core.database import SessionLocal, get_async_db
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.schemas.user import UserOut
+from app.models.user import User
 
 router = APIRouter()
 
@@ -16,8 +18,8 @@ def get_db():
         db.close()
 
 @router.post("/token", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -28,5 +30,9 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/me", response_model=UserOut)
-def read_users_me(current_user=Depends(get_current_user)):
-    return current_user
+def read_users_me(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+    # current_user 是缓存的快照，这里读取完整的用户信息（含在线状态）
+    user = db.query(User).filter(User.id == current_user.id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session, joinedload
 from app.core.database import SessionLocal
-from app.core.security import get_current_user
+from app.core.security import UserSnapshot, get_current_user
+from app.core.friend_cache import friend_cache
 from app.models.friend import Friend
 from app.models.user import User
 from app.schemas.friend import (
@@ -27,7 +28,7 @@ def get_db():
 def add_friend(
     request: FriendRequest,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: UserSnapshot = Depends(get_current_user),
 ):
     if request.friend_id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot add yourself as friend")
@@ -61,6 +62,7 @@ def add_friend(
     db.add(friend)
     db.commit()
     db.refresh(friend)
+    friend_cache.invalidate(current_user.id, request.friend_id)
     return friend
 
 
@@ -116,6 +118,7 @@ def accept_friend(
         db.add(reverse_friend)
     db.commit()
     db.refresh(friend)
+    friend_cache.add_friendship(current_user.id, friend.user_id)
     return friend
 
 
@@ -139,4 +142,5 @@ def reject_friend(
     friend.status = "rejected"
     db.commit()
     db.refresh(friend)
+    friend_cache.invalidate(current_user.id, friend.user_id)
     return friend
@@ -0,0 +1,266 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
+from app.core.database import SessionLocal, get_async_db
+from app.core.security import UserSnapshot, get_current_user
+from app.core.message_writer import message_writer
+from app.core.groups import (
+    GROUP_MAX_MEMBERS, deliver_group_message, group_history_query, group_read_update,
+    member_ids_query, my_groups_query,
+)
+from app.models.group import Group, GroupMember, GroupMessage
+from app.models.user import User
+from app.schemas.group import (
+    GroupCreate, GroupDetailOut, GroupMembersAdd, GroupMessageOut, GroupMessageSend, GroupOut,
+)
+from app.utils.pagination import decode_cursor, encode_cursor
+from datetime import datetime
+from typing import List, Optional
+
+router = APIRouter()
+
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def require_member(db: Session, group_id: int, user_id: int) -> GroupMember:
+    """当前用户必须是群成员；不是成员时与群不存在一样返回 404"""
+    member = db.get(GroupMember, (group_id, user_id))
+    if member is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return member
+
+
+def existing_user_ids(db: Session, user_ids: List[int]) -> List[int]:
+    found = set(db.execute(select(User.id).where(User.id.in_(user_ids))).scalars().all())
+    missing = [user_id for user_id in user_ids if user_id not in found]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Users not found: {missing}")
+    return user_ids
+
+
+def group_detail(db: Session, group: Group, member: GroupMember) -> GroupDetailOut:
+    members = (
+        db.execute(
+            select(GroupMember)
+            .options(joinedload(GroupMember.user))
+            .where(GroupMember.group_id == group.id)
+            .order_by(GroupMember.joined_at, GroupMember.user_id)
+        )
+        .scalars()
+        .all()
+    )
+    unread = db.execute(
+        select(func.count())
+        .select_from(GroupMessage)
+        .where(
+            GroupMessage.group_id == group.id,
+            GroupMessage.id > member.last_read_message_id,
+            GroupMessage.from_id != member.user_id,
+        )
+    ).scalar()
+    detail = GroupDetailOut.model_validate(group)
+    detail.members = members
+    detail.unread_count = unread
+    detail.last_read_message_id = member.last_read_message_id
+    return detail
+
+
+@router.post("/", response_model=GroupDetailOut)
+def create_group(
+    request: GroupCreate,
+    db: Session = Depends(get_db),
+    current_user: UserSnapshot = Depends(get_current_user),
+):
+    """创建群聊，创建者为群主"""
+    name = request.name.strip()
+    if not name:
+        raise HTTPException(status_code=400, detail="Group name is required")
+    member_ids = list(dict.fromkeys(uid for uid in request.member_ids if uid != current_user.id))
+    if len(member_ids) + 1 > GROUP_MAX_MEMBERS:
+        raise HTTPException(status_code=400, detail=f"A group can have at most {GROUP_MAX_MEMBERS} members")
+    existing_user_ids(db, member_ids)
+
+    group = Group(name=name, owner_id=current_user.id)
+    db.add(group)
+    db.flush()
+    owner = GroupMember(group_id=group.id, user_id=current_user.id, role="owner")
+    db.add(owner)
+    db.add_all([GroupMember(group_id=group.id, user_id=uid, role="member") for uid in member_ids])
+    db.commit()
+    return group_detail(db, group, owner)
+
+
+@router.get("/", response_model=List[GroupOut])
+def list_groups(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+    """我加入的群，附带最后一条消息和未读数，按最后消息时间倒序"""
+    groups = []
+    for group, unread_count, last_read_message_id in db.execute(my_groups_query(current_user.id)).all():
+        out = GroupOut.model_validate(group)
+        out.unread_count = unread_count
+        out.last_read_message_id = last_read_message_id
+        groups.append(out)
+    return groups
+
+
+@router.get("/{group_id}", response_model=GroupDetailOut)
+def get_group(group_id: int, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+    member = require_member(db, group_id, current_user.id)
+    return group_detail(db, db.get(Group, group_id), member)
+
+
+@router.post("/{group_id}/members", response_model=GroupDetailOut)
+def add_members(
+    group_id: int,
+    request: GroupMembersAdd,
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    """群成员可以邀请其他用户入群；新成员从入群时的最后一条消息开始计未读"""
+    member = require_member(db, group_id, current_user.id)
+    group = db.get(Group, group_id)
+    user_ids = list(dict.fromkeys(request.user_ids))
+    existing_user_ids(db, user_ids)
+    count = db.execute(select(func.count()).select_from(GroupMember).where(GroupMember.group_id == group_id)).scalar()
+    if count + len(user_ids) > GROUP_MAX_MEMBERS:
+        raise HTTPException(status_code=400, detail=f"A group can have at most {GROUP_MAX_MEMBERS} members")
+    if user_ids:
+        now = datetime.utcnow()
+        db.execute(
+            insert(GroupMember)
+            .values([
+                {"group_id": group_id, "user_id": uid, "role": "member", "joined_at": now,
+                 "last_read_message_id": group.last_message_id}
+                for uid in user_ids
+            ])
+            .on_conflict_do_nothing()
+        )
+        db.commit()
+    return group_detail(db, group, member)
+
+
+@router.delete("/{group_id}/members/{user_id}")
+def remove_member(
+    group_id: int,
+    user_id: int,
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    """退出群聊，或由群主移出成员；群主不能退出"""
+    member = require_member(db, group_id, current_user.id)
+    if user_id != current_user.id and member.role != "owner":
+        raise HTTPException(status_code=403, detail="Only the group owner can remove members")
+    target = db.get(GroupMember, (group_id, user_id))
+    if target is None:
+        raise HTTPException(status_code=404, detail="Member not found")
+    if target.role == "owner":
+        raise HTTPException(status_code=400, detail="The group owner cannot leave the group")
+    db.delete(target)
+    db.commit()
+    return {"message": "Member removed"}
+
+
+@router.get("/{group_id}/history", response_model=List[GroupMessageOut])
+def get_group_history(
+    group_id: int,
+    response: Response,
+    limit: int = 20,
+    before_id: Optional[int] = Query(None, description="只返回 id 小于该值的消息（向前翻页）"),
+    after_id: Optional[int] = Query(None, description="只返回 id 大于该值的消息（拉取新消息）"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标"),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    """群聊记录，按时间从新到旧排列，游标分页规则与单聊 /api/message/history 相同"""
+    require_member(db, group_id, current_user.id)
+    if cursor:
+        try:
+            direction, cursor_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if direction == "before":
+            before_id = cursor_id
+        else:
+            after_id = cursor_id
+    if after_id is not None and before_id is not None:
+        raise HTTPException(status_code=400, detail="before_id and after_id are mutually exclusive")
+
+    messages = db.execute(group_history_query(group_id, before_id, after_id, limit)).scalars().all()
+    if after_id is not None:
+        messages = list(reversed(messages))
+        if len(messages) == limit:
+            response.headers["X-Next-Cursor"] = encode_cursor("after", messages[0].id)
+    elif len(messages) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor("before", messages[-1].id)
+    return messages
+
+
+async def post_group_message(
+    db: AsyncSession,
+    user_id: int,
+    group_id: int,
+    content: Optional[str],
+    image_url: Optional[str] = None,
+    image_name: Optional[str] = None,
+) -> GroupMessage:
+    """
+    发送群消息（HTTP 和 WebSocket 共用）：消息只写一份，写入后推送给在线的群成员。
+    不是群成员或消息为空时抛出 HTTPException。
+    """
+    if not content and not image_url:
+        raise HTTPException(status_code=400, detail="消息不能为空，至少需要文本或图片")
+    member_ids = (await db.execute(member_ids_query(group_id))).scalars().all()
+    if user_id not in member_ids:
+        raise HTTPException(status_code=404, detail="Group not found")
+
+    if content and image_url:
+        msg_type = "mixed"
+    elif image_url:
+        msg_type = "image"
+    else:
+        msg_type = "text"
+    message = GroupMessage(
+        group_id=group_id,
+        from_id=user_id,
+        content=content,
+        msg_type=msg_type,
+        image_url=image_url,
+        image_name=image_name,
+    )
+    # 与单聊共用写入管线，返回时消息已落盘
+    await message_writer.submit(message)
+    await deliver_group_message(message, member_ids)
+    return message
+
+
+@router.post("/{group_id}/send", response_model=GroupMessageOut)
+async def send_group_message(
+    group_id: int,
+    message_data: GroupMessageSend,
+    db: AsyncSession = Depends(get_async_db),
+    current_user=Depends(get_current_user),
+):
+    return await post_group_message(
+        db, current_user.id, group_id, message_data.content, message_data.image_url, message_data.image_name
+    )
+
+
+@router.post("/{group_id}/read")
+def mark_group_read(
+    group_id: int,
+    up_to_id: Optional[int] = Query(None, description="只标记 id 不超过该值的消息，默认全部"),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    # 只更新自己这一行的已读水位
+    require_member(db, group_id, current_user.id)
+    last_read_message_id = db.execute(group_read_update(group_id, current_user.id, up_to_id)).scalar()
+    db.commit()
+    return {"last_read_message_id": last_read_message_id}
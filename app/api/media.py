@@ -0,0 +1,35 @@
+from fastapi import APIRouter, HTTPException, Request
+from app.core.derivatives import VARIANTS, derivative_path, derivatives
+from app.utils.media_files import media_response
+import os
+
+router = APIRouter()
+
+# 上传文件根目录，对应 /uploads
+MEDIA_ROOT = "uploads"
+
+@router.api_route("/derived/{variant}/{shard}/{filename}", methods=["GET", "HEAD"])
+async def get_derivative(request: Request, variant: str, shard: str, filename: str):
+    """
+    获取缩略图 / 预览图，尚未生成时（例如功能上线前上传的图片）当场生成
+    """
+    stem, suffix = os.path.splitext(filename)
+    if variant not in VARIANTS or suffix != ".webp" or shard != stem[:2]:
+        raise HTTPException(status_code=404, detail="图片不存在")
+
+    if not await derivatives.ensure(stem):
+        raise HTTPException(status_code=404, detail="图片不存在")
+    response = await media_response(request, ".", derivative_path(stem, variant), media_type="image/webp")
+    if response is None:
+        raise HTTPException(status_code=404, detail="图片不存在")
+    return response
+
+@router.api_route("/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def get_media(request: Request, path: str):
+    """
+    上传文件下载：长期缓存、ETag / 304、Range
+    """
+    response = await media_response(request, MEDIA_ROOT, path)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return response
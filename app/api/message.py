@@ -1,10 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import select, union_all
+from sqlalchemy.orm import Session, joinedload
 from app.core.database import SessionLocal
 from app.core.security import get_current_user
+from app.core.message_writer import message_writer
+from app.core.conversations import (
+    is_read, peer_watermarks_query, read_watermark_update, unread_count_query, unread_messages_query,
+    watermarks_query,
+)
+from app.core.search import SEARCH_MIN_TERM_LENGTH, match_expression, search_messages
+from app.core.archive import read_archive
 from app.models.message import Message
-from app.schemas.message import MessageOut, MessageSend
-from typing import List
+from app.models.conversation import Conversation
+from app.schemas.message import ConversationOut, MessageOut, MessageSend
+from app.utils.pagination import decode_cursor, decode_rank_cursor, encode_cursor, encode_rank_cursor
+from app.utils.streaming import STREAM_BATCH_SIZE, stream_items
+from typing import Dict, Iterator, List, Optional, Tuple
 
 router = APIRouter()
 
@@ -17,45 +28,244 @@ def get_db():
         db.close()
 
 
+def conversation_query(user_a: int, user_b: int, before_id: Optional[int] = None,
+                       after_id: Optional[int] = None, limit: int = 20):
+    """
+    两人会话中的一页消息（默认按 id 从新到旧）
+
+    拆成 (a->b)、(b->a) 两个分支分别走 ix_messages_from_to_id 索引取前 limit 条，
+    再合并排序，避免 OR 条件导致整段会话被扫描和排序。
+    """
+    newest_first = after_id is None
+
+    def branch(from_id: int, to_id: int):
+        q = select(Message.id).where(Message.from_id == from_id, Message.to_id == to_id)
+        if before_id is not None:
+            q = q.where(Message.id < before_id)
+        if after_id is not None:
+            q = q.where(Message.id > after_id)
+        q = q.order_by(Message.id.desc() if newest_first else Message.id.asc()).limit(limit)
+        return select(q.subquery())
+
+    ids = union_all(branch(user_a, user_b), branch(user_b, user_a)).subquery()
+    return (
+        select(Message)
+        .where(Message.id.in_(select(ids.c.id)))
+        .order_by(Message.id.desc() if newest_first else Message.id.asc())
+        .limit(limit)
+    )
+
+
+def conversation_page(db: Session, user_a: int, user_b: int, before_id: Optional[int] = None,
+                      after_id: Optional[int] = None, limit: int = 20) -> List[Message]:
+    """
+    两人会话中的一页消息，排序同 conversation_query，透明地跨热表和归档读取
+
+    归档中的消息都比热表中的旧：从新到旧翻页时热表不足一页才读归档，
+    从旧到新时先读归档，再从热表补齐。
+    归档后尚未从热表删除的消息两处都有，以热表为准：只取 id 小于热表中最旧一条的归档消息。
+    """
+    if after_id is None:
+        messages = list(db.execute(conversation_query(user_a, user_b, before_id, limit=limit)).scalars().all())
+        if len(messages) < limit:
+            oldest = messages[-1].id if messages else before_id
+            messages += read_archive(user_a, user_b, before_id=oldest, limit=limit - len(messages))
+        return messages
+    hot = list(db.execute(conversation_query(user_a, user_b, after_id=after_id, limit=limit)).scalars().all())
+    archived = read_archive(user_a, user_b, after_id=after_id, limit=limit)
+    if hot:
+        archived = [message for message in archived if message.id < hot[0].id]
+    return (archived + hot)[:limit]
+
+
+def with_read_state(messages, watermarks: Dict[Tuple[int, int], int]) -> List[MessageOut]:
+    """根据会话的已读水位填充 is_read（messages 表中的 is_read 列已不再维护）"""
+    result = []
+    for message in messages:
+        out = MessageOut.model_validate(message)
+        out.is_read = is_read(message, watermarks)
+        result.append(out)
+    return result
+
+
 @router.get("/history", response_model=List[MessageOut])
 def get_message_history(
+    response: Response,
     user_id: int = Query(..., description="对方用户id"),
     limit: int = 20,
     offset: int = 0,
+    before_id: Optional[int] = Query(None, description="只返回 id 小于该值的消息（向前翻页）"),
+    after_id: Optional[int] = Query(None, description="只返回 id 大于该值的消息（拉取新消息）"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标"),
     db: Session = Depends(get_db),
     current_user=Depends(get_current_user),
 ):
-    messages = (
-        db.query(Message)
-        .filter(
-            ((Message.from_id == current_user.id) & (Message.to_id == user_id))
-            | ((Message.from_id == user_id) & (Message.to_id == current_user.id))
-        )
-        .order_by(Message.created_at.desc())
-        .offset(offset)
-        .limit(limit)
+    """
+    获取与某个用户的聊天记录，结果按时间从新到旧排列
+
+    推荐使用游标分页：结果满一页时响应头 X-Next-Cursor 会带上下一页的游标。
+    offset 参数仅为兼容旧客户端保留。
+    """
+    if cursor:
+        try:
+            direction, cursor_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if direction == "before":
+            before_id = cursor_id
+        else:
+            after_id = cursor_id
+    if after_id is not None and before_id is not None:
+        raise HTTPException(status_code=400, detail="before_id and after_id are mutually exclusive")
+
+    if before_id is None and after_id is None and offset:
+        # 兼容旧的 offset 分页
+        messages = conversation_page(db, current_user.id, user_id, limit=offset + limit)[offset:]
+    else:
+        messages = conversation_page(db, current_user.id, user_id, before_id, after_id, limit)
+
+    if after_id is not None:
+        # 向后拉取时按 id 升序查询，返回前统一为从新到旧
+        messages = list(reversed(messages))
+        if len(messages) == limit:
+            response.headers["X-Next-Cursor"] = encode_cursor("after", messages[0].id)
+    elif len(messages) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor("before", messages[-1].id)
+    watermarks = {(owner, peer): mark for owner, peer, mark in db.execute(watermarks_query(current_user.id, user_id))}
+    return with_read_state(messages, watermarks)
+
+
+@router.get("/conversations", response_model=List[ConversationOut])
+def list_conversations(
+    response: Response,
+    limit: int = 20,
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标"),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    """会话列表：每个会话的最后一条消息和未读数，按最后消息时间倒序"""
+    query = (
+        select(Conversation)
+        .options(joinedload(Conversation.peer))
+        .where(Conversation.owner_id == current_user.id)
+    )
+    if cursor:
+        try:
+            direction, cursor_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if direction != "before":
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(Conversation.last_message_id < cursor_id)
+    conversations = (
+        db.execute(query.order_by(Conversation.last_message_id.desc()).limit(limit))
+        .scalars()
         .all()
     )
-    return messages
+    if len(conversations) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor("before", conversations[-1].last_message_id)
+    return conversations
+
+
+@router.get("/search", response_model=List[MessageOut])
+def search(
+    response: Response,
+    q: str = Query(..., description=f"关键词，多个关键词用空格分隔，每个至少 {SEARCH_MIN_TERM_LENGTH} 个字符"),
+    user_id: Optional[int] = Query(None, description="只在与该用户的会话中检索"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标"),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    """
+    全文检索自己参与的聊天消息，按相关度排序（相同时新消息在前）
+
+    结果满一页时响应头 X-Next-Cursor 会带上下一页的游标。
+    """
+    try:
+        match = match_expression(q)
+    except ValueError:
+        raise HTTPException(
+            status_code=400, detail=f"每个关键词至少需要 {SEARCH_MIN_TERM_LENGTH} 个字符"
+        )
+    after = None
+    if cursor:
+        try:
+            after = decode_rank_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    hits = search_messages(db, current_user.id, match, peer_id=user_id, after=after, limit=limit)
+    if not hits:
+        return []
+    if len(hits) == limit:
+        response.headers["X-Next-Cursor"] = encode_rank_cursor(hits[-1][1], hits[-1][0])
+    by_id = {
+        message.id: message
+        for message in db.execute(select(Message).where(Message.id.in_([message_id for message_id, _ in hits]))).scalars()
+    }
+    messages = [by_id[message_id] for message_id, _ in hits if message_id in by_id]
+    peer_ids = {message.to_id if message.from_id == current_user.id else message.from_id for message in messages}
+    watermarks = {
+        (owner, peer): mark for owner, peer, mark in db.execute(peer_watermarks_query(current_user.id, peer_ids))
+    }
+    return with_read_state(messages, watermarks)
 
 
 @router.get("/unread", response_model=List[MessageOut])
 def get_unread_messages(
     db: Session = Depends(get_db), current_user=Depends(get_current_user)
 ):
-    messages = (
-        db.query(Message)
-        .filter(Message.to_id == current_user.id, Message.is_read == False)
-        .order_by(Message.created_at.asc())
-        .all()
-    )
-    return messages
+    # 各会话已读水位之后的消息即为未读
+    messages = db.execute(unread_messages_query(current_user.id)).scalars().all()
+    return with_read_state(messages, {})
+
+
+def iter_unread_messages(owner_id: int) -> Iterator[MessageOut]:
+    # 会话在生成器内打开，响应发送完（或客户端断开）后关闭
+    with SessionLocal() as db:
+        result = db.execute(unread_messages_query(owner_id).execution_options(yield_per=STREAM_BATCH_SIZE))
+        for messages in result.scalars().partitions():
+            yield from with_read_state(messages, {})
+
+
+def iter_conversation(user_a: int, user_b: int) -> Iterator[MessageOut]:
+    """两人会话的全部消息（含归档），从旧到新；按 id 分批读取，热表部分每批都走 ix_messages_from_to_id 索引"""
+    with SessionLocal() as db:
+        watermarks = {(owner, peer): mark for owner, peer, mark in db.execute(watermarks_query(user_a, user_b))}
+        after_id = 0
+        while True:
+            messages = conversation_page(db, user_a, user_b, after_id=after_id, limit=STREAM_BATCH_SIZE)
+            yield from with_read_state(messages, watermarks)
+            if len(messages) < STREAM_BATCH_SIZE:
+                return
+            after_id = messages[-1].id
+
+
+@router.get("/unread/stream")
+def stream_unread_messages(
+    output: str = Query("ndjson", alias="format", pattern="^(ndjson|json)$", description="ndjson 或 json"),
+    current_user=Depends(get_current_user),
+):
+    """流式返回全部未读消息，内存占用与未读条数无关"""
+    return stream_items(iter_unread_messages(current_user.id), output)
+
+
+@router.get("/export")
+def export_conversation(
+    user_id: int = Query(..., description="对方用户id"),
+    output: str = Query("ndjson", alias="format", pattern="^(ndjson|json)$", description="ndjson 或 json"),
+    gzip: bool = Query(False, description="是否输出 gzip 压缩文件"),
+    current_user=Depends(get_current_user),
+):
+    """导出与某个用户的完整聊天记录（从旧到新），作为附件流式下载"""
+    filename = f"conversation-{current_user.id}-{user_id}.{output}"
+    return stream_items(iter_conversation(current_user.id, user_id), output, filename=filename, compress=gzip)
 
 
 @router.post("/send", response_model=MessageOut)
-def send_message(
+async def send_message(
     message_data: MessageSend,
-    db: Session = Depends(get_db),
     current_user=Depends(get_current_user)
 ):
     """
@@ -86,27 +296,23 @@ def send_message(
         image_name=message_data.image_name
     )
     
-    db.add(new_message)
-    db.commit()
-    db.refresh(new_message)
+    # 与 WebSocket 共用写入管线
+    await message_writer.submit(new_message)
     
     return new_message
 
 
 @router.post("/read")
 def mark_messages_read(
-    from_id: int, db: Session = Depends(get_db), current_user=Depends(get_current_user)
+    from_id: int,
+    up_to_id: Optional[int] = Query(None, description="只标记 id 不超过该值的消息，默认全部"),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
 ):
-    messages = (
-        db.query(Message)
-        .filter(
-            Message.from_id == from_id,
-            Message.to_id == current_user.id,
-            Message.is_read == False,
-        )
-        .all()
-    )
-    for msg in messages:
-        msg.is_read = True
+    # 推进已读水位，一条 UPDATE 完成，与未读条数无关
+    before = db.execute(unread_count_query(current_user.id, from_id)).scalar() or 0
+    row = db.execute(read_watermark_update(current_user.id, from_id, up_to_id)).first()
     db.commit()
-    return {"updated": len(messages)}
+    if row is None:
+        return {"updated": 0, "last_read_message_id": 0}
+    return {"updated": max(before - row.unread_count, 0), "last_read_message_id": row.last_read_message_id}
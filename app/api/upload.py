@@ -1,12 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from sqlalchemy.orm import Session
-from app.core.database import get_db
-from app.core.security import get_current_user
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import exists, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.database import get_async_db
+from app.core.image_store import (
+    IMAGE_DIR, blob_upsert, blob_url, find_blob, normalize_url, release_blob, touch_blob,
+)
+from app.core.derivatives import derivative_urls, derivatives
+from app.core.security import UserSnapshot, get_current_user
+from app.models.group import GroupMessage
+from app.models.image import ImageBlob
+from app.models.message import Message
 from app.models.user import User
+from app.utils.upload_stream import InvalidUpload, UploadTooLarge, receive_file
+from typing import Optional
+import asyncio
 import os
-import shutil
-from datetime import datetime
-import uuid
 
 router = APIRouter()
 
@@ -18,75 +26,118 @@ ALLOWED_IMAGE_TYPES = {
 
 # 最大文件大小 (5MB)
 MAX_FILE_SIZE = 5 * 1024 * 1024
+# multipart 边界和字段头部的长度余量
+MULTIPART_OVERHEAD = 16 * 1024
 
-@router.post("/upload-image")
+@router.post(
+    "/upload-image",
+    # 请求体由接口自行流式解析，这里补充文档中的表单字段
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {"file": {"type": "string", "format": "binary"}},
+                        "required": ["file"],
+                    }
+                }
+            },
+        }
+    },
+)
 async def upload_image(
-    file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    上传图片文件
+    上传图片文件（流式写入，超过大小限制立即中止）
+
+    图片按内容哈希存储，相同内容只保存一份。去重以收到的文件内容计算的哈希为准，
+    不接受客户端声明的哈希：否则只凭哈希就能探测服务端是否有某个文件、拿到他人图片的地址。
     """
-    # 验证文件类型
-    if file.content_type not in ALLOWED_IMAGE_TYPES:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"不支持的文件类型: {file.content_type}"
-        )
-    
-    # 验证文件大小
-    file_size = 0
-    for chunk in file.file:
-        file_size += len(chunk)
-        if file_size > MAX_FILE_SIZE:
+    # 请求体声明的长度已超限时直接拒绝（预留 multipart 头部的开销）
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_FILE_SIZE + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=400, detail="图片大小不能超过 5MB")
+
+    def check_type(filename: str, content_type: str):
+        # 验证文件类型（在写入数据之前）
+        if content_type not in ALLOWED_IMAGE_TYPES:
             raise HTTPException(
                 status_code=400, 
-                detail="图片大小不能超过 5MB"
+                detail=f"不支持的文件类型: {content_type}"
             )
-    
-    # 重置文件指针
-    await file.seek(0)
-    
-    # 生成唯一文件名
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    file_extension = file.filename.split(".")[-1] if "." in file.filename else "jpg"
-    unique_filename = f"{timestamp}_{current_user.id}_{uuid.uuid4().hex[:8]}.{file_extension}"
-    
+
     # 创建上传目录
-    upload_dir = "uploads/images"
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    # 保存文件
-    file_path = os.path.join(upload_dir, unique_filename)
-    
+    os.makedirs(IMAGE_DIR, exist_ok=True)
+
+    try:
+        upload = await receive_file(request, "file", IMAGE_DIR, MAX_FILE_SIZE, on_headers=check_type)
+    except UploadTooLarge:
+        raise HTTPException(
+            status_code=400, 
+            detail="图片大小不能超过 5MB"
+        )
+    except InvalidUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except OSError as e:
+        raise HTTPException(
+            status_code=500, 
+            detail=f"文件保存失败: {str(e)}"
+        )
+
+    sha256 = upload.sha256
+    blob = await find_blob(db, sha256)
+    # 已有相同内容：丢弃临时文件（文件被误删时用这次上传补回）
+    if blob and await asyncio.to_thread(os.path.exists, blob.url):
+        await upload.discard()
+        await db.execute(touch_blob(sha256))
+        await db.commit()
+        return _upload_response(blob, upload.filename, deduplicated=True)
+
+    # 保存文件：临时文件原子重命名到按哈希命名的最终路径
+    image_url = blob.url if blob else blob_url(sha256, upload.filename)
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await asyncio.to_thread(os.makedirs, os.path.dirname(image_url), exist_ok=True)
+        await upload.commit(image_url)
     except Exception as e:
+        await upload.discard()
         raise HTTPException(
             status_code=500, 
             detail=f"文件保存失败: {str(e)}"
         )
-    
+    await db.execute(blob_upsert(sha256, image_url, upload.size, upload.content_type))
+    await db.commit()
+    # 缩略图和预览图在后台生成，不阻塞本次请求
+    derivatives.enqueue(image_url)
+    blob = await find_blob(db, sha256)
+    return _upload_response(blob, upload.filename, deduplicated=False)
+
+def _upload_response(blob: ImageBlob, image_name: Optional[str], deduplicated: bool):
     # 返回文件信息 - 只返回相对路径
-    image_url = f"uploads/images/{unique_filename}"
-    
     return {
-        "image_url": image_url,
-        "image_name": file.filename,
-        "file_size": file_size,
-        "content_type": file.content_type
+        "image_url": blob.url,
+        "image_name": image_name,
+        "file_size": blob.size,
+        "content_type": blob.content_type,
+        "sha256": blob.sha256,
+        "deduplicated": deduplicated,
+        **derivative_urls(blob.url),
     }
 
 @router.delete("/delete-image")
 async def delete_image(
     image_url: str,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     删除图片文件
+
+    仍被消息或头像引用的图片会保留；没有引用的图片由后台回收任务删除。
     """
     # 验证图片URL格式 - 支持相对路径和绝对路径
     if not (image_url.startswith("uploads/images/") or image_url.startswith("/uploads/images/")):
@@ -95,8 +146,10 @@ async def delete_image(
             detail="无效的图片URL"
         )
     
-    # 构建文件路径
-    file_path = image_url.lstrip("/")
+    # 构建文件路径（不允许跳出图片目录）
+    file_path = normalize_url(image_url)
+    if os.path.commonpath([os.path.abspath(file_path), os.path.abspath(IMAGE_DIR)]) != os.path.abspath(IMAGE_DIR):
+        raise HTTPException(status_code=400, detail="无效的图片URL")
     
     # 检查文件是否存在
     if not os.path.exists(file_path):
@@ -104,13 +157,33 @@ async def delete_image(
             status_code=404, 
             detail="图片文件不存在"
         )
-    
+
+    result = await db.execute(select(ImageBlob.sha256).where(ImageBlob.url == file_path))
+    sha256 = result.scalar()
+    if sha256 is not None:
+        result = await db.execute(release_blob(sha256))
+        await db.commit()
+        if result.rowcount == 0:
+            return {"message": "图片仍被引用，已保留"}
+        return {"message": "图片删除成功"}
+
+    # 尚未迁移到哈希存储的旧文件：检查消息和头像是否仍在使用
+    result = await db.execute(
+        select(
+            exists().where(Message.image_url.in_([file_path, "/" + file_path]))
+            | exists().where(GroupMessage.image_url.in_([file_path, "/" + file_path]))
+            | exists().where(User.avatar.in_([file_path, "/" + file_path]))
+        )
+    )
+    if result.scalar():
+        return {"message": "图片仍被引用，已保留"}
+
     # 删除文件
     try:
-        os.remove(file_path)
+        await asyncio.to_thread(os.remove, file_path)
         return {"message": "图片删除成功"}
     except Exception as e:
         raise HTTPException(
             status_code=500, 
             detail=f"图片删除失败: {str(e)}"
-        )
\ No newline at end of file
+        )
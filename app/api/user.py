@@ -1,9 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.schemas.user import UserCreate, UserOut, UserUpdate, UserLogin
 from app.models.user import User
-from app.core.database import SessionLocal
-from app.core.security import get_password_hash, verify_password, get_current_user, create_access_token
+from app.core.database import SessionLocal, get_async_db
+from app.core.image_store import avatar_image_refs
+from app.core.security import authenticate_user, get_current_user, create_access_token, password_hasher, principal_cache
 
 router = APIRouter()
 
@@ -15,15 +18,16 @@ def get_db():
         db.close()
 
 @router.post("/register", response_model=UserOut)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.username == user.username).first()
-    if db_user:
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(User).where(User.username == user.username))
+    if result.scalars().first():
         raise HTTPException(status_code=400, detail="Username already registered")
     if user.email:
-        db_email = db.query(User).filter(User.email == user.email).first()
-        if db_email:
+        result = await db.execute(select(User).where(User.email == user.email))
+        if result.scalars().first():
             raise HTTPException(status_code=400, detail="Email already registered")
-    hashed_password = get_password_hash(user.password)
+    # 哈希在专用线程池中计算，繁忙时返回 503
+    hashed_password = await password_hasher.hash(user.password)
     new_user = User(
         username=user.username,
         hashed_password=hashed_password,
@@ -33,30 +37,44 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
         gender=user.gender
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.flush()
+    if new_user.avatar:
+        for stmt in avatar_image_refs(new_user.id, new_user.avatar):
+            await db.execute(stmt)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 @router.post("/login")
-def login(user: UserLogin, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.username == user.username).first()
-    if not db_user or not verify_password(user.password, db_user.hashed_password):
+async def login(user: UserLogin, db: AsyncSession = Depends(get_async_db)):
+    db_user = await authenticate_user(db, user.username, user.password)
+    if not db_user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
     # 生成 access_token
     access_token = create_access_token({"sub": db_user.username})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/me", response_model=UserOut)
-def get_my_info(current_user=Depends(get_current_user)):
-    return current_user
+def get_my_info(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+    # current_user 是缓存的快照，这里读取完整的用户信息（含在线状态）
+    user = db.query(User).filter(User.id == current_user.id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
 
 @router.put("/me", response_model=UserOut)
 def update_my_info(user_update: UserUpdate, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
     user = db.query(User).filter(User.id == current_user.id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    for field, value in user_update.dict(exclude_unset=True).items():
+    changes = user_update.dict(exclude_unset=True)
+    for field, value in changes.items():
         setattr(user, field, value)
+    if "avatar" in changes:
+        # 头像引用与资料在同一事务内更新
+        for stmt in avatar_image_refs(user.id, user.avatar):
+            db.execute(stmt)
     db.commit()
     db.refresh(user)
+    principal_cache.invalidate_user(user.id)
     return user
@@ -1,39 +1,35 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from app.core.security import get_current_user
-from app.core.database import SessionLocal
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from app.core.security import resolve_token_async
+from app.core.database import AsyncSessionLocal
 from app.core.user_status import UserStatusManager
+from app.core.presence import presence
+from app.core.friend_cache import friend_cache
+from app.core.broker import broker
+from app.core.frames import negotiate, receive_frame
+from app.core.outbox import Outbox, metrics
+from app.core.heartbeat import heartbeat_wheel
+from app.core.message_writer import message_writer
+from app.core.conversations import read_watermark_update, unread_count_query
+from app.core.groups import group_read_update
+from app.api.group import post_group_message
+from app.core.derivatives import derivative_urls
 from app.models.message import Message
-from app.models.user import User
-from app.models.friend import Friend
-from sqlalchemy.orm import Session
-from typing import Dict, Set
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, List
 from datetime import datetime, timezone
-import json
-import asyncio
+import os
 
 router = APIRouter()
 
-active_connections: Dict[int, WebSocket] = {}
-heartbeat_tasks: Dict[int, asyncio.Task] = {}
+# 本 worker 内的连接表，跨 worker 的投递由 broker 负责
+active_connections: Dict[int, WebSocket] = broker.connections
+# batch 帧最多包含的消息数
+WS_BATCH_MAX_MESSAGES = int(os.getenv("WS_BATCH_MAX_MESSAGES", "100"))
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-async def notify_friends_status_change(user_id: int, is_online: bool, db: Session):
+async def notify_friends_status_change(user_id: int, is_online: bool, db: AsyncSession):
     """通知好友用户状态变更"""
-    # 获取所有好友
-    friends = db.query(Friend).filter(
-        (Friend.user_id == user_id) | (Friend.friend_id == user_id),
-        Friend.status == "accepted"
-    ).all()
-    
-    friend_ids = []
-    for friend in friends:
-        friend_ids.append(friend.friend_id if friend.user_id == user_id else friend.user_id)
+    # 获取所有好友（走好友关系缓存）
+    friend_ids = await friend_cache.get_friend_ids(db, user_id)
     
     # 通知在线好友
     status_message = {
@@ -43,106 +39,212 @@ async def notify_friends_status_change(user_id: int, is_online: bool, db: Sessio
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
     
-    for friend_id in friend_ids:
-        friend_ws = active_connections.get(friend_id)
-        if friend_ws:
-            try:
-                await friend_ws.send_text(json.dumps(status_message))
-            except:
-                pass
-
-async def heartbeat_handler(websocket: WebSocket, user_id: int, db: Session):
-    """心跳处理器"""
-    
-    while True:
+    # 所有好友共用一次编码结果
+    await broker.send_to_users(friend_ids, status_message)
+
+async def notify_expired_users(user_ids: List[int]):
+    """presence 超时清理后通知这些用户的好友"""
+    async with AsyncSessionLocal() as db:
+        for user_id in user_ids:
+            await notify_friends_status_change(user_id, False, db)
+
+presence.on_expire = notify_expired_users
+presence.is_connected = broker.is_online
+
+async def disconnect_user(user_id: int, websocket: WebSocket):
+    """连接断开后的下线清理，接收循环结束和心跳回收死连接时都会调用，只执行一次"""
+    if getattr(websocket.state, "disconnected", False):
+        return
+    websocket.state.disconnected = True
+    await broker.unregister(user_id, websocket)
+    # 用户已经重新连上（本 worker 或其他 worker）时不标记离线
+    if not await broker.is_online(user_id):
+        async with AsyncSessionLocal() as db:
+            await UserStatusManager(db).update_user_status(user_id, False)
+            await notify_friends_status_change(user_id, False, db)
+
+heartbeat_wheel.on_dead = disconnect_user
+
+def chat_payload(message: Message) -> dict:
+    """推送给接收方的消息内容"""
+    return {
+        "from_id": message.from_id,
+        "to_id": message.to_id,
+        "content": message.content,
+        "msg_type": message.msg_type,
+        "image_url": message.image_url,
+        "image_name": message.image_name,
+        **derivative_urls(message.image_url),
+        "created_at": message.created_at.isoformat(),
+        "id": message.id
+    }
+
+async def handle_batch(outbox: Outbox, user_id: int, msg: dict):
+    """
+    批量消息帧：{"msg_type": "batch", "batch_id": ..., "messages": [{"temp_id", "to_id", "content", "image_url", ...}]}
+
+    合法的消息在同一个事务中写入，按接收方分组各推送一个 batch 帧，
+    最后回复一个 batch_ack，把客户端的 temp_id 映射到服务端消息 id。
+    """
+    batch_id = msg.get("batch_id")
+    items = msg.get("messages")
+    if not isinstance(items, list) or len(items) > WS_BATCH_MAX_MESSAGES:
+        outbox.put({
+            "msg_type": "batch_ack",
+            "batch_id": batch_id,
+            "error": f"messages 必须是不超过 {WS_BATCH_MAX_MESSAGES} 条的列表"
+        })
+        return
+
+    accepted = []
+    errors = []
+    for item in items:
+        temp_id = item.get("temp_id") if isinstance(item, dict) else None
+        if not isinstance(item, dict) or not isinstance(item.get("to_id"), int):
+            errors.append({"temp_id": temp_id, "error": "缺少接收方"})
+            continue
+        content = item.get("content")
+        image_url = item.get("image_url")
+        if not content and not image_url:
+            errors.append({"temp_id": temp_id, "error": "消息不能为空，至少需要文本或图片"})
+            continue
+        # 消息类型与 /api/message/send 的规则一致
+        if content and image_url:
+            msg_type = "mixed"
+        elif image_url:
+            msg_type = "image"
+        else:
+            msg_type = "text"
+        accepted.append((temp_id, Message(
+            from_id=user_id,
+            to_id=item["to_id"],
+            content=content,
+            msg_type=msg_type,
+            image_url=image_url,
+            image_name=item.get("image_name"),
+            created_at=datetime.utcnow(),
+            is_read=False
+        )))
+
+    if accepted:
+        # 整批在同一个事务中写入，失败时整批都未保存
         try:
-            # 发送心跳检查
-            await asyncio.sleep(30)  # 每30秒检查一次
-            
-            # 检查连接是否仍然活跃
-            if user_id not in active_connections:
-                break
-                
-            # 发送心跳响应
-            await websocket.send_text(json.dumps({
-                "msg_type": "heartbeat_response",
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            }))
-            
-        except WebSocketDisconnect:
-            break
+            await message_writer.submit_many([message for _, message in accepted])
         except Exception as e:
-            print(f"Heartbeat error for user {user_id}: {e}")
-            break
+            print(f"Batch save error for user {user_id}: {e}")
+            outbox.put({
+                "msg_type": "batch_ack",
+                "batch_id": batch_id,
+                "error": "消息保存失败，请重试"
+            })
+            return
+
+        # 按接收方分组，每个接收方只推送一帧
+        by_recipient: Dict[int, List[dict]] = {}
+        for _, message in accepted:
+            by_recipient.setdefault(message.to_id, []).append(chat_payload(message))
+        for to_id, payloads in by_recipient.items():
+            await broker.send_to_user(to_id, {"msg_type": "batch", "from_id": user_id, "messages": payloads})
+
+    outbox.put({
+        "msg_type": "batch_ack",
+        "batch_id": batch_id,
+        "results": [
+            {"temp_id": temp_id, "id": message.id, "created_at": message.created_at.isoformat()}
+            for temp_id, message in accepted
+        ],
+        "errors": errors
+    })
 
 @router.websocket("/ws/chat/{token}")
-async def websocket_chat(websocket: WebSocket, token: str, db: Session = Depends(get_db)):
-    # 简单 token 校验，生产建议用 get_current_user 依赖
-    from jose import jwt, JWTError
-    from app.core.security import SECRET_KEY, ALGORITHM
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        user = db.query(User).filter(User.username == user_id).first()
-        if not user:
-            await websocket.close()
-            return
-    except JWTError:
+async def websocket_chat(websocket: WebSocket, token: str):
+    # 与 HTTP 接口共用 token 校验和用户缓存
+    user = await resolve_token_async(token)
+    if not user:
         await websocket.close()
         return
     
-    await websocket.accept()
-    active_connections[user.id] = websocket
-    
-    # 用户上线，更新状态并通知好友
-    status_manager = UserStatusManager(db)
-    status_manager.update_user_status(user.id, True)
-    await notify_friends_status_change(user.id, True, db)
-    
-    # 启动心跳任务
-    heartbeat_task = asyncio.create_task(heartbeat_handler(websocket, user.id, db))
-    heartbeat_tasks[user.id] = heartbeat_task
+    # 客户端可通过子协议 chat.msgpack 选择 MessagePack 二进制帧
+    await websocket.accept(subprotocol=negotiate(websocket))
+    # 发往该连接的帧都经过自己的发送队列，由独立的写任务发送
+    outbox = Outbox(websocket)
+    outbox.start()
+    connection = None
     
     try:
+        await broker.register(user.id, websocket)
+
+        # 用户上线，更新状态并通知好友
+        # 每次数据库操作使用独立的短会话，避免长连接一直占用连接池中的连接
+        async with AsyncSessionLocal() as db:
+            await UserStatusManager(db).update_user_status(user.id, True, connected=True)
+            await notify_friends_status_change(user.id, True, db)
+
+        # 由共享的时间轮定时发送心跳、回收长时间无活动的连接
+        connection = heartbeat_wheel.add(user.id, websocket, outbox)
+
         while True:
-            data = await websocket.receive_text()
-            msg = json.loads(data)
+            msg = await receive_frame(websocket)
+            heartbeat_wheel.touch(connection)
             msg_type = msg.get("msg_type", "text")
             
             if msg_type == "heartbeat":
-                # 更新用户在线状态
-                status_manager.update_user_status(user.id, True)
+                # 更新用户在线状态（仅内存，由 presence 定时写库）
+                presence.heartbeat(user.id)
                 continue  # 心跳消息处理完成
             
+            if msg_type == "read" and msg.get("group_id") is not None:
+                # 群消息已读：只推进自己的已读水位，不向群成员推送回执
+                message_ids = msg.get("message_ids", [])
+                if message_ids:
+                    async with AsyncSessionLocal() as db:
+                        await db.execute(group_read_update(msg["group_id"], user.id, max(message_ids)))
+                        await db.commit()
+                continue
+
             if msg_type == "read":
                 # 已读回执处理
                 from_id = msg.get("from_id")  # 谁发的消息
                 message_ids = msg.get("message_ids", [])
-                # 批量标记为已读
+                # 已读水位推进到本次回执中最大的消息 id（一条 UPDATE，与未读条数无关）
                 updated = 0
+                last_read_message_id = None
                 if message_ids:
-                    messages = db.query(Message).filter(
-                        Message.id.in_(message_ids),
-                        Message.from_id == from_id,
-                        Message.to_id == user.id,
-                        Message.is_read == False
-                    ).all()
-                    for m in messages:
-                        m.is_read = True
-                    db.commit()
-                    updated = len(messages)
+                    async with AsyncSessionLocal() as db:
+                        before = (await db.execute(unread_count_query(user.id, from_id))).scalar() or 0
+                        row = (await db.execute(read_watermark_update(user.id, from_id, max(message_ids)))).first()
+                        await db.commit()
+                    if row is not None:
+                        updated = max(before - row.unread_count, 0)
+                        last_read_message_id = row.last_read_message_id
                 # 推送回执给原发送方
-                from_ws = active_connections.get(from_id)
-                if from_ws:
-                    await from_ws.send_text(json.dumps({
-                        "msg_type": "read_receipt",
-                        "from_id": user.id,  # 已读方
-                        "to_id": from_id,    # 原发送方
-                        "message_ids": message_ids,
-                        "updated": updated
-                    }))
+                await broker.send_to_user(from_id, {
+                    "msg_type": "read_receipt",
+                    "from_id": user.id,  # 已读方
+                    "to_id": from_id,    # 原发送方
+                    "message_ids": message_ids,
+                    "updated": updated,
+                    # 对方已读到的位置，发送方据此把之前的消息都标为已读
+                    "last_read_message_id": last_read_message_id
+                })
                 continue
                 
+            if msg_type == "batch":
+                # 批量消息（例如断线重连后补发）
+                await handle_batch(outbox, user.id, msg)
+                continue
+                
+            if msg.get("group_id") is not None:
+                # 群消息：只存一份，推送给在线的群成员
+                try:
+                    async with AsyncSessionLocal() as db:
+                        await post_group_message(
+                            db, user.id, msg["group_id"], msg.get("content"), msg.get("image_url"), msg.get("image_name")
+                        )
+                except HTTPException as e:
+                    outbox.put({"msg_type": "error", "group_id": msg["group_id"], "detail": e.detail})
+                continue
+
             # 普通消息处理
             to_id = msg.get("to_id")
             content = msg.get("content")
@@ -160,31 +262,26 @@ async def websocket_chat(websocket: WebSocket, token: str, db: Session = Depends
                 created_at=datetime.utcnow(),
                 is_read=False
             )
-            db.add(message)
-            db.commit()
-            db.refresh(message)
+            # 交给写入管线批量提交，返回时消息已落盘
+            await message_writer.submit(message)
             # 推送给目标用户
-            to_ws = active_connections.get(to_id)
-            if to_ws:
-                await to_ws.send_text(json.dumps({
-                    "from_id": user.id,
-                    "to_id": to_id,
-                    "content": content,
-                    "msg_type": msg_type,
-                    "image_url": image_url,
-                    "image_name": image_name,
-                    "created_at": message.created_at.isoformat(),
-                    "id": message.id
-                }))
+            await broker.send_to_user(to_id, chat_payload(message))
                 
     except WebSocketDisconnect:
-        # 用户下线，更新状态并通知好友
-        active_connections.pop(user.id, None)
-        heartbeat_tasks.pop(user.id, None)
-        status_manager.update_user_status(user.id, False)
-        await notify_friends_status_change(user.id, False, db)
-        
-        # 取消心跳任务
-        if user.id in heartbeat_tasks:
-            heartbeat_tasks[user.id].cancel()
-            del heartbeat_tasks[user.id]
+        pass
+    finally:
+        # 用户下线：停止心跳和写任务（丢弃尚未发出的帧），更新状态并通知好友
+        if connection is not None:
+            heartbeat_wheel.remove(connection)
+        await outbox.stop()
+        await disconnect_user(user.id, websocket)
+
+
+@router.get("/ws/metrics")
+async def websocket_metrics():
+    """本 worker 的 WebSocket 指标：发送队列深度、合并 / 丢弃的帧数、因读取过慢或长时间无活动被断开的连接数"""
+    return {
+        **metrics(list(active_connections.values())),
+        "heartbeat_connections": len(heartbeat_wheel),
+        "idle_disconnects": heartbeat_wheel.reaped,
+    }
@@ -0,0 +1,379 @@
+"""
+冷消息归档（分层存储）
+
+超过 ARCHIVE_AFTER_DAYS 的单聊消息由后台任务从 messages 表移到按会话划分的归档段文件中，
+热表只保留近期消息，页缓存、查询和备份都不再随历史增长。
+默认不归档：归档的消息从 messages 表删除后也会从全文检索索引中删除，不再能被搜索到。
+
+目录结构：ARCHIVE_DIR/<分片>/<较小用户id>_<较大用户id>/<序号>.seg|.idx
+- .seg 只追加写：由若干压缩块组成，每块是按 id 升序的最多 ARCHIVE_BLOCK_MESSAGES 条消息
+  （msgpack 序列化后 zlib 压缩）；超过 ARCHIVE_SEGMENT_BYTES 后新开一个段
+- .idx 是稀疏索引：每块一条定长记录（首末 id、首末时间、块在 .seg 中的偏移和长度、条数），
+  读取时 mmap 后二分定位，再从 mmap 的 .seg 中只解压需要的块，倒序翻页不必扫描整个文件
+
+先追加块、fsync 后再追加索引记录，只有索引引用到的块才会被读取；
+写入前按索引截掉 .seg 尾部未完成的块，并跳过 id 不大于已归档最大 id 的消息，
+因此进程在任何时刻中断，重跑都不会产生重复或损坏的数据。
+归档文件落盘之后才从热表删除，写文件时不持有数据库写锁；两步之间中断时消息同时在两处，
+读取时以热表为准，下次归档时删除。
+
+每个会话只归档第一条未读消息（任一方向）之前的消息，未读数和未读消息仍只需查询热表；
+消息 id 与写入时间同序，因此同一会话中归档的消息 id 总是小于热表中的消息 id。
+"""
+import asyncio
+import fcntl
+import mmap
+import os
+import struct
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import msgpack
+from sqlalchemy import delete, select
+
+from app.core.conversations import first_unread_ids_query
+from app.core.database import SessionLocal
+from app.models.message import Message
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+# 消息写入多少天后归档，0 表示不归档（默认）
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+# 归档间隔（秒）
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+# 每批从热表移出的消息数（一个短的删除事务）
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "500"))
+# 每个压缩块的消息数，稀疏索引每块一条记录
+ARCHIVE_BLOCK_MESSAGES = int(os.getenv("ARCHIVE_BLOCK_MESSAGES", "256"))
+# 单个段文件的大小上限（字节）
+ARCHIVE_SEGMENT_BYTES = int(os.getenv("ARCHIVE_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+
+# 索引记录：first_id, last_id, first_at, last_at（微秒时间戳）, offset, length, count
+_INDEX_RECORD = struct.Struct("<qqqqQII")
+_EPOCH = datetime(1970, 1, 1)
+
+# 归档中每条消息保存的字段（顺序即序列化格式）
+_FIELDS = ("id", "from_id", "to_id", "content", "msg_type", "image_url", "image_name", "created_at")
+
+
+def _timestamp(value: Optional[datetime]) -> int:
+    return (value - _EPOCH) // timedelta(microseconds=1) if value else 0
+
+
+def _message_row(message: Message) -> list:
+    return [getattr(message, field) for field in _FIELDS[:-1]] + [_timestamp(message.created_at)]
+
+
+def _from_row(row: Sequence) -> Message:
+    """还原为游离（不属于任何 Session）的 Message；归档的消息都已读"""
+    values = dict(zip(_FIELDS, row))
+    values["created_at"] = _EPOCH + timedelta(microseconds=values["created_at"])
+    return Message(**values, is_read=True)
+
+
+def conversation_dir(user_a: int, user_b: int, root: str = ARCHIVE_DIR) -> str:
+    low, high = sorted((user_a, user_b))
+    return os.path.join(root, f"{low % 256:02x}", f"{low}_{high}")
+
+
+def _segment_numbers(path: str) -> List[int]:
+    try:
+        names = os.listdir(path)
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[:-4]) for name in names if name.endswith(".idx") and name[:-4].isdigit())
+
+
+def _segment_path(path: str, number: int, suffix: str) -> str:
+    return os.path.join(path, f"{number:08d}.{suffix}")
+
+
+class _Segment:
+    """只读打开的一个段：索引和数据都通过 mmap 访问"""
+
+    def __init__(self, path: str, number: int):
+        self._files = []
+        self._maps = []
+        self.index = self._map(_segment_path(path, number, "idx"))
+        self.count = len(self.index) // _INDEX_RECORD.size if self.index is not None else 0
+        self.data = self._map(_segment_path(path, number, "seg")) if self.count else None
+        if self.data is None:
+            self.count = 0
+
+    def _map(self, path: str) -> Optional[mmap.mmap]:
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        self._files.append(f)
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return mapped
+
+    def close(self):
+        for mapped in self._maps:
+            mapped.close()
+        for f in self._files:
+            f.close()
+
+    def record(self, i: int) -> Tuple[int, ...]:
+        return _INDEX_RECORD.unpack_from(self.index, i * _INDEX_RECORD.size)
+
+    def block(self, i: int) -> List[list]:
+        _, _, _, _, offset, length, _ = self.record(i)
+        return msgpack.unpackb(zlib.decompress(self.data[offset:offset + length]))
+
+    def last_block_before(self, before_id: int) -> int:
+        """最后一个首 id 小于 before_id 的块，没有时为 -1（在 mmap 的索引上二分）"""
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self.record(mid)[0] < before_id:
+                low = mid + 1
+            else:
+                high = mid
+        return low - 1
+
+    def first_block_after(self, after_id: int) -> int:
+        """第一个末 id 大于 after_id 的块，没有时为 count"""
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self.record(mid)[1] <= after_id:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+
+def _iter_newest_first(path: str, before_id: Optional[int]) -> Iterator[list]:
+    for number in reversed(_segment_numbers(path)):
+        segment = _Segment(path, number)
+        try:
+            # 首 id 不小于 before_id 的块整块跳过，从其前一块开始倒序解压
+            start = segment.count - 1 if before_id is None else segment.last_block_before(before_id)
+            for i in range(start, -1, -1):
+                for row in reversed(segment.block(i)):
+                    if before_id is None or row[0] < before_id:
+                        yield row
+        finally:
+            segment.close()
+
+
+def _iter_oldest_first(path: str, after_id: int) -> Iterator[list]:
+    for number in _segment_numbers(path):
+        segment = _Segment(path, number)
+        try:
+            for i in range(segment.first_block_after(after_id), segment.count):
+                for row in segment.block(i):
+                    if row[0] > after_id:
+                        yield row
+        finally:
+            segment.close()
+
+
+def read_archive(user_a: int, user_b: int, before_id: Optional[int] = None,
+                 after_id: Optional[int] = None, limit: int = 20, root: str = ARCHIVE_DIR) -> List[Message]:
+    """
+    两人会话归档中的一页消息，参数和排序同 conversation_query：
+    默认按 id 从新到旧（before_id 之前），指定 after_id 时按 id 从旧到新
+    """
+    path = conversation_dir(user_a, user_b, root)
+    rows = _iter_newest_first(path, before_id) if after_id is None else _iter_oldest_first(path, after_id)
+    messages = []
+    try:
+        for row in rows:
+            messages.append(_from_row(row))
+            if len(messages) >= limit:
+                break
+    finally:
+        # 关闭生成器，释放正在读取的段的 mmap
+        rows.close()
+    return messages
+
+
+def _tail(path: str, number: int) -> Tuple[int, int, int]:
+    """段的 (已归档最大 id, 有效数据长度, 有效索引长度)，并截掉未完成的写入"""
+    index_path = _segment_path(path, number, "idx")
+    data_path = _segment_path(path, number, "seg")
+    index_size = os.path.getsize(index_path) // _INDEX_RECORD.size * _INDEX_RECORD.size
+    last_id, data_size = 0, 0
+    if index_size:
+        with open(index_path, "rb") as f:
+            f.seek(index_size - _INDEX_RECORD.size)
+            _, last_id, _, _, offset, length, _ = _INDEX_RECORD.unpack(f.read(_INDEX_RECORD.size))
+        data_size = offset + length
+    _truncate(index_path, index_size)
+    _truncate(data_path, data_size)
+    return last_id, data_size, index_size
+
+
+def _truncate(file_path: str, size: int):
+    if os.path.exists(file_path) and os.path.getsize(file_path) > size:
+        os.truncate(file_path, size)
+
+
+def append_archive(user_a: int, user_b: int, messages: Sequence[Message],
+                   root: str = ARCHIVE_DIR, block_messages: int = ARCHIVE_BLOCK_MESSAGES,
+                   segment_bytes: int = ARCHIVE_SEGMENT_BYTES) -> List[int]:
+    """
+    把一个会话的消息追加到归档，返回已在归档中的消息 id：本次写入的，以及此前已归档且内容一致的
+    （归档后中断、尚未从热表删除）。id 不大于已归档最大 id、但归档中没有相同记录的消息不会写入也不会返回。
+    """
+    path = conversation_dir(user_a, user_b, root)
+    os.makedirs(path, exist_ok=True)
+    # 同一会话同时只有一个写入者（多个进程同时归档时）
+    with open(os.path.join(path, ".lock"), "wb") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return _append_locked(path, messages, block_messages, segment_bytes)
+
+
+def _append_locked(path: str, messages: Sequence[Message], block_messages: int,
+                   segment_bytes: int) -> List[int]:
+    numbers = _segment_numbers(path)
+    number = numbers[-1] if numbers else 1
+    last_id, data_size, _ = _tail(path, number) if numbers else (0, 0, 0)
+    if numbers and len(numbers) > 1 and last_id == 0:
+        # 空的最后一段（新开段后中断）：已归档最大 id 在前一段
+        last_id = _tail(path, numbers[-2])[0]
+    if data_size >= segment_bytes:
+        number, data_size = number + 1, 0
+    # 新段（或尚未写入索引的段）可能残留中断时写了一半的数据
+    _truncate(_segment_path(path, number, "seg"), data_size)
+
+    rows = sorted((_message_row(m) for m in messages if m.id > last_id), key=lambda row: row[0])
+    skipped = {m.id: _message_row(m) for m in messages if m.id <= last_id}
+    archived = _archived_ids(path, skipped) if skipped else []
+    start = 0
+    while start < len(rows):
+        if data_size >= segment_bytes:
+            number, data_size = number + 1, 0
+            _truncate(_segment_path(path, number, "seg"), 0)
+        records = []
+        with open(_segment_path(path, number, "seg"), "ab") as data:
+            while start < len(rows) and data_size < segment_bytes:
+                block = rows[start:start + block_messages]
+                start += len(block)
+                payload = zlib.compress(msgpack.packb(block))
+                data.write(payload)
+                records.append(_INDEX_RECORD.pack(
+                    block[0][0], block[-1][0], block[0][-1], block[-1][-1], data_size, len(payload), len(block)
+                ))
+                data_size += len(payload)
+            data.flush()
+            os.fsync(data.fileno())
+        with open(_segment_path(path, number, "idx"), "ab") as index:
+            index.write(b"".join(records))
+            index.flush()
+            os.fsync(index.fileno())
+    return archived + [row[0] for row in rows]
+
+
+def _archived_ids(path: str, rows: Dict[int, list]) -> List[int]:
+    """rows（id -> 归档格式的记录）中与归档里相同 id 的记录完全一致的 id"""
+    found = []
+    iterator = _iter_oldest_first(path, min(rows) - 1)
+    try:
+        for row in iterator:
+            if row[0] > max(rows):
+                break
+            if rows.get(row[0]) == list(row):
+                found.append(row[0])
+    finally:
+        iterator.close()
+    return found
+
+
+class MessageArchiver:
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        root: str = ARCHIVE_DIR,
+        after_days: float = ARCHIVE_AFTER_DAYS,
+        interval: float = ARCHIVE_INTERVAL,
+        batch_size: int = ARCHIVE_BATCH,
+    ):
+        self.session_factory = session_factory
+        self.root = root
+        self.after_days = after_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None and self.after_days > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.archive)
+            except Exception as e:
+                print(f"Message archive error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def archive(self) -> int:
+        """把超过期限、且在所属会话第一条未读消息之前的消息移到归档，返回移出的条数"""
+        cutoff = datetime.utcnow() - timedelta(days=self.after_days)
+        moved, after_id = 0, 0
+        while True:
+            with self.session_factory() as db:
+                # 沿主键按 id 顺序扫描一个窗口，遇到未过期的消息说明后面都未过期
+                rows = db.execute(
+                    select(Message.id, Message.from_id, Message.to_id, Message.created_at)
+                    .where(Message.id > after_id)
+                    .order_by(Message.id)
+                    .limit(self.batch_size)
+                ).all()
+                expired = [row for row in rows if row.created_at is not None and row.created_at < cutoff]
+                bounds = {}
+                for pair in {tuple(sorted((row.from_id, row.to_id))) for row in expired}:
+                    # 发给自己的消息总是已读
+                    unread = [] if pair[0] == pair[1] else db.execute(first_unread_ids_query(*pair)).one()
+                    bounds[pair] = min((i for i in unread if i is not None), default=None)
+            ids = [
+                row.id for row in expired
+                if (bound := bounds[tuple(sorted((row.from_id, row.to_id)))]) is None or row.id < bound
+            ]
+            if ids:
+                moved += self._move(ids)
+            if len(expired) < len(rows) or len(rows) < self.batch_size:
+                return moved
+            after_id = rows[-1].id
+
+    def _move(self, ids: List[int]) -> int:
+        """
+        先归档再删除：普通查询读出消息，在写事务之外追加归档文件并 fsync，
+        最后在一个短事务中从热表删除，写锁只在删除时持有。只删除确认已在归档中的消息，
+        其余的（例如与已归档消息 id 相同的）留在热表中。
+        删除失败时消息仍在热表中（归档中的副本在读取时被忽略），下次归档会跳过已归档的部分再删除。
+        """
+        with self.session_factory() as db:
+            messages = db.execute(
+                select(*(getattr(Message, f) for f in _FIELDS)).where(Message.id.in_(ids))
+            ).all()
+        by_conversation: Dict[Tuple[int, int], List] = {}
+        for message in messages:
+            by_conversation.setdefault(tuple(sorted((message.from_id, message.to_id))), []).append(message)
+        archived = []
+        for (user_a, user_b), group in by_conversation.items():
+            archived += append_archive(user_a, user_b, group, self.root)
+        if archived:
+            with self.session_factory() as db:
+                db.execute(delete(Message).where(Message.id.in_(archived)))
+                db.commit()
+        return len(archived)
+
+
+message_archiver = MessageArchiver()
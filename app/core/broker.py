@@ -0,0 +1,296 @@
+"""
+跨进程消息路由
+
+每个 worker 进程只保存本进程内的 WebSocket 连接（本地连接表），
+推送消息时先查本地连接表，不在本地则交给后端查找目标用户所在的
+worker 并转发过去。
+
+后端：
+- memory: 单进程（默认），只做本地投递
+- sqlite: 同一台机器上的多个 worker 通过共享 SQLite 文件交换消息
+
+新增后端（例如 Redis）只需继承 MessageBroker 并实现
+_claim / _release / _forward / _has_route 四个方法，在后台任务中把收到的消息
+交给 _deliver_local 即可。
+
+通过环境变量 CHAT_BROKER 选择后端，CHAT_BROKER_PATH 指定 SQLite 文件路径。
+"""
+import asyncio
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from fastapi import WebSocket
+
+from app.core.frames import Frame, as_frame, send_frame
+from app.core.outbox import outbox_for
+
+CHAT_BROKER = os.getenv("CHAT_BROKER", "memory")
+CHAT_BROKER_PATH = os.getenv("CHAT_BROKER_PATH", "./broker.db")
+# 轮询投递队列的间隔（秒）
+CHAT_BROKER_POLL_INTERVAL = float(os.getenv("CHAT_BROKER_POLL_INTERVAL", "0.01"))
+# worker 心跳间隔（秒），超过 WORKER_TIMEOUT 未更新的 worker 视为已退出
+WORKER_HEARTBEAT_INTERVAL = 2.0
+WORKER_TIMEOUT = 10.0
+
+
+class MessageBroker:
+    """消息路由基类，同时也是单进程（memory）后端"""
+
+    def __init__(self):
+        # 本地连接表：user_id -> WebSocket
+        self.connections: Dict[int, WebSocket] = {}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def register(self, user_id: int, websocket: WebSocket):
+        """登记本地连接，并声明该用户归属本 worker"""
+        self.connections[user_id] = websocket
+        await self._claim(user_id)
+
+    async def unregister(self, user_id: int, websocket: Optional[WebSocket] = None):
+        """移除本地连接；传入 websocket 时只在仍是同一连接时移除（防止覆盖重连）"""
+        if websocket is not None and self.connections.get(user_id) is not websocket:
+            return
+        self.connections.pop(user_id, None)
+        await self._release(user_id)
+
+    def is_local(self, user_id: int) -> bool:
+        return user_id in self.connections
+
+    async def is_online(self, user_id: int) -> bool:
+        """用户在本 worker 或其他存活的 worker 上是否有连接"""
+        return self.is_local(user_id) or await self._has_route(user_id)
+
+    async def send_to_user(self, user_id: int, payload: Union[Frame, Dict[str, Any]]) -> bool:
+        """推送给指定用户，返回是否成功投递（或已转发给所属 worker）"""
+        frame = as_frame(payload)
+        websocket = self.connections.get(user_id)
+        if websocket is not None:
+            return await self._deliver_local(websocket, frame)
+        return await self._forward(user_id, frame)
+
+    async def send_to_users(self, user_ids: Iterable[int], payload: Union[Frame, Dict[str, Any]]):
+        """推送给多个用户，所有接收方共用同一个 Frame，每种编码只序列化一次"""
+        frame = as_frame(payload)
+        remote = []
+        for user_id in user_ids:
+            websocket = self.connections.get(user_id)
+            if websocket is not None:
+                await self._deliver_local(websocket, frame)
+            else:
+                remote.append(user_id)
+        if remote:
+            await self._forward_many(remote, frame)
+
+    async def _deliver_local(self, websocket: WebSocket, frame: Frame) -> bool:
+        # 放入连接自己的发送队列，不等待接收方
+        outbox = outbox_for(websocket)
+        if outbox is not None:
+            return outbox.put(frame)
+        try:
+            await send_frame(websocket, frame)
+            return True
+        except Exception:
+            return False
+
+    # 以下为后端扩展点，单进程后端无需实现
+    async def _claim(self, user_id: int):
+        pass
+
+    async def _release(self, user_id: int):
+        pass
+
+    async def _forward(self, user_id: int, frame: Frame) -> bool:
+        return False
+
+    async def _has_route(self, user_id: int) -> bool:
+        return False
+
+    async def _forward_many(self, user_ids: List[int], frame: Frame):
+        # 后端可以覆盖为批量查找路由
+        for user_id in user_ids:
+            await self._forward(user_id, frame)
+
+
+class SQLiteBroker(MessageBroker):
+    """基于共享 SQLite 文件的多进程后端，适用于单机多 worker 部署"""
+
+    def __init__(self, path: str = CHAT_BROKER_PATH, poll_interval: float = CHAT_BROKER_POLL_INTERVAL):
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def _execute(self, sql: str, params: tuple = (), fetch: bool = False):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            rows = cursor.fetchall() if fetch else None
+            self._conn.commit()
+            return rows
+
+    async def _run(self, sql: str, params: tuple = (), fetch: bool = False):
+        # sqlite3 调用放到线程中执行，避免阻塞事件循环
+        return await asyncio.to_thread(self._execute, sql, params, fetch)
+
+    def _forward_rows(self, user_ids: List[int], payload: str):
+        """一次查出这些用户所在的 worker，只为有路由的（在线）用户写入投递队列"""
+        with self._lock:
+            placeholders = ",".join("?" * len(user_ids))
+            routes = self._conn.execute(
+                f"""
+                SELECT r.user_id, r.worker_id FROM bus_routes r
+                JOIN bus_workers w ON w.worker_id = r.worker_id
+                WHERE r.user_id IN ({placeholders}) AND w.last_seen > ? AND r.worker_id != ?
+                """,
+                (*user_ids, time.time() - WORKER_TIMEOUT, self.worker_id),
+            ).fetchall()
+            if routes:
+                self._conn.executemany(
+                    "INSERT INTO bus_queue (worker_id, user_id, payload) VALUES (?, ?, ?)",
+                    [(worker_id, user_id, payload) for user_id, worker_id in routes],
+                )
+            self._conn.commit()
+
+    async def _forward_many(self, user_ids: List[int], frame: Frame):
+        # SQLite 单条语句的参数个数有限，分批查询
+        for start in range(0, len(user_ids), 500):
+            await asyncio.to_thread(self._forward_rows, user_ids[start:start + 500], frame.json())
+
+    async def start(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS bus_workers (
+                worker_id TEXT PRIMARY KEY,
+                last_seen REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS bus_routes (
+                user_id INTEGER PRIMARY KEY,
+                worker_id TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS bus_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                worker_id TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                payload TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_bus_queue_worker ON bus_queue (worker_id, id);
+        """)
+        await self._heartbeat()
+        self._task = asyncio.create_task(self._poll_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._conn:
+            await self._run("DELETE FROM bus_routes WHERE worker_id = ?", (self.worker_id,))
+            await self._run("DELETE FROM bus_queue WHERE worker_id = ?", (self.worker_id,))
+            await self._run("DELETE FROM bus_workers WHERE worker_id = ?", (self.worker_id,))
+            self._conn.close()
+            self._conn = None
+
+    async def _heartbeat(self):
+        await self._run(
+            "INSERT OR REPLACE INTO bus_workers (worker_id, last_seen) VALUES (?, ?)",
+            (self.worker_id, time.time()),
+        )
+
+    async def _claim(self, user_id: int):
+        await self._run(
+            "INSERT OR REPLACE INTO bus_routes (user_id, worker_id) VALUES (?, ?)",
+            (user_id, self.worker_id),
+        )
+
+    async def _release(self, user_id: int):
+        await self._run(
+            "DELETE FROM bus_routes WHERE user_id = ? AND worker_id = ?",
+            (user_id, self.worker_id),
+        )
+
+    async def _has_route(self, user_id: int) -> bool:
+        rows = await self._run(
+            """
+            SELECT 1 FROM bus_routes r
+            JOIN bus_workers w ON w.worker_id = r.worker_id
+            WHERE r.user_id = ? AND w.last_seen > ?
+            """,
+            (user_id, time.time() - WORKER_TIMEOUT),
+            fetch=True,
+        )
+        return bool(rows)
+
+    async def _forward(self, user_id: int, frame: Frame) -> bool:
+        rows = await self._run(
+            """
+            SELECT r.worker_id FROM bus_routes r
+            JOIN bus_workers w ON w.worker_id = r.worker_id
+            WHERE r.user_id = ? AND w.last_seen > ?
+            """,
+            (user_id, time.time() - WORKER_TIMEOUT),
+            fetch=True,
+        )
+        if not rows or rows[0][0] == self.worker_id:
+            return False
+        await self._run(
+            "INSERT INTO bus_queue (worker_id, user_id, payload) VALUES (?, ?, ?)",
+            (rows[0][0], user_id, frame.json()),
+        )
+        return True
+
+    async def _poll_loop(self):
+        """拉取发往本 worker 的消息并投递给本地连接"""
+        last_heartbeat = time.monotonic()
+        while True:
+            rows = None
+            try:
+                rows = await self._run(
+                    "SELECT id, user_id, payload FROM bus_queue WHERE worker_id = ? ORDER BY id LIMIT 500",
+                    (self.worker_id,),
+                    fetch=True,
+                )
+                if rows:
+                    await self._run(
+                        "DELETE FROM bus_queue WHERE worker_id = ? AND id <= ?",
+                        (self.worker_id, rows[-1][0]),
+                    )
+                    for _, user_id, payload in rows:
+                        websocket = self.connections.get(user_id)
+                        if websocket is not None:
+                            await self._deliver_local(websocket, Frame.from_json(payload))
+
+                if time.monotonic() - last_heartbeat >= WORKER_HEARTBEAT_INTERVAL:
+                    await self._heartbeat()
+                    last_heartbeat = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Broker poll error: {e}")
+            if not rows:
+                await asyncio.sleep(self.poll_interval)
+
+
+def create_broker(kind: str = CHAT_BROKER) -> MessageBroker:
+    if kind == "memory":
+        return MessageBroker()
+    if kind == "sqlite":
+        return SQLiteBroker()
+    raise ValueError(f"Unknown CHAT_BROKER backend: {kind}")
+
+
+broker = create_broker()
@@ -0,0 +1,167 @@
+"""
+会话列表读模型的维护
+
+这里只生成 SQL 语句，由调用方在写消息 / 标记已读的同一个事务中执行，
+同步 Session 和 AsyncSession 都可以使用。
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, func, select, update
+from sqlalchemy.dialects.sqlite import insert
+
+from app.models.conversation import Conversation
+from app.models.message import Message
+
+PREVIEW_LENGTH = 50
+
+
+def message_preview(message: Message) -> str:
+    """会话列表中显示的消息摘要"""
+    if message.content:
+        return message.content[:PREVIEW_LENGTH]
+    if message.image_url:
+        return "[图片]"
+    return ""
+
+
+def conversation_upserts(messages: Iterable[Message]) -> List:
+    """
+    新消息写入后需要执行的会话更新语句（消息必须已 flush，拿到 id）
+
+    同一批里同一对用户只生成一条 upsert：最后一条消息取 id 最大的，
+    接收方一侧的未读数加上本批发给他的消息数。
+    """
+    # (owner_id, peer_id) -> [最后一条消息, 新增未读数]
+    pairs: Dict[Tuple[int, int], list] = {}
+    for message in messages:
+        if not isinstance(message, Message):
+            continue
+        for owner_id, peer_id, unread in (
+            (message.from_id, message.to_id, 0),
+            (message.to_id, message.from_id, 1),
+        ):
+            if unread and owner_id == peer_id:
+                continue  # 发给自己的消息不计未读
+            entry = pairs.setdefault((owner_id, peer_id), [message, 0])
+            if message.id > entry[0].id:
+                entry[0] = message
+            entry[1] += unread
+
+    statements = []
+    for (owner_id, peer_id), (last, unread) in pairs.items():
+        stmt = insert(Conversation).values(
+            owner_id=owner_id,
+            peer_id=peer_id,
+            last_message_id=last.id,
+            last_from_id=last.from_id,
+            last_msg_type=last.msg_type,
+            last_preview=message_preview(last),
+            last_at=last.created_at,
+            unread_count=unread,
+        )
+        # 并发写入时只让更新的消息覆盖“最后一条消息”
+        is_newer = stmt.excluded.last_message_id > Conversation.last_message_id
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Conversation.owner_id, Conversation.peer_id],
+            set_={
+                column: case((is_newer, getattr(stmt.excluded, column)), else_=getattr(Conversation, column))
+                for column in ("last_message_id", "last_from_id", "last_msg_type", "last_preview", "last_at")
+            } | {"unread_count": Conversation.unread_count + stmt.excluded.unread_count},
+        )
+        statements.append(stmt)
+    return statements
+
+
+def read_watermark_update(owner_id: int, peer_id: int, up_to_id: Optional[int] = None):
+    """
+    推进已读水位：owner 已读 peer 发来的、id 不超过 up_to_id 的全部消息（None 表示到最后一条）
+
+    水位只前进不后退，未读数按新水位重新计算（全部已读时直接为 0，否则走
+    ix_messages_from_to_id 统计水位之后的消息）。返回新的水位和未读数。
+    """
+    latest = Conversation.last_message_id
+    target = latest if up_to_id is None else func.min(up_to_id, latest)
+    watermark = func.max(Conversation.last_read_message_id, target)
+    remaining = (
+        select(func.count())
+        .select_from(Message)
+        .where(Message.from_id == peer_id, Message.to_id == owner_id, Message.id > watermark)
+        .scalar_subquery()
+    )
+    return (
+        update(Conversation)
+        .where(Conversation.owner_id == owner_id, Conversation.peer_id == peer_id)
+        .values(
+            last_read_message_id=watermark,
+            unread_count=case((watermark >= latest, 0), else_=remaining),
+        )
+        .returning(Conversation.last_read_message_id, Conversation.unread_count)
+    )
+
+
+def unread_count_query(owner_id: int, peer_id: int):
+    return select(Conversation.unread_count).where(
+        Conversation.owner_id == owner_id, Conversation.peer_id == peer_id
+    )
+
+
+def watermarks_query(user_a: int, user_b: int):
+    """两人会话双方的已读水位：返回 (owner_id, peer_id, last_read_message_id)"""
+    return select(Conversation.owner_id, Conversation.peer_id, Conversation.last_read_message_id).where(
+        ((Conversation.owner_id == user_a) & (Conversation.peer_id == user_b))
+        | ((Conversation.owner_id == user_b) & (Conversation.peer_id == user_a))
+    )
+
+
+def peer_watermarks_query(user_id: int, peer_ids: Iterable[int]):
+    """user 与多个对方之间各会话双方的已读水位：返回 (owner_id, peer_id, last_read_message_id)"""
+    peer_ids = list(peer_ids)
+    return select(Conversation.owner_id, Conversation.peer_id, Conversation.last_read_message_id).where(
+        ((Conversation.owner_id == user_id) & Conversation.peer_id.in_(peer_ids))
+        | (Conversation.owner_id.in_(peer_ids) & (Conversation.peer_id == user_id))
+    )
+
+
+def first_unread_ids_query(user_a: int, user_b: int):
+    """
+    两人会话两个方向上各自第一条未读消息的 id（该方向全部已读时为 NULL），
+    每个方向都是沿 ix_messages_from_to_id 的一次定位
+    """
+    def first_unread(from_id: int, to_id: int):
+        watermark = (
+            select(Conversation.last_read_message_id)
+            .where(Conversation.owner_id == to_id, Conversation.peer_id == from_id)
+            .scalar_subquery()
+        )
+        return (
+            select(func.min(Message.id))
+            .where(Message.from_id == from_id, Message.to_id == to_id, Message.id > func.coalesce(watermark, 0))
+            .scalar_subquery()
+        )
+
+    return select(first_unread(user_a, user_b), first_unread(user_b, user_a))
+
+
+def unread_messages_query(owner_id: int):
+    """owner 所有会话中水位之后的消息（只扫描有未读的会话）"""
+    return (
+        select(Message)
+        .join(
+            Conversation,
+            (Conversation.owner_id == Message.to_id) & (Conversation.peer_id == Message.from_id),
+        )
+        .where(
+            Conversation.owner_id == owner_id,
+            Conversation.peer_id != owner_id,
+            Conversation.unread_count > 0,
+            Message.id > Conversation.last_read_message_id,
+        )
+        .order_by(Message.id.asc())
+    )
+
+
+def is_read(message: Message, watermarks: Dict[Tuple[int, int], int]) -> bool:
+    """消息是否已被接收方读过：watermarks 为 (owner_id, peer_id) -> 已读水位"""
+    if message.from_id == message.to_id:
+        return True
+    return message.id <= watermarks.get((message.to_id, message.from_id), 0)
@@ -1,18 +1,244 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.util import await_only
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from app.models.user import Base
 from app.models.friend import Friend  # 确保表被创建
 from app.models.message import Message  # 新增消息表
+from app.models.conversation import Conversation  # 会话列表
+from app.models.image import ImageBlob, ImageRef  # 图片去重存储
+from app.models.group import Group, GroupMember, GroupMessage  # 群聊
+from app.core.search import ensure_search_index
+from app.core.migrations import connect as migration_connect, mark_applied
+from app.migrations import MIGRATIONS
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./app.db"
+# 异步驱动（aiosqlite），供 WebSocket 等协程内使用，避免阻塞事件循环
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./app.db"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 引擎配置：default 为单个默认引擎（开发用）；production 启用 WAL 和连接参数调优，读写分离
+DB_PROFILE = os.getenv("DB_PROFILE", "default")
+# 以下参数只在 production 配置下生效
+# 每个连接的内存映射大小（字节）
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# 每个连接的页缓存，负数表示 KiB
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+# 遇到锁时的等待时间（毫秒）
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+# 只读连接池大小
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "8"))
+# 等待写连接的超时（秒）
+DB_WRITE_TIMEOUT = float(os.getenv("DB_WRITE_TIMEOUT", "30"))
+
+if DB_PROFILE not in ("default", "production"):
+    raise ValueError(f"Unknown DB_PROFILE: {DB_PROFILE}")
+
+
+def _apply_pragmas(engine: Engine, writer: bool):
+    """每个新连接建立时设置 PRAGMA；WAL 模式记录在数据库文件中，由写连接设置"""
+    pragmas = [
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size={SQLITE_CACHE_SIZE}",
+    ]
+    if writer:
+        pragmas = ["PRAGMA journal_mode=WAL", "PRAGMA synchronous=NORMAL"] + pragmas
+    else:
+        # 只读连接误执行写入时直接报错，而不是去争写锁
+        pragmas.append("PRAGMA query_only=ON")
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def _is_raw_write(clause) -> bool:
+    if not isinstance(clause, TextClause):
+        return False
+    return not clause.text.lstrip(" \t\r\n(").upper().startswith("SELECT")
+
+
+class RoutingSession(Session):
+    """
+    读写分离的 Session：查询走只读连接池，flush 和 INSERT / UPDATE / DELETE 走唯一的写连接。
+    事务中一旦写入过，之后的语句（包括查询）也走写连接，能读到自己尚未提交的写入；事务结束后恢复。
+    读写引擎通过 info 传入：{"writer": Engine, "reader": Engine}
+
+    原生 SQL（text()）只有以 SELECT 开头的才走只读连接，其余（包括 WITH ... 和 PRAGMA）一律视为写入；
+    需要在只读连接上执行的复杂查询请改用 select() 构造。
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or isinstance(clause, UpdateBase) or _is_raw_write(clause):
+            self.info["writing"] = True
+        return self.info["writer"] if self.info.get("writing") else self.info["reader"]
+
+
+class WriterLock:
+    """
+    先到先得的锁：释放时直接交给等待最久的一方，同步线程和协程交替写入时谁都不会被饿死。
+    acquire 阻塞当前线程；acquire_polling 每次检查之间调用 sleep，供协程中不阻塞事件循环地等待。
+    """
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._locked = False
+        self._waiters: deque = deque()
+
+    def _enqueue(self) -> Optional[threading.Event]:
+        """立即取得锁时返回 None，否则排队并返回交接时被 set 的 Event"""
+        with self._mutex:
+            if not self._locked:
+                self._locked = True
+                return None
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+            return waiter
+
+    def _abandon(self, waiter: threading.Event):
+        """放弃等待；锁已经交接过来时转交给下一个"""
+        with self._mutex:
+            if not waiter.is_set():
+                self._waiters.remove(waiter)
+                return
+        self.release()
+
+    def acquire(self, timeout: float) -> bool:
+        waiter = self._enqueue()
+        if waiter is None or waiter.wait(timeout):
+            return True
+        self._abandon(waiter)
+        return False
+
+    def acquire_polling(self, timeout: float, sleep: Callable[[], None]) -> bool:
+        waiter = self._enqueue()
+        if waiter is None:
+            return True
+        deadline = time.monotonic() + timeout
+        try:
+            while not waiter.is_set():
+                if time.monotonic() > deadline:
+                    self._abandon(waiter)
+                    return False
+                sleep()
+        except BaseException:
+            # 等待中的协程被取消
+            self._abandon(waiter)
+            raise
+        return True
+
+    def release(self):
+        with self._mutex:
+            if self._waiters:
+                self._waiters.popleft().set()
+            else:
+                self._locked = False
+
+
+# 同步和异步驱动各有一个写连接，两者共用这把锁：同一时刻只有一个写连接被签出，
+# 写事务在这里排队，而不是在数据库锁上等待 busy_timeout
+_writer_lock = WriterLock()
+
+
+def _serialize_writer(engine: Engine, is_async: bool):
+    """
+    签出写连接时取得 _writer_lock，归还时释放。
+    异步引擎的签出在协程中（greenlet）执行，轮询等待，不阻塞事件循环。
+    """
+
+    @event.listens_for(engine, "checkout")
+    def acquire(dbapi_connection, connection_record, connection_proxy):
+        if is_async:
+            acquired = _writer_lock.acquire_polling(DB_WRITE_TIMEOUT, lambda: await_only(asyncio.sleep(0.001)))
+        else:
+            acquired = _writer_lock.acquire(DB_WRITE_TIMEOUT)
+        if not acquired:
+            raise PoolTimeoutError("Timed out waiting for the database writer")
+        connection_record.info["writer_lock"] = True
+
+    @event.listens_for(engine, "checkin")
+    def release(dbapi_connection, connection_record):
+        if connection_record.info.pop("writer_lock", False):
+            _writer_lock.release()
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _end_writing(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("writing", None)
+
+
+if DB_PROFILE == "production":
+    # 同步、异步驱动各一个写连接，由 _writer_lock 保证同一时刻只有一个在使用，写事务不再互相争抢数据库锁
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=DB_WRITE_TIMEOUT,
+    )
+    read_engine = create_engine(
+        SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}, pool_size=DB_READ_POOL_SIZE
+    )
+    async_engine = create_async_engine(
+        ASYNC_SQLALCHEMY_DATABASE_URL, pool_size=1, max_overflow=0, pool_timeout=DB_WRITE_TIMEOUT
+    )
+    async_read_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, pool_size=DB_READ_POOL_SIZE)
+    _apply_pragmas(engine, writer=True)
+    _apply_pragmas(read_engine, writer=False)
+    _apply_pragmas(async_engine.sync_engine, writer=True)
+    _apply_pragmas(async_read_engine.sync_engine, writer=False)
+    _serialize_writer(engine, is_async=False)
+    _serialize_writer(async_engine.sync_engine, is_async=True)
+
+    SessionLocal = sessionmaker(
+        autocommit=False, autoflush=False, class_=RoutingSession,
+        info={"writer": engine, "reader": read_engine},
+    )
+    # expire_on_commit=False：提交后仍可直接读取对象属性，不会触发隐式的同步加载
+    AsyncSessionLocal = async_sessionmaker(
+        class_=AsyncSession, sync_session_class=RoutingSession, autoflush=False, expire_on_commit=False,
+        info={"writer": async_engine.sync_engine, "reader": async_read_engine.sync_engine},
+    )
+else:
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    )
+    read_engine = engine
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+    async_read_engine = async_engine
+    # expire_on_commit=False：提交后仍可直接读取对象属性，不会触发隐式的同步加载
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+    )
 
 # 创建表
+_new_database = not inspect(engine).get_table_names()
 Base.metadata.create_all(bind=engine)
+# 消息全文检索的索引表和触发器
+ensure_search_index(engine)
+if _new_database:
+    # 新建的数据库已是最新结构，所有迁移记为已执行
+    _conn = migration_connect(engine.url.database)
+    try:
+        mark_applied(_conn, MIGRATIONS)
+    finally:
+        _conn.close()
 
 # 依赖注入
 def get_db():
@@ -21,3 +247,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# 异步依赖注入
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,150 @@
+"""
+聊天图片的缩略图和预览图
+
+上传完成后把生成任务交给专用线程池，不占用请求处理；
+派生图按原图文件名保存为 uploads/derived/<variant>/<xx>/<stem>.webp，地址可以直接由原图地址推出。
+功能上线前上传的图片没有派生图，第一次被请求时再生成（见 app/api/media.py）。
+"""
+import asyncio
+import glob
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from PIL import Image, ImageOps
+
+from app.core.image_store import IMAGE_DIR, image_gc, normalize_url
+
+DERIVED_DIR = "uploads/derived"
+# 派生图规格：最长边（像素）和 WebP 质量
+VARIANTS = {
+    "thumb": (256, 70),
+    "preview": (1280, 80),
+}
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", "2"))
+# 排队中的生成任务上限，超出时跳过，等到第一次请求时再生成
+DERIVATIVE_QUEUE = int(os.getenv("DERIVATIVE_QUEUE", "256"))
+# 解码前拒绝像素数过大的图片（解压炸弹）
+Image.MAX_IMAGE_PIXELS = int(os.getenv("DERIVATIVE_MAX_PIXELS", str(40_000_000)))
+
+_STEM_RE = re.compile(r"^[\w\-]+$")
+# Pillow 无法处理的格式不生成派生图
+_UNSUPPORTED_SUFFIXES = {".svg"}
+
+
+def image_stem(image_url: Optional[str]) -> Optional[str]:
+    """本地存储的图片返回文件名（不含扩展名），其他地址返回 None"""
+    if not image_url:
+        return None
+    path = normalize_url(image_url)
+    if not path.startswith(IMAGE_DIR + "/"):
+        return None
+    stem, suffix = os.path.splitext(os.path.basename(path))
+    if suffix.lower() in _UNSUPPORTED_SUFFIXES or not _STEM_RE.match(stem):
+        return None
+    return stem
+
+
+def derivative_path(stem: str, variant: str) -> str:
+    return f"{DERIVED_DIR}/{variant}/{stem[:2]}/{stem}.webp"
+
+
+def derivative_urls(image_url: Optional[str]) -> Dict[str, Optional[str]]:
+    """原图对应的缩略图和预览图地址（相对路径，与 image_url 一致）"""
+    stem = image_stem(image_url)
+    if stem is None:
+        return {"thumbnail_url": None, "preview_url": None}
+    return {
+        "thumbnail_url": derivative_path(stem, "thumb"),
+        "preview_url": derivative_path(stem, "preview"),
+    }
+
+
+def derived_files(image_url: str) -> List[str]:
+    stem = image_stem(image_url)
+    if stem is None:
+        return []
+    return [derivative_path(stem, variant) for variant in VARIANTS]
+
+
+def find_source(stem: str) -> Optional[str]:
+    """根据文件名找到原图：哈希存储目录或旧的平铺目录"""
+    if not _STEM_RE.match(stem):
+        return None
+    for pattern in (f"{IMAGE_DIR}/{stem[:2]}/{stem}.*", f"{IMAGE_DIR}/{stem}.*"):
+        for path in glob.glob(pattern):
+            if os.path.splitext(path)[1].lower() not in _UNSUPPORTED_SUFFIXES:
+                return path
+    return None
+
+
+def render_derivatives(source: str, stem: str):
+    """生成全部派生图（在线程池中执行）；写临时文件后原子重命名"""
+    with Image.open(source) as image:
+        # 动图取第一帧；按 EXIF 方向摆正
+        image.seek(0)
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "P") else "RGB")
+        for variant, (max_edge, quality) in VARIANTS.items():
+            path = derivative_path(stem, variant)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            derived = image.copy()
+            derived.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            derived.save(temp_path, "WEBP", quality=quality, method=4)
+            os.replace(temp_path, path)
+
+
+class DerivativeGenerator:
+    def __init__(self, workers: int = DERIVATIVE_WORKERS, max_pending: int = DERIVATIVE_QUEUE):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="derivatives")
+        # 正在生成的图片，同一张图的并发请求共用一个任务
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.failed = 0
+
+    def enqueue(self, image_url: str):
+        """上传完成后调用：后台生成派生图，不等待结果"""
+        stem = image_stem(image_url)
+        if stem is None or stem in self._pending or len(self._pending) >= self.max_pending:
+            return
+        source = normalize_url(image_url)
+        self._submit(stem, source)
+
+    async def ensure(self, stem: str) -> bool:
+        """确保派生图已生成（按需生成旧图片的派生图），原图不存在或无法解码时返回 False"""
+        if not _STEM_RE.match(stem):
+            return False
+        future = self._pending.get(stem)
+        if future is None:
+            if all(os.path.exists(derivative_path(stem, variant)) for variant in VARIANTS):
+                return True
+            source = await asyncio.to_thread(find_source, stem)
+            if source is None:
+                return False
+            future = self._pending.get(stem) or self._submit(stem, source)
+        try:
+            await asyncio.shield(future)
+        except Exception:
+            return False
+        return True
+
+    def _submit(self, stem: str, source: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().run_in_executor(self._executor, render_derivatives, source, stem)
+        self._pending[stem] = future
+        future.add_done_callback(lambda f: self._done(stem, f))
+        return future
+
+    def _done(self, stem: str, future: asyncio.Future):
+        self._pending.pop(stem, None)
+        if not future.cancelled() and future.exception() is not None:
+            self.failed += 1
+            print(f"Derivative generation failed for {stem}: {future.exception()}")
+
+
+derivatives = DerivativeGenerator()
+
+# 原图被回收时一并删除派生图
+image_gc.derived_files = derived_files
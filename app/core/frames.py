@@ -0,0 +1,96 @@
+"""
+WebSocket 帧的编码
+
+推送内容包装成 Frame，每种编码只计算一次：广播给多个接收方时复用同一份编码结果，
+跨 worker 转发的 JSON 文本也直接复用，不再反序列化后重新编码。
+
+客户端在握手时通过 Sec-WebSocket-Protocol 协商编码：
+- chat.json（默认）：JSON 文本帧
+- chat.msgpack：MessagePack 二进制帧，体积更小、解析更快
+无论协商结果如何，服务端都接受 JSON 文本帧和 MessagePack 二进制帧。
+"""
+from typing import Any, Dict, Optional, Union
+
+import msgpack
+import orjson
+from fastapi import WebSocket, WebSocketDisconnect
+
+CODEC_JSON = "json"
+CODEC_MSGPACK = "msgpack"
+# 子协议 -> 编码
+SUBPROTOCOLS = {
+    "chat.json": CODEC_JSON,
+    "chat.msgpack": CODEC_MSGPACK,
+}
+
+
+class Frame:
+    """一条待推送的消息，按编码缓存序列化结果"""
+
+    __slots__ = ("_payload", "_json", "_msgpack")
+
+    def __init__(self, payload: Optional[Dict[str, Any]] = None, json_text: Optional[str] = None):
+        self._payload = payload
+        self._json = json_text
+        self._msgpack: Optional[bytes] = None
+
+    @classmethod
+    def from_json(cls, json_text: str) -> "Frame":
+        """由已编码的 JSON 构造（跨 worker 转发），只有需要其他编码时才解析"""
+        return cls(json_text=json_text)
+
+    @property
+    def payload(self) -> Dict[str, Any]:
+        if self._payload is None:
+            self._payload = orjson.loads(self._json)
+        return self._payload
+
+    def json(self) -> str:
+        if self._json is None:
+            self._json = orjson.dumps(self._payload).decode()
+        return self._json
+
+    def msgpack(self) -> bytes:
+        if self._msgpack is None:
+            self._msgpack = msgpack.packb(self.payload)
+        return self._msgpack
+
+
+def as_frame(payload: Union[Frame, Dict[str, Any]]) -> Frame:
+    return payload if isinstance(payload, Frame) else Frame(payload)
+
+
+def negotiate(websocket: WebSocket) -> Optional[str]:
+    """
+    按客户端给出的顺序选择第一个支持的子协议，记录该连接的编码。
+    返回值传给 websocket.accept(subprotocol=...)；客户端没有请求子协议时为 None。
+    """
+    for subprotocol in websocket.scope.get("subprotocols") or []:
+        codec = SUBPROTOCOLS.get(subprotocol)
+        if codec is not None:
+            websocket.state.frame_codec = codec
+            return subprotocol
+    websocket.state.frame_codec = CODEC_JSON
+    return None
+
+
+def connection_codec(websocket: WebSocket) -> str:
+    return getattr(websocket.state, "frame_codec", CODEC_JSON)
+
+
+async def send_frame(websocket: WebSocket, payload: Union[Frame, Dict[str, Any]]):
+    frame = as_frame(payload)
+    if connection_codec(websocket) == CODEC_MSGPACK:
+        await websocket.send_bytes(frame.msgpack())
+    else:
+        await websocket.send_text(frame.json())
+
+
+async def receive_frame(websocket: WebSocket) -> Dict[str, Any]:
+    """接收一帧并解码：文本帧按 JSON、二进制帧按 MessagePack 解析"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    if message.get("bytes") is not None:
+        return msgpack.unpackb(message["bytes"])
+    return orjson.loads(message["text"])
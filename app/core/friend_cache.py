@@ -0,0 +1,133 @@
+"""
+好友关系缓存
+
+user_id -> 已接受好友 id 的有序数组（array，内存紧凑），按需从 friends 表加载，
+LRU 淘汰，条目数上限 FRIEND_CACHE_MAX_USERS。
+
+本 worker 内的好友关系变更（接受、拒绝、申请）会直接更新或失效缓存；
+其他 worker 的变更通过 FRIEND_CACHE_TTL 过期后重新加载来感知。
+"""
+import asyncio
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.friend import Friend
+
+FRIEND_CACHE_MAX_USERS = int(os.getenv("FRIEND_CACHE_MAX_USERS", "10000"))
+FRIEND_CACHE_TTL = float(os.getenv("FRIEND_CACHE_TTL", "300"))
+
+
+class FriendGraphCache:
+    def __init__(self, max_users: int = FRIEND_CACHE_MAX_USERS, ttl: float = FRIEND_CACHE_TTL):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Tuple[array, float]]" = OrderedDict()
+        # 同步接口会在线程池中调用，修改缓存需要加锁
+        self._lock = threading.Lock()
+        # 每次失效递增，加载期间发生过失效的结果不写入缓存
+        self._generation = 0
+        self._loading: Dict[int, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, user_id: int) -> Optional[array]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[1] > self.ttl:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[0]
+
+    def _store(self, user_id: int, friend_ids: array):
+        with self._lock:
+            self._entries[user_id] = (friend_ids, time.monotonic())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    async def get_friend_ids(self, db: AsyncSession, user_id: int) -> array:
+        """获取用户的好友 id（升序数组），未命中时从数据库加载"""
+        friend_ids = self._lookup(user_id)
+        if friend_ids is not None:
+            self.hits += 1
+            return friend_ids
+        self.misses += 1
+
+        # 同一用户的并发未命中只查一次库
+        loading = self._loading.get(user_id)
+        if loading is not None:
+            return await asyncio.shield(loading)
+        future = asyncio.get_running_loop().create_future()
+        self._loading[user_id] = future
+        try:
+            generation = self._generation
+            friend_ids = await self._load(db, user_id)
+            if generation == self._generation:
+                self._store(user_id, friend_ids)
+            future.set_result(friend_ids)
+            return friend_ids
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            del self._loading[user_id]
+
+    async def _load(self, db: AsyncSession, user_id: int) -> array:
+        result = await db.execute(
+            select(Friend.user_id, Friend.friend_id).where(
+                Friend.status == "accepted",
+                (Friend.user_id == user_id) | (Friend.friend_id == user_id),
+            )
+        )
+        # 接受申请时会插入反向记录，这里去重
+        peers = {b if a == user_id else a for a, b in result.all()}
+        return array("i", sorted(peers))
+
+    def are_friends(self, user_id: int, other_id: int) -> Optional[bool]:
+        """仅查缓存；未缓存时返回 None"""
+        friend_ids = self._lookup(user_id)
+        if friend_ids is None:
+            return None
+        i = bisect_left(friend_ids, other_id)
+        return i < len(friend_ids) and friend_ids[i] == other_id
+
+    def add_friendship(self, user_id: int, other_id: int):
+        """好友申请被接受：已缓存的双方直接加边"""
+        with self._lock:
+            self._generation += 1
+            for a, b in ((user_id, other_id), (other_id, user_id)):
+                entry = self._entries.get(a)
+                if entry is None:
+                    continue
+                friend_ids = entry[0]
+                i = bisect_left(friend_ids, b)
+                if i == len(friend_ids) or friend_ids[i] != b:
+                    # 复制后再修改，不影响正在遍历旧数组的调用方
+                    friend_ids = array("i", friend_ids)
+                    insort(friend_ids, b)
+                    self._entries[a] = (friend_ids, entry[1])
+
+    def invalidate(self, *user_ids: int):
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+
+friend_cache = FriendGraphCache()
@@ -0,0 +1,122 @@
+"""
+群聊的读写（读扩散）
+
+群消息只在 group_messages 中存一份，写入时只更新群本身的最后一条消息，
+不为每个成员写收件箱；成员的未读数在读取时由其已读水位之后的群消息数得出，
+标记已读只更新该成员的一行水位。
+
+与 conversations.py 一样，这里只生成 SQL 语句，同步 Session 和 AsyncSession 都可以使用。
+"""
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import case, func, select, update
+
+from app.core.broker import broker
+from app.core.conversations import message_preview
+from app.core.derivatives import derivative_urls
+from app.models.group import Group, GroupMember, GroupMessage
+
+# 单个群的成员上限
+GROUP_MAX_MEMBERS = 500
+
+
+def group_updates(messages: Iterable[GroupMessage]) -> List:
+    """新群消息写入后需要执行的语句：每个群一条 UPDATE，只让更新的消息覆盖最后一条消息"""
+    latest: Dict[int, GroupMessage] = {}
+    for message in messages:
+        if not isinstance(message, GroupMessage):
+            continue
+        current = latest.get(message.group_id)
+        if current is None or message.id > current.id:
+            latest[message.group_id] = message
+
+    return [
+        update(Group)
+        .where(Group.id == group_id, Group.last_message_id < last.id)
+        .values(
+            last_message_id=last.id,
+            last_from_id=last.from_id,
+            last_msg_type=last.msg_type,
+            last_preview=message_preview(last),
+            last_at=last.created_at,
+        )
+        for group_id, last in latest.items()
+    ]
+
+
+def group_read_update(group_id: int, user_id: int, up_to_id: Optional[int] = None):
+    """推进成员的已读水位（只前进不后退，不超过群的最后一条消息），返回新的水位"""
+    latest = select(Group.last_message_id).where(Group.id == group_id).scalar_subquery()
+    target = latest if up_to_id is None else func.min(up_to_id, latest)
+    return (
+        update(GroupMember)
+        .where(GroupMember.group_id == group_id, GroupMember.user_id == user_id)
+        .values(last_read_message_id=func.max(GroupMember.last_read_message_id, target))
+        .returning(GroupMember.last_read_message_id)
+    )
+
+
+def unread_count_expr(user_id: int):
+    """成员在某个群的未读数（关联 GroupMember），走 ix_group_messages_group_id 统计水位之后的消息"""
+    unread = (
+        select(func.count())
+        .select_from(GroupMessage)
+        .where(
+            GroupMessage.group_id == GroupMember.group_id,
+            GroupMessage.id > GroupMember.last_read_message_id,
+            GroupMessage.from_id != user_id,
+        )
+        .scalar_subquery()
+    )
+    # 全部已读时不必统计
+    return case((GroupMember.last_read_message_id >= Group.last_message_id, 0), else_=unread)
+
+
+def my_groups_query(user_id: int):
+    """用户加入的群，附带未读数和已读水位，按最后消息倒序"""
+    return (
+        select(Group, unread_count_expr(user_id), GroupMember.last_read_message_id)
+        .join(GroupMember, GroupMember.group_id == Group.id)
+        .where(GroupMember.user_id == user_id)
+        .order_by(Group.last_message_id.desc(), Group.id.desc())
+    )
+
+
+def member_ids_query(group_id: int):
+    return select(GroupMember.user_id).where(GroupMember.group_id == group_id)
+
+
+def group_history_query(group_id: int, before_id: Optional[int] = None,
+                        after_id: Optional[int] = None, limit: int = 20):
+    """群聊历史的一页（默认按 id 从新到旧，after_id 时从旧到新），直接走 (group_id, id) 索引"""
+    query = select(GroupMessage).where(GroupMessage.group_id == group_id)
+    if before_id is not None:
+        query = query.where(GroupMessage.id < before_id)
+    if after_id is not None:
+        query = query.where(GroupMessage.id > after_id)
+    newest_first = after_id is None
+    return query.order_by(GroupMessage.id.desc() if newest_first else GroupMessage.id.asc()).limit(limit)
+
+
+def group_message_payload(message: GroupMessage) -> dict:
+    """推送给群成员的消息内容，与单聊消息相比以 group_id 代替 to_id"""
+    return {
+        "group_id": message.group_id,
+        "from_id": message.from_id,
+        "content": message.content,
+        "msg_type": message.msg_type,
+        "image_url": message.image_url,
+        "image_name": message.image_name,
+        **derivative_urls(message.image_url),
+        "created_at": message.created_at.isoformat(),
+        "id": message.id
+    }
+
+
+async def deliver_group_message(message: GroupMessage, member_ids: Sequence[int]):
+    """
+    推送给群成员（发送方除外）：所有成员共用一次编码，只有持有连接的在线成员会收到，
+    离线成员上线后通过历史接口按已读水位拉取
+    """
+    recipients = [user_id for user_id in member_ids if user_id != message.from_id]
+    await broker.send_to_users(recipients, group_message_payload(message))
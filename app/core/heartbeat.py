@@ -0,0 +1,145 @@
+"""
+WebSocket 心跳与死连接回收
+
+所有连接共用一个后台任务，按时间轮调度：一圈为一个心跳间隔，分成若干槽，
+连接登记时放进当前槽，之后每转一圈被检查一次。登记、注销、刷新活跃时间都是 O(1)，
+不再为每个连接创建一个循环 sleep 的任务。
+
+检查到连接时：
+- 超过 WS_IDLE_TIMEOUT 没有收到客户端任何帧，视为死连接：关闭连接并调用 on_dead 做下线清理
+- 否则通过发送队列推送一帧 heartbeat_response
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Optional, Set
+
+from fastapi import WebSocket
+
+from app.core.frames import Frame
+from app.core.outbox import WS_CLOSE_TIMEOUT, Outbox
+
+# 心跳间隔（秒）
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "30"))
+# 超过该时间未收到客户端任何帧则断开（秒）
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "90"))
+# 时间轮的槽数，每个槽的时长为 WS_HEARTBEAT_INTERVAL / WS_HEARTBEAT_SLOTS
+WS_HEARTBEAT_SLOTS = int(os.getenv("WS_HEARTBEAT_SLOTS", "30"))
+IDLE_CLOSE_CODE = 1000
+
+
+class Connection:
+    __slots__ = ("user_id", "websocket", "outbox", "last_activity", "slot")
+
+    def __init__(self, user_id: int, websocket: WebSocket, outbox: Outbox, slot: int):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.outbox = outbox
+        self.last_activity = time.monotonic()
+        self.slot = slot
+
+
+class HeartbeatWheel:
+    def __init__(
+        self,
+        interval: float = WS_HEARTBEAT_INTERVAL,
+        idle_timeout: float = WS_IDLE_TIMEOUT,
+        slots: int = WS_HEARTBEAT_SLOTS,
+    ):
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.tick = interval / slots
+        self._slots: List[Set[Connection]] = [set() for _ in range(slots)]
+        # 下一个要检查的槽
+        self._cursor = 0
+        # 回收死连接后的清理（例如注销连接、标记离线），参数为 (user_id, websocket)
+        self.on_dead: Optional[Callable[[int, WebSocket], Awaitable[None]]] = None
+        self.reaped = 0
+        self._reaping: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return sum(len(slot) for slot in self._slots)
+
+    def add(self, user_id: int, websocket: WebSocket, outbox: Outbox) -> Connection:
+        # 放进刚检查过的槽，一个完整的间隔后第一次心跳
+        slot = (self._cursor - 1) % len(self._slots)
+        connection = Connection(user_id, websocket, outbox, slot)
+        self._slots[slot].add(connection)
+        return connection
+
+    def remove(self, connection: Connection):
+        self._slots[connection.slot].discard(connection)
+
+    @staticmethod
+    def touch(connection: Connection):
+        """收到客户端的帧时调用"""
+        connection.last_activity = time.monotonic()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._reaping):
+            task.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            next_tick += self.tick
+            await asyncio.sleep(max(next_tick - loop.time(), 0))
+            try:
+                self.advance()
+            except Exception as e:
+                print(f"Heartbeat error: {e}")
+
+    def advance(self):
+        """检查当前槽中的连接并转到下一个槽"""
+        slot = self._slots[self._cursor]
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        if not slot:
+            return
+        now = time.monotonic()
+        frame = None
+        for connection in list(slot):
+            if now - connection.last_activity > self.idle_timeout or connection.outbox.closed:
+                slot.discard(connection)
+                self._reap(connection)
+                continue
+            if frame is None:
+                # 同一槽内的连接共用一帧，只编码一次
+                frame = Frame({"msg_type": "heartbeat_response", "timestamp": datetime.now(timezone.utc).isoformat()})
+            connection.outbox.put(frame)
+
+    def _reap(self, connection: Connection):
+        self.reaped += 1
+        task = asyncio.create_task(self._close(connection))
+        self._reaping.add(task)
+        task.add_done_callback(self._reaping.discard)
+
+    async def _close(self, connection: Connection):
+        try:
+            await asyncio.wait_for(
+                connection.websocket.close(code=IDLE_CLOSE_CODE, reason="idle timeout"),
+                timeout=WS_CLOSE_TIMEOUT,
+            )
+        except Exception:
+            pass
+        if self.on_dead is not None:
+            try:
+                await self.on_dead(connection.user_id, connection.websocket)
+            except Exception as e:
+                print(f"Heartbeat cleanup error for user {connection.user_id}: {e}")
+
+
+heartbeat_wheel = HeartbeatWheel()
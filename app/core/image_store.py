@@ -0,0 +1,191 @@
+"""
+内容寻址的图片存储
+
+图片按 sha256 保存为 uploads/images/<前两位>/<sha256>.<ext>，相同内容只落盘一次。
+image_refs 记录哪些消息 / 头像引用了哪张图片；引用语句与消息、用户资料的写入在同一事务中执行。
+没有任何引用、且超过宽限期未被重新上传的图片由后台任务分批回收。
+"""
+import asyncio
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, List, Optional
+
+from sqlalchemy import delete, exists, literal, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import AsyncSessionLocal
+from app.models.group import GroupMessage
+from app.models.image import ImageBlob, ImageRef
+from app.models.message import Message
+
+IMAGE_DIR = "uploads/images"
+# 回收间隔（秒）
+IMAGE_GC_INTERVAL = float(os.getenv("IMAGE_GC_INTERVAL", "600"))
+# 上传后尚未被消息引用的宽限期（秒）
+IMAGE_GC_GRACE = float(os.getenv("IMAGE_GC_GRACE", "86400"))
+# 每批回收的图片数
+IMAGE_GC_BATCH = int(os.getenv("IMAGE_GC_BATCH", "500"))
+
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+_EXT_RE = re.compile(r"^[0-9a-z]{1,10}$")
+
+
+def is_sha256(value: Optional[str]) -> bool:
+    return bool(value) and bool(_SHA256_RE.match(value))
+
+
+def normalize_url(image_url: str) -> str:
+    """消息里的图片地址可能带前导 /，统一为相对路径"""
+    return image_url.lstrip("/")
+
+
+def blob_url(sha256: str, filename: str) -> str:
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if not _EXT_RE.match(extension):
+        extension = "jpg"
+    return f"{IMAGE_DIR}/{sha256[:2]}/{sha256}.{extension}"
+
+
+async def find_blob(db: AsyncSession, sha256: str) -> Optional[ImageBlob]:
+    result = await db.execute(select(ImageBlob).where(ImageBlob.sha256 == sha256))
+    return result.scalars().first()
+
+
+def touch_blob(sha256: str):
+    """重新上传已有内容时刷新时间，避免在宽限期内被回收"""
+    return update(ImageBlob).where(ImageBlob.sha256 == sha256).values(last_uploaded_at=datetime.utcnow())
+
+
+def blob_upsert(sha256: str, url: str, size: int, content_type: Optional[str]):
+    now = datetime.utcnow()
+    stmt = insert(ImageBlob).values(
+        sha256=sha256, url=url, size=size, content_type=content_type, created_at=now, last_uploaded_at=now
+    )
+    return stmt.on_conflict_do_update(index_elements=[ImageBlob.sha256], set_={"last_uploaded_at": now})
+
+
+def _ref_insert(ref_type: str, ref_id: int, image_url: str):
+    # 只有存储在 image_blobs 中的图片才记录引用（外部链接等忽略）
+    return insert(ImageRef).from_select(
+        ["sha256", "ref_type", "ref_id", "created_at"],
+        select(ImageBlob.sha256, literal(ref_type), literal(ref_id), literal(datetime.utcnow())).where(
+            ImageBlob.url == normalize_url(image_url)
+        ),
+    ).on_conflict_do_nothing()
+
+
+def message_image_refs(messages: Iterable[Message]) -> List:
+    """新消息写入后需要执行的图片引用语句（消息必须已 flush，拿到 id）"""
+    stmts = []
+    for message in messages:
+        if not message.image_url:
+            continue
+        if isinstance(message, Message):
+            stmts.append(_ref_insert("message", message.id, message.image_url))
+        elif isinstance(message, GroupMessage):
+            stmts.append(_ref_insert("group_message", message.id, message.image_url))
+    return stmts
+
+
+def avatar_image_refs(user_id: int, avatar: Optional[str]) -> List:
+    """用户头像变更时替换头像引用"""
+    stmts = [delete(ImageRef).where(ImageRef.ref_type == "avatar", ImageRef.ref_id == user_id)]
+    if avatar:
+        stmts.append(_ref_insert("avatar", user_id, avatar))
+    return stmts
+
+
+def _unreferenced():
+    return ~exists().where(ImageRef.sha256 == ImageBlob.sha256)
+
+
+def release_blob(sha256: str):
+    """
+    客户端删除图片：没有引用时让其立即过期，由下一轮回收删除文件。
+
+    不直接删除文件，是因为其他用户可能刚上传了相同内容、还没发出消息；
+    那种情况下对方的上传会刷新时间，图片不会被回收。
+    """
+    return update(ImageBlob).where(ImageBlob.sha256 == sha256, _unreferenced()).values(
+        last_uploaded_at=datetime(1970, 1, 1)
+    )
+
+
+def _remove_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class ImageGarbageCollector:
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        interval: float = IMAGE_GC_INTERVAL,
+        grace: float = IMAGE_GC_GRACE,
+        batch_size: int = IMAGE_GC_BATCH,
+    ):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.grace = grace
+        self.batch_size = batch_size
+        # 原图 -> 需要一并删除的派生文件（缩略图等）
+        self.derived_files: Optional[Callable[[str], List[str]]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.collect()
+            except Exception as e:
+                print(f"Image GC error: {e}")
+
+    async def collect(self) -> int:
+        """回收没有引用且超过宽限期的图片，返回删除的数量"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.grace)
+        removed = 0
+        while True:
+            candidates = (
+                select(ImageBlob.sha256)
+                .where(ImageBlob.last_uploaded_at < cutoff, _unreferenced())
+                .limit(self.batch_size)
+            )
+            async with self.session_factory() as db:
+                # 删除时再次检查条件，期间新增引用或重新上传的图片不会被删
+                result = await db.execute(
+                    delete(ImageBlob)
+                    .where(ImageBlob.sha256.in_(candidates), ImageBlob.last_uploaded_at < cutoff, _unreferenced())
+                    .returning(ImageBlob.url)
+                )
+                urls = list(result.scalars().all())
+                await db.commit()
+            if urls:
+                paths = list(urls)
+                if self.derived_files is not None:
+                    for url in urls:
+                        paths.extend(self.derived_files(url))
+                await asyncio.to_thread(_remove_files, paths)
+            removed += len(urls)
+            if len(urls) < self.batch_size:
+                return removed
+
+
+image_gc = ImageGarbageCollector()
@@ -0,0 +1,122 @@
+"""
+消息写入管线（group commit）
+
+所有连接提交的消息先进入同一个队列，由后台任务按批次写库：
+攒够 MESSAGE_BATCH_SIZE 条或等待超过 MESSAGE_BATCH_LATENCY_MS 毫秒即提交一次事务。
+提交成功后才唤醒调用方，此时消息的 id 和 created_at 已经确定，
+调用方再推送给接收方，保证推送出去的消息一定已经落盘。
+"""
+import asyncio
+import os
+from datetime import datetime
+from typing import List, Optional, Sequence
+
+from app.core.database import AsyncSessionLocal
+from app.core.conversations import conversation_upserts
+from app.core.groups import group_updates
+from app.core.image_store import message_image_refs
+
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "256"))
+MESSAGE_BATCH_LATENCY_MS = float(os.getenv("MESSAGE_BATCH_LATENCY_MS", "5"))
+
+
+class MessageWriter:
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        batch_size: int = MESSAGE_BATCH_SIZE,
+        max_latency_ms: float = MESSAGE_BATCH_LATENCY_MS,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.max_latency = max_latency_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务，队列中剩余的消息会先写完"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, row):
+        """提交一条消息，等待提交成功后返回（id、created_at 已填充）"""
+        rows = await self.submit_many([row])
+        return rows[0]
+
+    async def submit_many(self, rows: Sequence) -> List:
+        """提交多条消息，保证它们在同一个事务中写入"""
+        if self._task is None:
+            await self.start()
+        rows = list(rows)
+        for row in rows:
+            if getattr(row, "created_at", None) is None:
+                row.created_at = datetime.utcnow()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((rows, future))
+        await future
+        return rows
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            count = len(item[0])
+            deadline = loop.time() + self.max_latency
+            # 在批次上限和延迟上限内尽量多攒一些
+            while count < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                count += len(item[0])
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        try:
+            await self._commit([row for rows, _ in batch for row in rows])
+        except Exception:
+            # 整批失败时逐项重试，避免一条坏数据拖累同批的其他消息
+            for rows, future in batch:
+                try:
+                    await self._commit(rows)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(None)
+            return
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    async def _commit(self, rows):
+        async with self.session_factory() as db:
+            db.add_all(rows)
+            await db.flush()
+            # 会话列表、群的最后一条消息、图片引用与消息在同一事务内更新
+            for stmt in conversation_upserts(rows) + group_updates(rows) + message_image_refs(rows):
+                await db.execute(stmt)
+            await db.commit()
+
+
+message_writer = MessageWriter()
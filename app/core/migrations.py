@@ -0,0 +1,314 @@
+"""
+在线、分批、可续跑的数据库版本迁移
+
+schema_migrations 记录已执行的版本，schema_migration_steps 记录每个步骤的检查点。
+一个迁移由若干步骤组成，按顺序执行，已完成的步骤不会重复执行：
+- Sql：一组语句在一个短事务中执行（建表、建索引等）
+- AddColumn：列不存在时添加（SQLite 加列只修改表结构，不重写数据）
+- Backfill：按主键范围分批执行语句，每批与检查点在同一个事务中提交
+- RebuildTable：重建表（修改列约束等）：建新表，用触发器把旧表的写入同步过去，
+  分批复制已有数据，最后在一个短事务中切换
+- Call：自定义函数，需可重复执行，并自行分批提交
+
+所有写入都在短事务（BEGIN IMMEDIATE）中进行，批与批之间让出写锁，迁移期间应用可以正常读写；
+进程中断后重新执行会从最后一个检查点继续。同一时间运行两个迁移进程也不会重复处理：
+检查点在每批的事务中读取和更新。
+"""
+import sqlite3
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+# 每批处理的主键范围
+MIGRATION_BATCH = int(os.getenv("MIGRATION_BATCH", "5000"))
+# 批与批之间的停顿（秒），给应用的写入让出时间
+MIGRATION_PAUSE = float(os.getenv("MIGRATION_PAUSE", "0.01"))
+# 等待应用释放写锁的时间（秒）
+MIGRATION_BUSY_TIMEOUT = float(os.getenv("MIGRATION_BUSY_TIMEOUT", "30"))
+
+_STATE_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR NOT NULL,
+    applied_at DATETIME NOT NULL
+);
+CREATE TABLE IF NOT EXISTS schema_migration_steps (
+    version INTEGER NOT NULL,
+    step INTEGER NOT NULL,
+    cursor INTEGER NOT NULL DEFAULT 0,
+    done BOOLEAN NOT NULL DEFAULT 0,
+    PRIMARY KEY (version, step)
+);
+"""
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """打开迁移用的连接：自动提交模式，事务由各步骤显式控制"""
+    conn = sqlite3.connect(db_path, timeout=MIGRATION_BUSY_TIMEOUT, isolation_level=None)
+    conn.executescript(_STATE_SQL)
+    return conn
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def table_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+class Progress:
+    """一个步骤的检查点；load / save 需在调用方的事务中执行"""
+
+    def __init__(self, conn: sqlite3.Connection, version: int, step: int,
+                 batch_size: int = MIGRATION_BATCH, pause: float = MIGRATION_PAUSE):
+        self.conn = conn
+        self.version = version
+        self.step = step
+        self.batch_size = batch_size
+        self.pause = pause
+
+    def load(self) -> Tuple[int, bool]:
+        row = self.conn.execute(
+            "SELECT cursor, done FROM schema_migration_steps WHERE version = ? AND step = ?",
+            (self.version, self.step),
+        ).fetchone()
+        return (row[0], bool(row[1])) if row else (0, False)
+
+    def save(self, cursor: int, done: bool = False):
+        self.conn.execute(
+            "INSERT INTO schema_migration_steps (version, step, cursor, done) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (version, step) DO UPDATE SET cursor = excluded.cursor, done = excluded.done",
+            (self.version, self.step, cursor, done),
+        )
+
+    def log(self, message: str):
+        print(f"  [{self.version}.{self.step}] {message}")
+
+
+class Step:
+    description = ""
+
+    def run(self, conn: sqlite3.Connection, progress: Progress):
+        raise NotImplementedError
+
+
+class Sql(Step):
+    def __init__(self, statements: Union[str, Sequence[str]], description: str = ""):
+        self.statements = [statements] if isinstance(statements, str) else list(statements)
+        self.description = description
+
+    def run(self, conn, progress):
+        with transaction(conn):
+            if progress.load()[1]:
+                return
+            for statement in self.statements:
+                conn.execute(statement)
+            progress.save(0, done=True)
+
+
+class AddColumn(Step):
+    def __init__(self, table: str, column: str, definition: str):
+        self.table = table
+        self.column = column
+        self.definition = definition
+        self.description = f"添加 {table}.{column} 字段"
+
+    def run(self, conn, progress):
+        with transaction(conn):
+            if self.column not in table_columns(conn, self.table):
+                conn.execute(f"ALTER TABLE {self.table} ADD COLUMN {self.column} {self.definition}")
+            progress.save(0, done=True)
+
+
+def _batches(conn: sqlite3.Connection, progress: Progress, table: str, key: str,
+             run_batch: Callable[[int, int], None]) -> bool:
+    """
+    按 key 的范围 (start, end] 分批调用 run_batch，每批一个事务并推进检查点。
+    上界每批重新读取，迁移期间新写入的行也会被处理；处理到当前最大值时返回 True。
+    步骤已完成时返回 False。
+    """
+    while True:
+        with transaction(conn):
+            cursor, done = progress.load()
+            if done:
+                return False
+            upper = conn.execute(f"SELECT MAX({key}) FROM {table}").fetchone()[0] or 0
+            if cursor >= upper:
+                return True
+            end = min(cursor + progress.batch_size, upper)
+            run_batch(cursor, end)
+            progress.save(end)
+        progress.log(f"{end} / {upper}")
+        time.sleep(progress.pause)
+
+
+class Backfill(Step):
+    """按主键范围分批执行语句，语句中用 :start、:end 表示本批的范围 (start, end]"""
+
+    def __init__(self, table: str, statements: Union[str, Sequence[str]], description: str = "", key: str = "id"):
+        self.table = table
+        self.statements = [statements] if isinstance(statements, str) else list(statements)
+        self.description = description
+        self.key = key
+
+    def run(self, conn, progress):
+        def run_batch(start: int, end: int):
+            for statement in self.statements:
+                conn.execute(statement, {"start": start, "end": end})
+
+        if _batches(conn, progress, self.table, self.key, run_batch):
+            with transaction(conn):
+                progress.save(progress.load()[0], done=True)
+
+
+class RebuildTable(Step):
+    """
+    在线重建表：create_sql 中用 {table} 表示新表名，columns 为 新列 -> 基于旧表列的表达式。
+
+    1. 创建新表，并在旧表上建触发器，把之后的插入 / 修改 / 删除同步到新表
+    2. 按主键分批 INSERT OR IGNORE 复制旧数据（已被触发器同步的行不会被旧数据覆盖）
+    3. 一个事务内：复制最后一批，删除旧表，新表改名，按原定义重建旧表上的索引和触发器
+
+    第 3 步重建索引时持有写锁，耗时与索引大小成正比，其余步骤都是短事务。
+    when 返回 False 时跳过（例如表结构已是新的）。
+    """
+
+    def __init__(self, table: str, create_sql: str, columns: Dict[str, str],
+                 when: Optional[Callable[[sqlite3.Connection], bool]] = None, key: str = "id"):
+        self.table = table
+        self.create_sql = create_sql
+        self.columns = columns
+        self.when = when
+        self.key = key
+        self.description = f"重建 {table} 表"
+        self.new_table = f"{table}__rebuild"
+
+    def _triggers(self) -> Dict[str, str]:
+        table, new, key = self.table, self.new_table, self.key
+        copy = (
+            f"INSERT OR REPLACE INTO {new} ({', '.join(self.columns)}) "
+            f"SELECT {', '.join(self.columns.values())} FROM {table} WHERE {key} = new.{key};"
+        )
+        return {
+            f"{new}_insert": f"AFTER INSERT ON {table} BEGIN {copy} END",
+            f"{new}_update": f"AFTER UPDATE ON {table} BEGIN DELETE FROM {new} WHERE {key} = old.{key}; {copy} END",
+            f"{new}_delete": f"AFTER DELETE ON {table} BEGIN DELETE FROM {new} WHERE {key} = old.{key}; END",
+        }
+
+    def _copy(self, conn: sqlite3.Connection, start: int, end: int):
+        conn.execute(
+            f"INSERT OR IGNORE INTO {self.new_table} ({', '.join(self.columns)}) "
+            f"SELECT {', '.join(self.columns.values())} FROM {self.table} "
+            f"WHERE {self.key} > :start AND {self.key} <= :end",
+            {"start": start, "end": end},
+        )
+
+    def run(self, conn, progress):
+        triggers = self._triggers()
+        with transaction(conn):
+            if progress.load()[1]:
+                return
+            if self.when is not None and not self.when(conn):
+                progress.log("无需重建，跳过")
+                progress.save(0, done=True)
+                return
+            conn.execute(self.create_sql.format(table=self.new_table))
+            for name, body in triggers.items():
+                conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+
+        if not _batches(conn, progress, self.table, self.key, lambda start, end: self._copy(conn, start, end)):
+            return
+
+        # 改名时不改写其他对象中的表名引用（索引和触发器会按原定义重建）
+        conn.execute("PRAGMA legacy_alter_table = ON")
+        try:
+            with transaction(conn):
+                cursor, done = progress.load()
+                if done:
+                    return
+                upper = conn.execute(f"SELECT MAX({self.key}) FROM {self.table}").fetchone()[0] or 0
+                if upper > cursor:
+                    self._copy(conn, cursor, upper)
+                objects = [
+                    sql for name, sql in conn.execute(
+                        "SELECT name, sql FROM sqlite_master "
+                        "WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+                        (self.table,),
+                    )
+                    if name not in triggers
+                ]
+                for name in triggers:
+                    conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+                conn.execute(f"DROP TABLE {self.table}")
+                conn.execute(f"ALTER TABLE {self.new_table} RENAME TO {self.table}")
+                for sql in objects:
+                    conn.execute(sql)
+                progress.save(upper, done=True)
+        finally:
+            conn.execute("PRAGMA legacy_alter_table = OFF")
+        progress.log("切换到新表完成")
+
+
+class Call(Step):
+    """执行自定义函数 func(conn, progress)，需可重复执行"""
+
+    def __init__(self, func: Callable[[sqlite3.Connection, Progress], None], description: str = ""):
+        self.func = func
+        self.description = description
+
+    def run(self, conn, progress):
+        with transaction(conn):
+            if progress.load()[1]:
+                return
+        self.func(conn, progress)
+        with transaction(conn):
+            progress.save(0, done=True)
+
+
+class Migration:
+    def __init__(self, version: int, name: str, steps: Sequence[Step]):
+        self.version = version
+        self.name = name
+        self.steps = list(steps)
+
+
+def applied_versions(conn: sqlite3.Connection) -> Dict[int, str]:
+    return {version: applied_at for version, applied_at in conn.execute(
+        "SELECT version, applied_at FROM schema_migrations"
+    )}
+
+
+def apply_migration(conn: sqlite3.Connection, migration: Migration,
+                    batch_size: int = MIGRATION_BATCH, pause: float = MIGRATION_PAUSE):
+    """执行一个迁移中尚未完成的步骤，全部完成后记录版本"""
+    for index, step in enumerate(migration.steps, start=1):
+        progress = Progress(conn, migration.version, index, batch_size, pause)
+        if step.description:
+            progress.log(step.description)
+        step.run(conn, progress)
+    with transaction(conn):
+        conn.execute(
+            "INSERT OR IGNORE INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+            (migration.version, migration.name, datetime.utcnow().isoformat(" ")),
+        )
+        conn.execute("DELETE FROM schema_migration_steps WHERE version = ?", (migration.version,))
+
+
+def mark_applied(conn: sqlite3.Connection, migrations: Sequence[Migration]):
+    """不执行，直接把迁移记录为已执行（数据库由当前代码新建时）"""
+    now = datetime.utcnow().isoformat(" ")
+    with transaction(conn):
+        conn.executemany(
+            "INSERT OR IGNORE INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+            [(migration.version, migration.name, now) for migration in migrations],
+        )
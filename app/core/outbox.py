@@ -0,0 +1,184 @@
+"""
+每个 WebSocket 连接的发送队列
+
+推送只把帧放入接收方的有界队列，由该连接自己的写任务发送，发送方不会被慢的接收方拖住。
+队列满时按帧类型处理：
+- 在线状态、心跳等可丢弃的帧：同一对象的状态在队列中只保留最新一条（合并），
+  队列满时丢弃最旧的可丢弃帧
+- 聊天消息、回执等不可丢弃的帧：先挤掉队列中的可丢弃帧，仍然放不下说明客户端长期读不动，
+  断开连接（1013），客户端重连后通过历史接口补齐
+"""
+import asyncio
+import os
+from collections import deque
+from typing import Any, Deque, Dict, Hashable, List, Optional, Union
+
+from fastapi import WebSocket
+
+from app.core.frames import Frame, as_frame, send_frame
+
+# 每个连接最多排队的帧数
+WS_SEND_QUEUE = int(os.getenv("WS_SEND_QUEUE", "256"))
+# 断开慢连接时等待关闭握手的时间（秒）
+WS_CLOSE_TIMEOUT = float(os.getenv("WS_CLOSE_TIMEOUT", "5"))
+# 1013 Try Again Later：服务端主动断开的慢连接
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+def coalesce_key(frame: Frame) -> Optional[Hashable]:
+    """可丢弃帧的合并键，同一个键在队列中只保留最新的一帧；不可丢弃的帧返回 None"""
+    payload = frame.payload
+    msg_type = payload.get("msg_type")
+    if msg_type == "user_status":
+        return ("user_status", payload.get("user_id"))
+    if msg_type == "heartbeat_response":
+        return ("heartbeat_response",)
+    return None
+
+
+class OutboxStats:
+    """本 worker 所有连接的发送队列计数"""
+
+    def __init__(self):
+        self.enqueued = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.overflow_disconnects = 0
+        self.send_errors = 0
+
+
+stats = OutboxStats()
+
+
+class Outbox:
+    def __init__(self, websocket: WebSocket, max_size: int = WS_SEND_QUEUE):
+        self.websocket = websocket
+        self.max_size = max_size
+        # 队列元素为 [合并键, 帧]，合并时原地替换帧，保留原来的位置
+        self._queue: Deque[List[Any]] = deque()
+        self._pending: Dict[Hashable, List[Any]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._close_task: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def start(self):
+        self._task = asyncio.create_task(self._writer())
+        # 挂在连接上，broker 投递时通过 outbox_for 找到队列
+        self.websocket.state.outbox = self
+
+    async def stop(self):
+        self.closed = True
+        self._queue.clear()
+        self._pending.clear()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def put(self, payload: Union[Frame, Dict[str, Any]]) -> bool:
+        """放入一帧，不等待发送；返回 False 表示被丢弃或连接已关闭"""
+        if self.closed:
+            return False
+        frame = as_frame(payload)
+        key = coalesce_key(frame)
+        if key is not None:
+            entry = self._pending.get(key)
+            if entry is not None:
+                entry[1] = frame
+                stats.coalesced += 1
+                return True
+
+        if len(self._queue) >= self.max_size and not self._drop_oldest():
+            if key is not None:
+                # 队列里全是不可丢弃的帧，丢掉新来的状态帧
+                stats.dropped += 1
+                return False
+            self._overflow()
+            return False
+
+        entry = [key, frame]
+        self._queue.append(entry)
+        if key is not None:
+            self._pending[key] = entry
+        stats.enqueued += 1
+        self._wakeup.set()
+        return True
+
+    def _drop_oldest(self) -> bool:
+        for entry in self._queue:
+            if entry[0] is not None:
+                self._queue.remove(entry)
+                del self._pending[entry[0]]
+                stats.dropped += 1
+                return True
+        return False
+
+    def _overflow(self):
+        """不可丢弃的帧放不下：断开慢连接"""
+        stats.overflow_disconnects += 1
+        self.closed = True
+        self._queue.clear()
+        self._pending.clear()
+        if self._task is not None:
+            self._task.cancel()
+        self._close_task = asyncio.create_task(self._close())
+
+    async def _close(self):
+        try:
+            await asyncio.wait_for(
+                self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason="slow consumer"),
+                timeout=WS_CLOSE_TIMEOUT,
+            )
+        except Exception:
+            pass
+
+    async def _writer(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            key, frame = self._queue.popleft()
+            if key is not None:
+                del self._pending[key]
+            try:
+                await send_frame(self.websocket, frame)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # 连接已断开，由接收循环负责清理
+                stats.send_errors += 1
+                self.closed = True
+                self._queue.clear()
+                self._pending.clear()
+                return
+            stats.sent += 1
+
+
+def outbox_for(websocket: WebSocket) -> Optional[Outbox]:
+    return getattr(websocket.state, "outbox", None)
+
+
+def metrics(websockets) -> Dict[str, Any]:
+    """发送队列指标：当前队列深度和累计计数"""
+    depths = [len(outbox) for outbox in map(outbox_for, websockets) if outbox is not None]
+    return {
+        "connections": len(depths),
+        "queued_frames": sum(depths),
+        "max_queue_depth": max(depths, default=0),
+        "queue_limit": WS_SEND_QUEUE,
+        "enqueued": stats.enqueued,
+        "sent": stats.sent,
+        "coalesced": stats.coalesced,
+        "dropped": stats.dropped,
+        "overflow_disconnects": stats.overflow_disconnects,
+        "send_errors": stats.send_errors,
+    }
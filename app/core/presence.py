@@ -0,0 +1,230 @@
+"""
+在线状态（presence）
+
+在线状态和心跳时间保存在内存中，心跳不再直接写库；
+后台任务定时把变化批量写回 users.is_online / users.last_seen，
+并定期清理超时未心跳的用户。
+
+多 worker 部署时，本 worker 不持有的用户从数据库读取并短暂缓存，
+在线用户的 last_seen 会定期刷新为最近心跳时间，供其他 worker 判断超时。
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import AsyncSessionLocal
+from app.models.user import User
+
+# 批量写库间隔（秒）
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", "5"))
+# 超过该时间未心跳视为离线（秒）
+PRESENCE_TIMEOUT = float(os.getenv("PRESENCE_TIMEOUT", "300"))
+# 超时清理间隔（秒）
+PRESENCE_SWEEP_INTERVAL = float(os.getenv("PRESENCE_SWEEP_INTERVAL", "30"))
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+class PresenceStore:
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        flush_interval: float = PRESENCE_FLUSH_INTERVAL,
+        timeout: float = PRESENCE_TIMEOUT,
+        sweep_interval: float = PRESENCE_SWEEP_INTERVAL,
+    ):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.sweep_interval = sweep_interval
+        # 本 worker 已知的在线用户 -> 最后心跳时间（time.time()）
+        self._heartbeats: Dict[int, float] = {}
+        # 持有本地 WebSocket 连接的用户，不参与超时清理
+        self._connected: Set[int] = set()
+        # 其他用户的状态缓存：user_id -> (is_online, last_seen, 缓存时间)
+        self._cache: Dict[int, Tuple[bool, Optional[datetime], float]] = {}
+        # 待写库的变化：user_id -> (is_online, last_seen)
+        self._dirty: Dict[int, Tuple[bool, datetime]] = {}
+        # 在线用户最近一次写库的心跳时间
+        self._flushed: Dict[int, float] = {}
+        # 超时清理后的回调（例如通知好友），参数为被清理的用户 id 列表
+        self.on_expire: Optional[Callable[[List[int]], Awaitable[None]]] = None
+        # 用户在任一 worker 上是否仍有连接，超时清理时跳过这些用户
+        self.is_connected: Optional[Callable[[int], Awaitable[bool]]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # 状态变更
+    def heartbeat(self, user_id: int):
+        """记录心跳；用户此前不在线则标记为上线"""
+        now = time.time()
+        was_online = user_id in self._heartbeats
+        self._heartbeats[user_id] = now
+        self._cache.pop(user_id, None)
+        if not was_online:
+            self._mark_dirty(user_id, True, now)
+        elif now - self._flushed.get(user_id, 0) > self.timeout / 4:
+            # 定期刷新数据库中的 last_seen，其他 worker 据此判断是否超时
+            self._mark_dirty(user_id, True, now)
+
+    def set_online(self, user_id: int, connected: bool = False):
+        if connected:
+            self._connected.add(user_id)
+        self.heartbeat(user_id)
+
+    def set_offline(self, user_id: int):
+        self._connected.discard(user_id)
+        self._heartbeats.pop(user_id, None)
+        self._flushed.pop(user_id, None)
+        now = time.time()
+        self._cache[user_id] = (False, self._to_datetime(now), now)
+        self._mark_dirty(user_id, False, now)
+
+    def _mark_dirty(self, user_id: int, is_online: bool, ts: float):
+        self._dirty[user_id] = (is_online, self._to_datetime(ts))
+        if is_online:
+            self._flushed[user_id] = ts
+
+    @staticmethod
+    def _to_datetime(ts: float) -> datetime:
+        return datetime.fromtimestamp(ts, timezone.utc)
+
+    # 查询
+    def _status(self, is_online: bool, last_seen: Optional[datetime]) -> Dict[str, Any]:
+        # 在线用户不返回 last_seen，与原接口保持一致
+        return {"is_online": is_online, "last_seen": None if is_online else _isoformat(last_seen)}
+
+    async def get_statuses(self, db: AsyncSession, user_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """批量获取状态，内存中没有的用户从数据库加载一次并缓存"""
+        now = time.time()
+        statuses: Dict[int, Dict[str, Any]] = {}
+        missing = []
+        for user_id in user_ids:
+            if user_id in self._heartbeats:
+                statuses[user_id] = self._status(True, None)
+                continue
+            cached = self._cache.get(user_id)
+            if cached and now - cached[2] < self.flush_interval:
+                statuses[user_id] = self._status(cached[0], cached[1])
+            else:
+                missing.append(user_id)
+
+        if missing:
+            result = await db.execute(
+                select(User.id, User.is_online, User.last_seen).where(User.id.in_(missing))
+            )
+            for user_id, is_online, last_seen in result.all():
+                is_online = bool(is_online)
+                self._cache[user_id] = (is_online, last_seen, now)
+                statuses[user_id] = self._status(is_online, last_seen)
+        return statuses
+
+    # 后台任务
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务，本 worker 的在线用户标记为离线并写库"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for user_id in list(self._heartbeats):
+            self.set_offline(user_id)
+        await self.flush()
+
+    async def _run(self):
+        last_sweep = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                # 持有连接的用户视为持续心跳
+                for user_id in self._connected:
+                    self.heartbeat(user_id)
+                await self.flush()
+                if time.monotonic() - last_sweep >= self.sweep_interval:
+                    last_sweep = time.monotonic()
+                    await self.sweep()
+            except Exception as e:
+                print(f"Presence flush error: {e}")
+
+    async def flush(self):
+        """把状态变化批量写回数据库"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        params = [
+            {"id": user_id, "is_online": is_online, "last_seen": last_seen}
+            for user_id, (is_online, last_seen) in dirty.items()
+        ]
+        try:
+            async with self.session_factory() as db:
+                # 按主键批量更新（executemany）
+                await db.execute(update(User), params)
+                await db.commit()
+        except Exception:
+            # 写库失败时放回队列，下次重试（保留期间产生的更新）
+            for user_id, value in dirty.items():
+                self._dirty.setdefault(user_id, value)
+            raise
+
+    async def _without_connected(self, user_ids: List[int]) -> List[int]:
+        if self.is_connected is None:
+            return user_ids
+        return [user_id for user_id in user_ids if not await self.is_connected(user_id)]
+
+    async def sweep(self, timeout: Optional[float] = None) -> List[int]:
+        """清理超时未心跳的用户，返回被标记为离线的用户 id"""
+        now = time.time()
+        cutoff = now - (timeout or self.timeout)
+        expired = [
+            user_id
+            for user_id, ts in self._heartbeats.items()
+            if ts < cutoff and user_id not in self._connected
+        ]
+        offline = await self._without_connected(expired)
+        for user_id in expired:
+            if user_id in offline:
+                self.set_offline(user_id)
+            else:
+                # 用户已连到其他 worker，由那边维护状态，这里只丢弃本地记录
+                self._heartbeats.pop(user_id, None)
+                self._flushed.pop(user_id, None)
+        expired = offline
+
+        # 清理过期的状态缓存
+        for user_id in [uid for uid, (_, _, loaded) in self._cache.items() if now - loaded > self.flush_interval]:
+            del self._cache[user_id]
+
+        # 数据库中残留的在线记录（例如其他 worker 异常退出）
+        await self.flush()
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(User.id).where(
+                    User.is_online == True,
+                    (User.last_seen == None) | (User.last_seen < self._to_datetime(cutoff).replace(tzinfo=None)),
+                )
+            )
+            stale = [user_id for user_id in result.scalars().all() if user_id not in self._heartbeats]
+        stale = await self._without_connected(stale)
+        for user_id in stale:
+            self.set_offline(user_id)
+        await self.flush()
+
+        expired.extend(stale)
+        if expired and self.on_expire is not None:
+            await self.on_expire(expired)
+        return expired
+
+
+presence = PresenceStore()
@@ -0,0 +1,156 @@
+"""
+消息全文检索（SQLite FTS5）
+
+messages_fts 是以 messages 为外部内容表的 FTS5 索引，不重复保存消息内容。
+使用 trigram 分词：中文不需要分词即可做子串匹配，代价是每个关键词至少 3 个字符。
+
+索引由触发器随消息的写入 / 修改 / 删除增量维护，对所有写入路径（写入管线、脚本）都生效。
+已有数据库在安装触发器之前的消息由迁移 v007_search_index 分批回填，可以随时中断后继续：
+messages_fts_state 记录触发器生效的起始 id（trigger_from）和已回填到的 id（backfilled_id），
+id 不超过 backfilled_id 或不小于 trigger_from 的消息已在索引中，触发器只维护这部分消息，
+回填只处理两者之间的消息，两边不会重复写入。
+"""
+import sqlite3
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+# 每个关键词的最少字符数（trigram 分词的限制）
+SEARCH_MIN_TERM_LENGTH = 3
+
+_INDEXED = (
+    "({id} >= (SELECT trigger_from FROM messages_fts_state)"
+    " OR {id} <= (SELECT backfilled_id FROM messages_fts_state))"
+)
+_HAS_CONTENT = "{content} IS NOT NULL AND {content} != ''"
+
+# 整个脚本在一个写事务中执行，触发器生效的起始 id 与触发器同时确定
+SEARCH_SETUP_SQL = f"""
+BEGIN IMMEDIATE;
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='id', tokenize='trigram'
+);
+CREATE TABLE IF NOT EXISTS messages_fts_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    trigger_from INTEGER NOT NULL,
+    backfilled_id INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO messages_fts_state (id, trigger_from, backfilled_id)
+    SELECT 1, COALESCE(MAX(id), 0) + 1, 0 FROM messages;
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+WHEN {_HAS_CONTENT.format(content="new.content")} AND {_INDEXED.format(id="new.id")}
+BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+WHEN {_HAS_CONTENT.format(content="old.content")} AND {_INDEXED.format(id="old.id")}
+BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages
+WHEN {_INDEXED.format(id="old.id")}
+BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content)
+        SELECT 'delete', old.id, old.content WHERE {_HAS_CONTENT.format(content="old.content")};
+    INSERT INTO messages_fts (rowid, content)
+        SELECT new.id, new.content WHERE {_HAS_CONTENT.format(content="new.content")};
+END;
+COMMIT;
+"""
+
+
+def setup_search_index(conn: sqlite3.Connection):
+    """创建索引表、状态表和触发器（已存在时不做任何修改）"""
+    conn.executescript(SEARCH_SETUP_SQL)
+
+
+def ensure_search_index(engine: Engine):
+    raw = engine.raw_connection()
+    try:
+        setup_search_index(raw.driver_connection)
+    finally:
+        raw.close()
+
+
+def backfill_batch(conn: sqlite3.Connection, batch_size: int) -> Tuple[int, int]:
+    """
+    回填下一段 id 范围内的旧消息，与进度在同一事务中提交。
+    返回 (已回填到的 id, 需要回填到的 id)，两者相等时回填完成。
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        backfilled_id, trigger_from = conn.execute(
+            "SELECT backfilled_id, trigger_from FROM messages_fts_state"
+        ).fetchone()
+        target = trigger_from - 1
+        upper = min(backfilled_id + batch_size, target)
+        if upper > backfilled_id:
+            conn.execute(
+                f"""
+                INSERT INTO messages_fts (rowid, content)
+                SELECT id, content FROM messages
+                WHERE id > ? AND id <= ? AND {_HAS_CONTENT.format(content="content")}
+                """,
+                (backfilled_id, upper),
+            )
+            conn.execute("UPDATE messages_fts_state SET backfilled_id = ?", (upper,))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return upper, target
+
+
+def match_expression(query: str) -> str:
+    """
+    把用户输入转换为 FTS5 查询：按空白拆成关键词，每个关键词作为短语（转义引号），
+    多个关键词之间为 AND。关键词过短时抛出 ValueError。
+    """
+    terms = query.split()
+    if not terms:
+        raise ValueError("empty query")
+    for term in terms:
+        if len(term) < SEARCH_MIN_TERM_LENGTH:
+            raise ValueError(f"term too short: {term}")
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def search_messages(
+    db: Session,
+    user_id: int,
+    match: str,
+    peer_id: Optional[int] = None,
+    after: Optional[Tuple[float, int]] = None,
+    limit: int = 20,
+) -> List[Tuple[int, float]]:
+    """
+    在 user_id 参与的单聊消息中检索，按相关度（bm25，越小越相关）排序，相同时新消息在前。
+    after 为上一页最后一条的 (score, id)；返回 [(message_id, score)]。
+    """
+    conditions = ["messages_fts MATCH :match"]
+    params = {"match": match, "user_id": user_id, "limit": limit}
+    if peer_id is None:
+        conditions.append("(m.from_id = :user_id OR m.to_id = :user_id)")
+    else:
+        conditions.append(
+            "((m.from_id = :user_id AND m.to_id = :peer_id) OR (m.from_id = :peer_id AND m.to_id = :user_id))"
+        )
+        params["peer_id"] = peer_id
+    cursor_condition = ""
+    if after is not None:
+        cursor_condition = "WHERE score > :after_score OR (score = :after_score AND id < :after_id)"
+        params["after_score"], params["after_id"] = after
+
+    sql = f"""
+        SELECT id, score FROM (
+            SELECT m.id AS id, bm25(messages_fts) AS score
+            FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+            WHERE {" AND ".join(conditions)}
+        )
+        {cursor_condition}
+        ORDER BY score, id DESC
+        LIMIT :limit
+    """
+    return [(row.id, row.score) for row in db.execute(text(sql), params)]
@@ -1,18 +1,35 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from jose import jwt, JWTError
-from typing import Optional
+from typing import Dict, Optional, Set, Tuple
 from passlib.context import CryptContext
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.models.user import User
 from fastapi import Depends, HTTPException, status
-from app.core.database import SessionLocal
+from app.core.database import AsyncSessionLocal, SessionLocal
+import os
+import threading
+import time
 
 # 生产环境请用更安全的密钥
 SECRET_KEY = "secret-key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# 已验证 token 的缓存条数和有效期（秒）
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt 计算成本；调整后旧哈希会在用户下次登录时自动按新成本重新计算
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# 密码哈希专用线程数，以及允许排队的请求数，超出时直接返回 503
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
@@ -20,10 +37,52 @@ def get_password_hash(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = db.query(User).filter(User.username == username).first()
-    if not user or not verify_password(password, user.hashed_password):
+class PasswordHasher:
+    """在独立的有界线程池中执行 bcrypt，避免占满默认线程池和阻塞事件循环"""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_QUEUE):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        # 正在执行和排队的任务数，只在事件循环线程中修改
+        self._pending = 0
+        self.rejected = 0
+
+    async def _run(self, func, *args):
+        if self._pending >= self.workers + self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server busy, please retry later",
+                headers={"Retry-After": "1"},
+            )
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """校验密码；哈希需要升级（如成本变化）时同时返回新哈希"""
+        return await self._run(pwd_context.verify_and_update, password, hashed_password)
+
+password_hasher = PasswordHasher()
+
+async def authenticate_user(db: AsyncSession, username: str, password: str) -> Optional[User]:
+    """校验用户名密码，成功时按需用当前成本重新哈希密码"""
+    result = await db.execute(select(User).where(User.username == username))
+    user = result.scalars().first()
+    if not user:
+        return None
+    verified, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+    if not verified:
         return None
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -44,20 +103,122 @@ def get_db():
     finally:
         db.close()
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+class UserSnapshot:
+    """已认证用户的轻量快照，不绑定数据库会话，可在请求之间缓存"""
+    __slots__ = ("id", "username", "avatar", "email", "nickname", "gender")
+
+    def __init__(self, id: int, username: str, avatar: Optional[str] = None, email: Optional[str] = None,
+                 nickname: Optional[str] = None, gender: Optional[str] = None):
+        self.id = id
+        self.username = username
+        self.avatar = avatar
+        self.email = email
+        self.nickname = nickname
+        self.gender = gender
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserSnapshot":
+        return cls(user.id, user.username, user.avatar, user.email, user.nickname, user.gender)
+
+class PrincipalCache:
+    """已验证 token -> 用户快照，LRU + TTL，过期时间不超过 token 自身的 exp"""
+
+    def __init__(self, max_size: int = PRINCIPAL_CACHE_SIZE, ttl: float = PRINCIPAL_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[UserSnapshot, float]]" = OrderedDict()
+        self._tokens_by_user: Dict[int, Set[str]] = {}
+        # 同步依赖在线程池中执行，需要加锁
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[UserSnapshot]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if time.time() >= entry[1]:
+                self._remove(token)
+                return None
+            self._entries.move_to_end(token)
+            return entry[0]
+
+    def put(self, token: str, user: UserSnapshot, exp: Optional[float]):
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        with self._lock:
+            self._entries[token] = (user, expires_at)
+            self._entries.move_to_end(token)
+            self._tokens_by_user.setdefault(user.id, set()).add(token)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: int):
+        """用户信息变更后移除该用户的所有缓存 token"""
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+
+    def _remove(self, token: str):
+        user, _ = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(user.id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user.id]
+
+principal_cache = PrincipalCache()
+
+def _decode_token(token: str) -> Tuple[Optional[str], Optional[float]]:
+    """校验 token，返回 (username, exp)；无效时 username 为 None"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
-    user = db.query(User).filter(User.username == username).first()
+        return None, None
+    return payload.get("sub"), payload.get("exp")
+
+def resolve_token(token: str) -> Optional[UserSnapshot]:
+    """根据 token 获取当前用户（同步），优先查缓存"""
+    user = principal_cache.get(token)
+    if user is not None:
+        return user
+    username, exp = _decode_token(token)
+    if username is None:
+        return None
+    db = SessionLocal()
+    try:
+        db_user = db.query(User).filter(User.username == username).first()
+    finally:
+        db.close()
+    if db_user is None:
+        return None
+    user = UserSnapshot.from_user(db_user)
+    principal_cache.put(token, user, exp)
+    return user
+
+async def resolve_token_async(token: str) -> Optional[UserSnapshot]:
+    """根据 token 获取当前用户（异步，供 WebSocket 使用），优先查缓存"""
+    user = principal_cache.get(token)
+    if user is not None:
+        return user
+    username, exp = _decode_token(token)
+    if username is None:
+        return None
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(User).where(User.username == username))
+        db_user = result.scalars().first()
+    if db_user is None:
+        return None
+    user = UserSnapshot.from_user(db_user)
+    principal_cache.put(token, user, exp)
+    return user
+
+def get_current_user(token: str = Depends(oauth2_scheme)) -> UserSnapshot:
+    user = resolve_token(token)
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
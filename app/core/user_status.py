@@ -1,81 +1,40 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
-from app.models.user import User
-from app.models.friend import Friend
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.presence import presence
+from app.core.friend_cache import friend_cache
 from typing import Dict, Any
-from datetime import datetime, timezone, timedelta
 
 class UserStatusManager:
-    def __init__(self, db: Session):
+    """用户在线状态，读写都走内存中的 presence，由其定时批量写库"""
+
+    def __init__(self, db: AsyncSession):
         self.db = db
-    
-    def update_user_status(self, user_id: int, is_online: bool = True):
-        """更新用户在线状态"""
-        user = self.db.query(User).filter(User.id == user_id).first()
-        if user:
-            user.is_online = is_online
-            user.last_seen = datetime.now(timezone.utc) if not is_online else None
-            self.db.commit()
-            self.db.refresh(user)
-        return user
-    
-    def get_user_status(self, user_id: int) -> Dict[str, Any]:
+
+    async def update_user_status(self, user_id: int, is_online: bool = True, connected: bool = False):
+        """更新用户在线状态（connected 表示用户持有本 worker 的 WebSocket 连接）"""
+        if is_online:
+            presence.set_online(user_id, connected=connected)
+        else:
+            presence.set_offline(user_id)
+
+    async def get_user_status(self, user_id: int) -> Dict[str, Any]:
         """获取用户状态"""
-        user = self.db.query(User).filter(User.id == user_id).first()
-        if not user:
-            return {"is_online": False, "last_seen": None}
-        
-        return {
-            "is_online": user.is_online,
-            "last_seen": user.last_seen.isoformat() if user.last_seen else None
-        }
-    
-    def get_friends_status(self, user_id: int) -> Dict[int, Dict[str, Any]]:
+        statuses = await presence.get_statuses(self.db, [user_id])
+        return statuses.get(user_id, {"is_online": False, "last_seen": None})
+
+    async def get_friends_status(self, user_id: int) -> Dict[int, Dict[str, Any]]:
         """获取用户所有好友的在线状态"""
-        # 获取所有好友ID
-        friends = self.db.query(Friend).filter(
-            and_(
-                Friend.status == "accepted",
-                (Friend.user_id == user_id) | (Friend.friend_id == user_id)
-            )
-        ).all()
-        
-        friend_ids = []
-        for friend in friends:
-            if friend.user_id == user_id:
-                friend_ids.append(friend.friend_id)
-            else:
-                friend_ids.append(friend.user_id)
-        
+        # 获取所有好友ID（走好友关系缓存）
+        friend_ids = await friend_cache.get_friend_ids(self.db, user_id)
+
         # 获取好友状态
-        status_dict = {}
-        if friend_ids:
-            friends_users = self.db.query(User).filter(User.id.in_(friend_ids)).all()
-            for friend_user in friends_users:
-                status_dict[friend_user.id] = {
-                    "is_online": friend_user.is_online,
-                    "last_seen": friend_user.last_seen.isoformat() if friend_user.last_seen else None
-                }
-        
-        return status_dict
-    
-    def mark_user_offline(self, user_id: int):
+        if not friend_ids:
+            return {}
+        return await presence.get_statuses(self.db, friend_ids)
+
+    async def mark_user_offline(self, user_id: int):
         """标记用户为离线"""
-        return self.update_user_status(user_id, False)
-    
-    def cleanup_offline_users(self, timeout_minutes: int = 5):
-        """清理超时离线用户"""
-        timeout_time = datetime.now(timezone.utc) - timedelta(minutes=timeout_minutes)
-        offline_users = self.db.query(User).filter(
-            and_(
-                User.is_online == True,
-                User.last_seen < timeout_time
-            )
-        ).all()
-        
-        for user in offline_users:
-            user.is_online = False
-            user.last_seen = datetime.now(timezone.utc)
-        
-        self.db.commit()
-        return len(offline_users)
\ No newline at end of file
+        return await self.update_user_status(user_id, False)
+
+    async def cleanup_offline_users(self, timeout_minutes: int = 5):
+        """清理超时离线用户（后台任务会定期执行，这里用于手动触发）"""
+        return len(await presence.sweep(timeout_minutes * 60))
@@ -1,9 +1,37 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from .api import auth, user, friend, ws_chat, message, user_status, upload
+from .api import auth, user, friend, ws_chat, message, group, user_status, upload, media
+from .core.database import async_engine, async_read_engine
+from .core.broker import broker
+from .core.message_writer import message_writer
+from .core.presence import presence
+from .core.image_store import image_gc
+from .core.heartbeat import heartbeat_wheel
+from .core.archive import message_archiver
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动跨进程消息路由、消息写入管线、在线状态刷新、图片回收、WebSocket 心跳和冷消息归档
+    await broker.start()
+    await message_writer.start()
+    await presence.start()
+    await image_gc.start()
+    await heartbeat_wheel.start()
+    await message_archiver.start()
+    yield
+    await message_archiver.stop()
+    await heartbeat_wheel.stop()
+    await image_gc.stop()
+    await presence.stop()
+    await message_writer.stop()
+    await broker.stop()
+    await async_engine.dispose()
+    await async_read_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # 允许跨域请求
 origins = ["*"]
@@ -14,6 +42,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 游标分页通过响应头返回下一页游标
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
@@ -21,8 +51,9 @@ app.include_router(user.router, prefix="/api/user", tags=["user"])
 app.include_router(friend.router, prefix="/api/friend", tags=["friend"])
 app.include_router(ws_chat.router, prefix="/api", tags=["ws_chat"])
 app.include_router(message.router, prefix="/api/message", tags=["message"])
+app.include_router(group.router, prefix="/api/group", tags=["group"])
 app.include_router(user_status.router, prefix="/api/user", tags=["user_status"])
 app.include_router(upload.router, prefix="/api", tags=["upload"])
+# 上传文件（含缩略图 / 预览图）的下载，带长期缓存、ETag 和 Range 支持
+app.include_router(media.router, prefix="/uploads", tags=["media"])
 
-# 挂载静态文件服务
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
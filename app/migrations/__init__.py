@@ -0,0 +1,30 @@
+"""
+数据库版本迁移（由根目录的 migrate.py 执行，框架见 app/core/migrations.py）
+
+新增迁移：添加 vNNN_<名称>.py 定义 migration，并加入下面的 MIGRATIONS；
+已发布的迁移不要再修改，表结构再变化时新增一个版本。
+"""
+from app.migrations import (
+    v001_user_presence,
+    v002_message_images,
+    v003_message_indexes,
+    v004_conversations,
+    v005_read_watermarks,
+    v006_image_hashes,
+    v007_search_index,
+    v008_message_autoincrement,
+)
+
+MIGRATIONS = [
+    module.migration
+    for module in (
+        v001_user_presence,
+        v002_message_images,
+        v003_message_indexes,
+        v004_conversations,
+        v005_read_watermarks,
+        v006_image_hashes,
+        v007_search_index,
+        v008_message_autoincrement,
+    )
+]
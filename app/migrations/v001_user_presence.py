@@ -0,0 +1,7 @@
+"""用户在线状态字段（原 migrate_db.py / simple_migrate.py）"""
+from app.core.migrations import AddColumn, Migration
+
+migration = Migration(1, "user_presence", [
+    AddColumn("users", "is_online", "BOOLEAN DEFAULT 0"),
+    AddColumn("users", "last_seen", "DATETIME"),
+])
@@ -0,0 +1,41 @@
+"""
+消息图片字段，content 允许为空（原 migrate_images.py）
+
+SQLite 不能修改列的约束，需要重建 messages 表；改为在线重建，分批复制，期间消息照常写入。
+"""
+from app.core.migrations import Migration, RebuildTable, table_columns
+
+MESSAGES_SQL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    from_id INTEGER NOT NULL,
+    to_id INTEGER NOT NULL,
+    content TEXT,
+    msg_type TEXT DEFAULT 'text',
+    image_url TEXT,
+    image_name TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    is_read BOOLEAN DEFAULT FALSE,
+    FOREIGN KEY (from_id) REFERENCES users (id),
+    FOREIGN KEY (to_id) REFERENCES users (id)
+)
+"""
+
+migration = Migration(2, "message_images", [
+    RebuildTable(
+        "messages",
+        MESSAGES_SQL,
+        {
+            "id": "id",
+            "from_id": "from_id",
+            "to_id": "to_id",
+            "content": "content",
+            "msg_type": "msg_type",
+            "image_url": "NULL",
+            "image_name": "NULL",
+            "created_at": "created_at",
+            "is_read": "is_read",
+        },
+        when=lambda conn: "image_url" not in table_columns(conn, "messages"),
+    ),
+])
@@ -0,0 +1,13 @@
+"""会话历史的复合索引（原 migrate_indexes.py）"""
+from app.core.migrations import Migration, Sql
+
+migration = Migration(3, "message_indexes", [
+    Sql(
+        [
+            "CREATE INDEX IF NOT EXISTS ix_messages_from_to_id ON messages (from_id, to_id, id)",
+            # 更新统计信息，让查询规划器使用新索引
+            "ANALYZE messages",
+        ],
+        "创建 ix_messages_from_to_id 索引",
+    ),
+])
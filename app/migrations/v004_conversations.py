@@ -0,0 +1,68 @@
+"""
+会话列表表，并根据已有消息回填（原 migrate_conversations.py）
+
+按消息 id 分批：每批只把本批中更新的消息写为会话的最后一条消息，可以重复执行；
+未读数由 v005 根据已读水位统一计算。
+"""
+from app.core.migrations import Backfill, Migration, Sql
+
+PREVIEW_LENGTH = 50
+
+migration = Migration(4, "conversations", [
+    Sql(
+        [
+            """
+            CREATE TABLE IF NOT EXISTS conversations (
+                owner_id INTEGER NOT NULL,
+                peer_id INTEGER NOT NULL,
+                last_message_id INTEGER NOT NULL,
+                last_from_id INTEGER,
+                last_msg_type VARCHAR,
+                last_preview VARCHAR,
+                last_at DATETIME,
+                unread_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (owner_id, peer_id),
+                FOREIGN KEY (owner_id) REFERENCES users (id),
+                FOREIGN KEY (peer_id) REFERENCES users (id)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS ix_conversations_owner_last ON conversations (owner_id, last_message_id)",
+        ],
+        "创建 conversations 表",
+    ),
+    Backfill(
+        "messages",
+        # 每对用户两行，双方各一行
+        """
+        INSERT INTO conversations (owner_id, peer_id, last_message_id)
+        SELECT owner_id, peer_id, MAX(id) FROM (
+            SELECT from_id AS owner_id, to_id AS peer_id, id FROM messages WHERE id > :start AND id <= :end
+            UNION ALL
+            SELECT to_id, from_id, id FROM messages WHERE id > :start AND id <= :end
+        )
+        GROUP BY owner_id, peer_id
+        ON CONFLICT (owner_id, peer_id) DO UPDATE SET
+            last_message_id = MAX(last_message_id, excluded.last_message_id)
+        """,
+        "回填会话",
+    ),
+    Backfill(
+        "conversations",
+        f"""
+        UPDATE conversations SET
+            last_from_id = m.from_id,
+            last_msg_type = m.msg_type,
+            last_preview = CASE
+                WHEN m.content IS NOT NULL AND m.content != '' THEN substr(m.content, 1, {PREVIEW_LENGTH})
+                WHEN m.image_url IS NOT NULL THEN '[图片]'
+                ELSE ''
+            END,
+            last_at = m.created_at
+        FROM messages m
+        WHERE m.id = conversations.last_message_id
+          AND conversations.rowid > :start AND conversations.rowid <= :end
+        """,
+        "回填最后一条消息",
+        key="rowid",
+    ),
+])
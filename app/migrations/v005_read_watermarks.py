@@ -0,0 +1,41 @@
+"""
+已读状态改为会话级的已读水位（原 migrate_read_watermarks.py）
+
+- conversations 表增加 last_read_message_id 列
+- 根据 messages.is_read 回填水位：取每个会话中最早一条未读消息之前的位置，
+  没有未读消息时为最后一条消息；水位之后仍已读的零散消息会重新计为未读
+- 按水位重新计算未读数
+- 删除不再使用的 ix_messages_to_is_read 索引
+"""
+from app.core.migrations import AddColumn, Backfill, Migration, Sql
+
+migration = Migration(5, "read_watermarks", [
+    AddColumn("conversations", "last_read_message_id", "INTEGER NOT NULL DEFAULT 0"),
+    Backfill(
+        "conversations",
+        [
+            """
+            UPDATE conversations SET last_read_message_id = CASE
+                WHEN owner_id = peer_id THEN last_message_id
+                ELSE COALESCE(
+                    (SELECT MIN(id) - 1 FROM messages
+                     WHERE from_id = conversations.peer_id AND to_id = conversations.owner_id AND NOT is_read),
+                    last_message_id
+                )
+            END
+            WHERE last_read_message_id = 0 AND rowid > :start AND rowid <= :end
+            """,
+            """
+            UPDATE conversations SET unread_count = (
+                SELECT COUNT(*) FROM messages
+                WHERE from_id = conversations.peer_id AND to_id = conversations.owner_id
+                  AND id > conversations.last_read_message_id
+            )
+            WHERE owner_id != peer_id AND rowid > :start AND rowid <= :end
+            """,
+        ],
+        "回填已读水位和未读数",
+        key="rowid",
+    ),
+    Sql("DROP INDEX IF EXISTS ix_messages_to_is_read", "删除 ix_messages_to_is_read 索引"),
+])
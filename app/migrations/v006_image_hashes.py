@@ -0,0 +1,178 @@
+"""
+图片按内容哈希存储（原 migrate_image_hashes.py）
+
+- 创建 image_blobs / image_refs 表
+- 按 sha256 复制 uploads/images 下的旧文件到新地址，内容相同的只保留一份，
+  每个文件单独提交 blob 记录和 旧地址 -> 新地址 的对应关系（image_url_moves）
+- 按 id 分批更新消息图片和用户头像的地址，同一批内建立引用记录
+- 地址全部更新后再删除旧文件
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+from datetime import datetime
+
+from app.core.migrations import Backfill, Call, Migration, Sql, transaction
+
+IMAGE_DIR = "uploads/images"
+EXT_RE = re.compile(r"^[0-9a-z]{1,10}$")
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def blob_url(sha256, filename):
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if not EXT_RE.match(extension):
+        extension = "jpg"
+    return f"{IMAGE_DIR}/{sha256[:2]}/{sha256}.{extension}"
+
+
+def move_files(conn, progress):
+    """
+    只处理 uploads/images 根目录下的文件，已迁移的文件在子目录中。
+    这里不修改消息和头像的地址（逐个文件全表扫描会长时间持有写锁），只记录对应关系；
+    旧文件保留到后续步骤改完地址之后再删除。中断后重新执行会跳过已记录的文件。
+
+    blob 记录的 last_uploaded_at 取当前时间：引用记录要到后面的步骤才建立，
+    在此之前由回收任务的宽限期保护新文件不被当作无引用的图片删除。
+    """
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS image_url_moves (old_url VARCHAR NOT NULL PRIMARY KEY, new_url VARCHAR NOT NULL)"
+    )
+    if os.path.isdir(IMAGE_DIR):
+        names = sorted(
+            name for name in os.listdir(IMAGE_DIR)
+            if not name.startswith(".") and os.path.isfile(os.path.join(IMAGE_DIR, name))
+        )
+    else:
+        names = []
+
+    moved = 0
+    duplicates = 0
+    for name in names:
+        old_url = f"{IMAGE_DIR}/{name}"
+        if conn.execute("SELECT 1 FROM image_url_moves WHERE old_url = ?", (old_url,)).fetchone():
+            continue
+        sha256 = file_sha256(old_url)
+        row = conn.execute("SELECT url FROM image_blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        new_url = row[0] if row else blob_url(sha256, name)
+        # 先复制到新地址（写临时文件再改名，中断时不会留下不完整的文件）
+        duplicate = os.path.exists(new_url)
+        if not duplicate:
+            os.makedirs(os.path.dirname(new_url), exist_ok=True)
+            shutil.copyfile(old_url, new_url + ".tmp")
+            os.replace(new_url + ".tmp", new_url)
+
+        with transaction(conn):
+            row = conn.execute("SELECT url FROM image_blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is None:
+                stat = os.stat(old_url)
+                modified = datetime.utcfromtimestamp(stat.st_mtime).isoformat(" ")
+                now = datetime.utcnow().isoformat(" ")
+                conn.execute(
+                    "INSERT INTO image_blobs (sha256, url, size, content_type, created_at, last_uploaded_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (sha256, new_url, stat.st_size, mimetypes.guess_type(name)[0], modified, now),
+                )
+            elif row[0] != new_url:
+                # 复制期间应用上传了相同内容，使用已有的文件
+                if not duplicate:
+                    os.remove(new_url)
+                new_url = row[0]
+                duplicate = True
+            conn.execute("INSERT INTO image_url_moves (old_url, new_url) VALUES (?, ?)", (old_url, new_url))
+
+        if duplicate:
+            duplicates += 1
+        else:
+            moved += 1
+    progress.log(f"迁移图片 {moved} 个，重复内容合并 {duplicates} 个")
+
+
+def remove_moved_files(conn, progress):
+    """地址已全部更新，旧文件不再被引用"""
+    removed = 0
+    for (old_url,) in conn.execute("SELECT old_url FROM image_url_moves").fetchall():
+        try:
+            os.remove(old_url)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    progress.log(f"删除旧文件 {removed} 个")
+
+
+def _rewrite(table, column):
+    return f"""
+    UPDATE {table}
+    SET {column} = (SELECT new_url FROM image_url_moves WHERE old_url = ltrim({table}.{column}, '/'))
+    WHERE id > :start AND id <= :end
+      AND ltrim({column}, '/') IN (SELECT old_url FROM image_url_moves)
+    """
+
+
+migration = Migration(6, "image_hashes", [
+    Sql(
+        [
+            """
+            CREATE TABLE IF NOT EXISTS image_blobs (
+                sha256 VARCHAR(64) NOT NULL PRIMARY KEY,
+                url VARCHAR NOT NULL UNIQUE,
+                size INTEGER NOT NULL,
+                content_type VARCHAR,
+                created_at DATETIME,
+                last_uploaded_at DATETIME NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS image_refs (
+                id INTEGER NOT NULL PRIMARY KEY,
+                sha256 VARCHAR(64) NOT NULL,
+                ref_type VARCHAR NOT NULL,
+                ref_id INTEGER NOT NULL,
+                created_at DATETIME,
+                CONSTRAINT uq_image_refs_target UNIQUE (sha256, ref_type, ref_id),
+                FOREIGN KEY (sha256) REFERENCES image_blobs (sha256)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS ix_image_refs_owner ON image_refs (ref_type, ref_id)",
+        ],
+        "创建 image_blobs / image_refs 表",
+    ),
+    Call(move_files, "按内容哈希复制已有图片"),
+    Backfill(
+        "messages",
+        [
+            _rewrite("messages", "image_url"),
+            """
+            INSERT OR IGNORE INTO image_refs (sha256, ref_type, ref_id, created_at)
+            SELECT b.sha256, 'message', m.id, m.created_at
+            FROM messages m JOIN image_blobs b ON b.url = ltrim(m.image_url, '/')
+            WHERE m.image_url IS NOT NULL AND m.id > :start AND m.id <= :end
+            """,
+        ],
+        "更新消息图片地址并建立引用",
+    ),
+    Backfill(
+        "users",
+        [
+            _rewrite("users", "avatar"),
+            """
+            INSERT OR IGNORE INTO image_refs (sha256, ref_type, ref_id, created_at)
+            SELECT b.sha256, 'avatar', u.id, CURRENT_TIMESTAMP
+            FROM users u JOIN image_blobs b ON b.url = ltrim(u.avatar, '/')
+            WHERE u.avatar IS NOT NULL AND u.id > :start AND u.id <= :end
+            """,
+        ],
+        "更新头像地址并建立引用",
+    ),
+    Call(remove_moved_files, "删除已迁移的旧图片"),
+    Sql("DROP TABLE IF EXISTS image_url_moves", "删除地址对应表"),
+])
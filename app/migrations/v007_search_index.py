@@ -0,0 +1,41 @@
+"""
+为已有消息建立全文检索索引（原 migrate_search_index.py）
+
+索引表、进度表和触发器在应用启动时也会自动创建；这里按 id 分批回填触发器生效之前的消息，
+回填进度记录在 messages_fts_state 中，最后分多次小步合并索引段。
+"""
+import time
+
+from app.core.migrations import Call, Migration, transaction
+from app.core.search import backfill_batch, setup_search_index
+
+# 每次合并写入的页数
+MERGE_PAGES = 500
+
+
+def backfill(conn, progress):
+    setup_search_index(conn)
+    while True:
+        backfilled_id, target = backfill_batch(conn, progress.batch_size)
+        if backfilled_id >= target:
+            break
+        progress.log(f"{backfilled_id} / {target}")
+        time.sleep(progress.pause)
+
+
+def merge(conn, progress):
+    # 'optimize' 会在一个事务中重写整个索引，改为多次 'merge'，直到没有可合并的段
+    while True:
+        with transaction(conn):
+            before = conn.total_changes
+            conn.execute("INSERT INTO messages_fts (messages_fts, rank) VALUES ('merge', ?)", (MERGE_PAGES,))
+            changed = conn.total_changes - before
+        if changed < 2:
+            break
+        time.sleep(progress.pause)
+
+
+migration = Migration(7, "search_index", [
+    Call(backfill, "回填全文检索索引"),
+    Call(merge, "合并索引段"),
+])
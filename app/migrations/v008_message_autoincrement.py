@@ -0,0 +1,56 @@
+"""
+messages.id 改为 AUTOINCREMENT，id 不再复用
+
+没有 AUTOINCREMENT 时 SQLite 分配 MAX(id) + 1：最新的消息被归档（从热表删除）后，
+新消息会拿到与归档消息相同的 id，被已读水位当作已读，归档时又被当作已归档跳过。
+在线重建 messages 表，再把自增序列推进到会话表记录过的最大消息 id（覆盖已归档的消息）。
+"""
+from app.core.migrations import Migration, RebuildTable, Sql
+
+MESSAGES_SQL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+    from_id INTEGER NOT NULL,
+    to_id INTEGER NOT NULL,
+    content VARCHAR,
+    msg_type VARCHAR,
+    image_url VARCHAR,
+    image_name VARCHAR,
+    created_at DATETIME,
+    is_read BOOLEAN,
+    FOREIGN KEY(from_id) REFERENCES users (id),
+    FOREIGN KEY(to_id) REFERENCES users (id)
+)
+"""
+
+COLUMNS = ("id", "from_id", "to_id", "content", "msg_type", "image_url", "image_name", "created_at", "is_read")
+
+# 曾分配过的最大消息 id：热表、以及会话表中的最后一条消息和已读水位（含已归档的消息）
+_HIGHEST_ID = """
+max(
+    COALESCE((SELECT MAX(id) FROM messages), 0),
+    COALESCE((SELECT MAX(last_message_id) FROM conversations), 0),
+    COALESCE((SELECT MAX(last_read_message_id) FROM conversations), 0)
+)
+"""
+
+
+def _without_autoincrement(conn) -> bool:
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'messages'").fetchone()[0]
+    return "AUTOINCREMENT" not in sql.upper()
+
+
+migration = Migration(8, "message_autoincrement", [
+    RebuildTable("messages", MESSAGES_SQL, {column: column for column in COLUMNS}, when=_without_autoincrement),
+    Sql(
+        [
+            f"UPDATE sqlite_sequence SET seq = max(seq, {_HIGHEST_ID}) WHERE name = 'messages'",
+            f"""
+            INSERT INTO sqlite_sequence (name, seq)
+            SELECT 'messages', {_HIGHEST_ID}
+            WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'messages')
+            """,
+        ],
+        "推进消息 id 的自增序列",
+    ),
+])
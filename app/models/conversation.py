@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
+from sqlalchemy.orm import relationship
+from app.models.user import Base
+
+class Conversation(Base):
+    """会话列表读模型：每对用户两行，各自记录一侧的最后一条消息、未读数和已读水位"""
+    __tablename__ = "conversations"
+    __table_args__ = (
+        # 会话列表：按最后一条消息倒序分页
+        Index("ix_conversations_owner_last", "owner_id", "last_message_id"),
+    )
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    peer_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    last_message_id = Column(Integer, nullable=False)
+    last_from_id = Column(Integer, nullable=True)
+    last_msg_type = Column(String, nullable=True)
+    last_preview = Column(String, nullable=True)  # 最后一条消息摘要
+    last_at = Column(DateTime, nullable=True)
+    unread_count = Column(Integer, default=0, nullable=False)
+    # 已读水位：peer 发来的 id 不超过该值的消息都已读
+    last_read_message_id = Column(Integer, default=0, server_default="0", nullable=False)
+    peer = relationship("User", foreign_keys=[peer_id])
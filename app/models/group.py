@@ -0,0 +1,52 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
+from sqlalchemy.orm import relationship
+from datetime import datetime
+from app.models.user import Base
+
+class Group(Base):
+    """群聊：群消息只存一份，最后一条消息直接记在群上"""
+    __tablename__ = "groups"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_message_id = Column(Integer, default=0, server_default="0", nullable=False)
+    last_from_id = Column(Integer, nullable=True)
+    last_msg_type = Column(String, nullable=True)
+    last_preview = Column(String, nullable=True)  # 最后一条消息摘要
+    last_at = Column(DateTime, nullable=True)
+    members = relationship("GroupMember", back_populates="group")
+
+
+class GroupMember(Base):
+    """群成员，各自记录已读水位；未读数在读取时由水位之后的群消息数得出"""
+    __tablename__ = "group_members"
+    __table_args__ = (
+        # 我的群列表
+        Index("ix_group_members_user", "user_id", "group_id"),
+    )
+    group_id = Column(Integer, ForeignKey("groups.id"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    role = Column(String, default="member", nullable=False)  # owner/member
+    joined_at = Column(DateTime, default=datetime.utcnow)
+    # 已读水位：id 不超过该值的群消息都已读
+    last_read_message_id = Column(Integer, default=0, server_default="0", nullable=False)
+    group = relationship("Group", back_populates="members")
+    user = relationship("User", foreign_keys=[user_id])
+
+
+class GroupMessage(Base):
+    __tablename__ = "group_messages"
+    __table_args__ = (
+        # 群聊历史：按群定位后沿 id 做游标分页
+        Index("ix_group_messages_group_id", "group_id", "id"),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    group_id = Column(Integer, ForeignKey("groups.id"), nullable=False)
+    from_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    content = Column(String, nullable=True)
+    msg_type = Column(String, default="text")  # text, image, mixed
+    image_url = Column(String, nullable=True)
+    image_name = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sender = relationship("User", foreign_keys=[from_id])
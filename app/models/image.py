@@ -0,0 +1,28 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index, UniqueConstraint
+from datetime import datetime
+from app.models.user import Base
+
+class ImageBlob(Base):
+    """按内容哈希存储的图片，相同内容只保存一份"""
+    __tablename__ = "image_blobs"
+    sha256 = Column(String(64), primary_key=True)
+    url = Column(String, unique=True, nullable=False)  # 相对路径 uploads/images/xx/<sha256>.<ext>
+    size = Column(Integer, nullable=False)
+    content_type = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # 最近一次上传（含秒传）的时间，尚未被引用的图片在宽限期内不会被回收
+    last_uploaded_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class ImageRef(Base):
+    """图片引用：消息图片、用户头像等，没有引用的图片由后台任务回收"""
+    __tablename__ = "image_refs"
+    __table_args__ = (
+        UniqueConstraint("sha256", "ref_type", "ref_id", name="uq_image_refs_target"),
+        # 按引用方查找（例如更换头像时移除旧引用）
+        Index("ix_image_refs_owner", "ref_type", "ref_id"),
+    )
+    id = Column(Integer, primary_key=True)
+    sha256 = Column(String(64), ForeignKey("image_blobs.sha256"), nullable=False)
+    ref_type = Column(String, nullable=False)  # message, group_message, avatar
+    ref_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
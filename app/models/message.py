@@ -1,11 +1,17 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from datetime import timezone
+from datetime import datetime
 from app.models.user import Base
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # 会话历史：按 (发送方, 接收方) 定位后沿 id 做游标分页
+        Index("ix_messages_from_to_id", "from_id", "to_id", "id"),
+        # 消息 id 不能复用：归档、已读水位和全文检索都按 id 判断，最新的消息被归档后也不能再分配出去
+        {"sqlite_autoincrement": True},
+    )
     id = Column(Integer, primary_key=True, index=True)
     from_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     to_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -13,7 +19,8 @@ class Message(Base):
     msg_type = Column(String, default="text")  # text, image, mixed
     image_url = Column(String, nullable=True)  # 图片存储路径
     image_name = Column(String, nullable=True)  # 原始文件名
-    created_at = Column(DateTime, default=timezone.utc)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # 已不再维护：已读状态由 conversations.last_read_message_id 水位决定，保留该列兼容旧数据
     is_read = Column(Boolean, default=False)
     sender = relationship("User", foreign_keys=[from_id])
     receiver = relationship("User", foreign_keys=[to_id])
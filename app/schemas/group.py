@@ -0,0 +1,89 @@
+from pydantic import BaseModel, computed_field, field_serializer
+from typing import List, Optional
+from datetime import datetime
+from app.schemas.friend import FriendUserInfo
+from app.core.derivatives import derivative_urls
+
+
+class GroupCreate(BaseModel):
+    name: str
+    member_ids: List[int] = []
+
+
+class GroupMembersAdd(BaseModel):
+    user_ids: List[int]
+
+
+class GroupMessageSend(BaseModel):
+    content: Optional[str] = None
+    msg_type: Optional[str] = "text"
+    image_url: Optional[str] = None
+    image_name: Optional[str] = None
+
+
+class GroupMemberOut(BaseModel):
+    user_id: int
+    role: str
+    joined_at: datetime
+    last_read_message_id: int
+    user: Optional[FriendUserInfo] = None
+
+    @field_serializer('joined_at')
+    def serialize_joined_at(self, joined_at: datetime) -> str:
+        return joined_at.isoformat()
+
+    model_config = {"from_attributes": True}
+
+
+class GroupOut(BaseModel):
+    id: int
+    name: str
+    owner_id: int
+    created_at: datetime
+    last_message_id: int
+    last_from_id: Optional[int] = None
+    last_msg_type: Optional[str] = None
+    last_preview: Optional[str] = None
+    last_at: Optional[datetime] = None
+    # 当前用户的未读数和已读水位
+    unread_count: int = 0
+    last_read_message_id: int = 0
+
+    @field_serializer('created_at', 'last_at')
+    def serialize_datetime(self, value: Optional[datetime]) -> Optional[str]:
+        if value is None:
+            return None
+        return value.isoformat()
+
+    model_config = {"from_attributes": True}
+
+
+class GroupDetailOut(GroupOut):
+    members: List[GroupMemberOut] = []
+
+
+class GroupMessageOut(BaseModel):
+    id: int
+    group_id: int
+    from_id: int
+    content: Optional[str] = None
+    msg_type: str
+    image_url: Optional[str] = None
+    image_name: Optional[str] = None
+    created_at: datetime
+
+    @field_serializer('created_at')
+    def serialize_created_at(self, created_at: datetime) -> str:
+        return created_at.isoformat()
+
+    @computed_field
+    @property
+    def thumbnail_url(self) -> Optional[str]:
+        return derivative_urls(self.image_url)["thumbnail_url"]
+
+    @computed_field
+    @property
+    def preview_url(self) -> Optional[str]:
+        return derivative_urls(self.image_url)["preview_url"]
+
+    model_config = {"from_attributes": True}
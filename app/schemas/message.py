@@ -1,6 +1,8 @@
-from pydantic import BaseModel, field_serializer
+from pydantic import BaseModel, computed_field, field_serializer
 from typing import Optional
 from datetime import datetime
+from app.schemas.friend import FriendUserInfo
+from app.core.derivatives import derivative_urls
 
 class MessageSend(BaseModel):
     to_id: int
@@ -24,4 +26,35 @@ class MessageOut(BaseModel):
     def serialize_created_at(self, created_at: datetime) -> str:
         return created_at.isoformat()
 
+    # 图片消息的缩略图和预览图，客户端优先使用，点开后再加载原图
+    @computed_field
+    @property
+    def thumbnail_url(self) -> Optional[str]:
+        return derivative_urls(self.image_url)["thumbnail_url"]
+
+    @computed_field
+    @property
+    def preview_url(self) -> Optional[str]:
+        return derivative_urls(self.image_url)["preview_url"]
+
+    model_config = {"from_attributes": True}
+
+
+class ConversationOut(BaseModel):
+    peer_id: int
+    last_message_id: int
+    last_from_id: Optional[int] = None
+    last_msg_type: Optional[str] = None
+    last_preview: Optional[str] = None
+    last_at: Optional[datetime] = None
+    unread_count: int
+    last_read_message_id: int = 0
+    peer: Optional[FriendUserInfo] = None
+
+    @field_serializer('last_at')
+    def serialize_last_at(self, last_at: datetime) -> Optional[str]:
+        if last_at is None:
+            return None
+        return last_at.isoformat()
+
     model_config = {"from_attributes": True}
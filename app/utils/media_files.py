@@ -0,0 +1,121 @@
+"""
+上传文件的缓存友好输出
+
+上传目录中的文件名都不会复用（内容哈希或带随机后缀），同一地址的内容永远不变，
+因此响应带一年有效期的 immutable Cache-Control 和强 ETag，客户端不必重新验证；
+仍会重新验证的客户端（If-None-Match / If-Modified-Since）直接得到 304。
+Range 请求由 FileResponse 处理；服务器支持零拷贝扩展时用 sendfile 发送文件内容。
+"""
+import os
+import stat
+from email.utils import formatdate, parsedate
+from typing import Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from app.core.image_store import is_sha256
+
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class MediaFileResponse(FileResponse):
+    # 服务器不支持零拷贝时按较大的块读取，减少线程切换次数
+    chunk_size = 256 * 1024
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        extensions = scope.get("extensions") or {}
+        if (
+            "http.response.zerocopysend" in extensions
+            and scope["method"].upper() != "HEAD"
+            and "range" not in Headers(scope=scope)
+        ):
+            await self._zerocopy_send(send)
+            return
+        # 其余情况（含 Range、pathsend 扩展）交给 FileResponse
+        await super().__call__(scope, receive, send)
+
+    async def _zerocopy_send(self, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        f = await anyio.to_thread.run_sync(open, self.path, "rb")
+        try:
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": f.fileno(),
+                "count": self.stat_result.st_size,
+                "more_body": False,
+            })
+        finally:
+            f.close()
+
+
+def media_etag(path: str, stat_result: os.stat_result) -> str:
+    """以内容哈希命名的文件直接用哈希作 ETag，其他文件用修改时间和大小"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if is_sha256(stem) and "/derived/" not in path.replace(os.sep, "/"):
+        return f'"{stem}"'
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def is_not_modified(request_headers: Headers, etag: str, last_modified: str) -> bool:
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match 优先；按弱比较处理 W/ 前缀
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is not None:
+        since = parsedate(if_modified_since)
+        modified = parsedate(last_modified)
+        return since is not None and modified is not None and since >= modified
+    return False
+
+
+def resolve_media_path(root: str, path: str) -> Optional[str]:
+    """把请求路径映射到 root 下的文件，越界或隐藏文件（上传中的临时文件）返回 None"""
+    root = os.path.realpath(root)
+    full_path = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, full_path]) != root:
+        return None
+    if any(part.startswith(".") for part in os.path.relpath(full_path, root).split(os.sep)):
+        return None
+    return full_path
+
+
+def _lookup(root: str, path: str) -> Optional[Tuple[str, os.stat_result]]:
+    # 路径解析和 stat 合并为一次线程调用
+    full_path = resolve_media_path(root, path)
+    if full_path is None:
+        return None
+    try:
+        stat_result = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if not stat.S_ISREG(stat_result.st_mode):
+        return None
+    return full_path, stat_result
+
+
+async def media_response(
+    request: Request, root: str, path: str, media_type: Optional[str] = None
+) -> Optional[Response]:
+    """返回 root 下 path 对应文件的响应；文件不存在时返回 None"""
+    found = await anyio.to_thread.run_sync(_lookup, root, path)
+    if found is None:
+        return None
+    full_path, stat_result = found
+
+    etag = media_etag(full_path, stat_result)
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    headers = {
+        "cache-control": MEDIA_CACHE_CONTROL,
+        "etag": etag,
+        "last-modified": last_modified,
+    }
+    if is_not_modified(request.headers, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    return MediaFileResponse(full_path, headers=headers, media_type=media_type, stat_result=stat_result)
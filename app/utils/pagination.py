@@ -0,0 +1,41 @@
+import base64
+import json
+from typing import Tuple
+
+# 游标方向：before 向更早的消息翻页，after 拉取更新的消息
+CURSOR_DIRECTIONS = ("before", "after")
+
+
+def encode_cursor(direction: str, message_id: int) -> str:
+    """生成不透明游标，客户端原样回传即可"""
+    raw = json.dumps({"d": direction, "id": message_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """解析游标，格式不合法时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        direction, message_id = data["d"], int(data["id"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("invalid cursor") from e
+    if direction not in CURSOR_DIRECTIONS:
+        raise ValueError("invalid cursor")
+    return direction, message_id
+
+
+def encode_rank_cursor(score: float, message_id: int) -> str:
+    """按相关度排序的结果（如全文检索）的游标：上一页最后一条的分数和 id"""
+    raw = json.dumps({"s": score, "id": message_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_rank_cursor(cursor: str) -> Tuple[float, int]:
+    """解析相关度游标，格式不合法时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return float(data["s"]), int(data["id"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("invalid cursor") from e
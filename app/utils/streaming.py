@@ -0,0 +1,84 @@
+"""
+大结果集的流式输出
+
+查询结果逐批从数据库读出、逐条序列化，攒够一块再写给客户端，内存占用与结果总量无关。
+支持两种格式：
+- ndjson：每行一个 JSON 对象（application/x-ndjson），客户端可以边收边处理
+- json：普通 JSON 数组，分块发送，旧客户端无需改动
+"""
+import os
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from pydantic import BaseModel
+from starlette.responses import StreamingResponse
+
+# 每次从数据库读取的行数
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+# 攒够这么多字节才发送一块，减少线程切换和 send 次数
+STREAM_CHUNK_BYTES = int(os.getenv("STREAM_CHUNK_BYTES", str(64 * 1024)))
+
+STREAM_FORMATS = ("ndjson", "json")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "json": "application/json"}
+
+
+def _buffered(pieces: Iterable[bytes], chunk_bytes: int) -> Iterator[bytes]:
+    buffer = bytearray()
+    for piece in pieces:
+        buffer += piece
+        if len(buffer) >= chunk_bytes:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def ndjson_pieces(items: Iterable[BaseModel]) -> Iterator[bytes]:
+    for item in items:
+        yield item.model_dump_json().encode() + b"\n"
+
+
+def json_array_pieces(items: Iterable[BaseModel]) -> Iterator[bytes]:
+    separator = b"["
+    for item in items:
+        yield separator + item.model_dump_json().encode()
+        separator = b","
+    # 没有任何元素时输出 []
+    yield b"]" if separator == b"," else b"[]"
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """把输出流压缩为 gzip 文件格式"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_items(
+    items: Iterable[BaseModel],
+    output: str = "ndjson",
+    filename: Optional[str] = None,
+    compress: bool = False,
+) -> StreamingResponse:
+    """
+    把模型对象的迭代器输出为流式响应
+
+    items 可以是同步生成器（在线程池中迭代），数据库会话应在生成器内部打开和关闭，
+    这样响应发送期间会话一直可用，客户端断开时生成器关闭、会话随之释放。
+    filename 不为空时作为附件下载；compress 为 True 时输出 .gz 文件。
+    """
+    pieces = ndjson_pieces(items) if output == "ndjson" else json_array_pieces(items)
+    chunks = _buffered(pieces, STREAM_CHUNK_BYTES)
+    media_type = MEDIA_TYPES[output]
+    headers = {}
+    if compress:
+        chunks = gzip_chunks(chunks)
+        media_type = "application/gzip"
+        if filename:
+            filename += ".gz"
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
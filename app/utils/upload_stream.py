@@ -0,0 +1,162 @@
+"""
+流式接收 multipart 上传
+
+直接解析请求体流，文件内容按块写入目标目录下的临时文件并计算 sha256（磁盘 I/O 在线程中执行），
+超过大小限制时立即中止，不会先把整个请求体缓存下来。
+调用方校验通过后用 commit() 原子地重命名到最终路径。
+"""
+import asyncio
+import hashlib
+import os
+import uuid
+from typing import Callable, List, Optional, Tuple
+
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import Request
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class InvalidUpload(Exception):
+    pass
+
+
+class StreamedFile:
+    """已写入临时文件的上传文件"""
+
+    def __init__(self, filename: str, content_type: str, temp_path: str):
+        self.filename = filename
+        self.content_type = content_type
+        self.temp_path = temp_path
+        self.size = 0
+        self._hash = hashlib.sha256()
+
+    @property
+    def sha256(self) -> str:
+        """文件内容的 sha256（写入完成后有效）"""
+        return self._hash.hexdigest()
+
+    async def commit(self, path: str):
+        """原子地把临时文件移动到最终路径"""
+        await asyncio.to_thread(os.replace, self.temp_path, path)
+
+    async def discard(self):
+        await asyncio.to_thread(_remove_quietly, self.temp_path)
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _write_chunks(f, hasher, chunks: List[bytes]):
+    # 写盘的同时计算哈希，都在线程中执行
+    for chunk in chunks:
+        hasher.update(chunk)
+        f.write(chunk)
+
+
+async def receive_file(
+    request: Request,
+    field_name: str,
+    temp_dir: str,
+    max_size: int,
+    on_headers: Optional[Callable[[str, str], None]] = None,
+) -> StreamedFile:
+    """
+    从 multipart 请求体中读取名为 field_name 的文件字段写入临时文件。
+
+    on_headers(filename, content_type) 在写入任何数据前调用，可抛出异常拒绝上传。
+    超过 max_size 抛出 UploadTooLarge，请求格式错误或缺少该字段抛出 InvalidUpload；
+    出错时临时文件会被删除。
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise InvalidUpload("请求必须是 multipart/form-data")
+
+    # 解析回调只记录事件，写文件在回调外异步执行
+    events: List[Tuple[str, bytes]] = []
+    header_field = bytearray()
+    header_value = bytearray()
+
+    def on_header_field(data: bytes, start: int, end: int):
+        header_field.extend(data[start:end])
+
+    def on_header_value(data: bytes, start: int, end: int):
+        header_value.extend(data[start:end])
+
+    def on_header_end():
+        events.append(("header", bytes(header_field).lower() + b"\0" + bytes(header_value)))
+        header_field.clear()
+        header_value.clear()
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": lambda: events.append(("begin", b"")),
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": lambda: events.append(("headers_finished", b"")),
+        "on_part_data": lambda data, start, end: events.append(("data", bytes(data[start:end]))),
+        "on_part_end": lambda: events.append(("end", b"")),
+    })
+
+    result: Optional[StreamedFile] = None
+    # 当前 part 是否为目标文件字段，以及它的头部
+    in_target = False
+    part_headers = {}
+    f = None
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            pending: List[bytes] = []
+            for kind, data in events:
+                if kind == "begin":
+                    part_headers = {}
+                elif kind == "header":
+                    name, _, value = data.partition(b"\0")
+                    part_headers[name] = value
+                elif kind == "headers_finished":
+                    _, options = parse_options_header(part_headers.get(b"content-disposition", b""))
+                    in_target = (
+                        result is None
+                        and options.get(b"name", b"").decode("latin-1") == field_name
+                        and b"filename" in options
+                    )
+                    if in_target:
+                        filename = options[b"filename"].decode("utf-8", "replace")
+                        file_type = part_headers.get(b"content-type", b"").decode("latin-1")
+                        if on_headers is not None:
+                            on_headers(filename, file_type)
+                        temp_path = os.path.join(temp_dir, f".{uuid.uuid4().hex}.part")
+                        result = StreamedFile(filename, file_type, temp_path)
+                        f = await asyncio.to_thread(open, temp_path, "wb")
+                elif kind == "data" and in_target:
+                    result.size += len(data)
+                    if result.size > max_size:
+                        raise UploadTooLarge()
+                    pending.append(data)
+                elif kind == "end":
+                    in_target = False
+            events.clear()
+            if pending:
+                await asyncio.to_thread(_write_chunks, f, result._hash, pending)
+        parser.finalize()
+    except BaseException as e:
+        if f is not None:
+            await asyncio.to_thread(f.close)
+            await asyncio.to_thread(_remove_quietly, result.temp_path)
+        if isinstance(e, MultipartParseError):
+            raise InvalidUpload(f"请求格式错误: {e}") from e
+        raise
+
+    if f is not None:
+        await asyncio.to_thread(f.close)
+    if result is None:
+        raise InvalidUpload(f"缺少文件字段: {field_name}")
+    return result
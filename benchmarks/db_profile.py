@@ -0,0 +1,152 @@
+"""
+数据库引擎配置基准：对比 DB_PROFILE=default 与 DB_PROFILE=production 在读写混合负载下的表现
+
+每种配置在独立的子进程和临时目录中运行（配置在导入 app.core.database 时确定）：
+先写入一批历史消息，再启动 R 个读线程循环读取会话历史的第一页，
+W 个写线程循环发送消息（add + commit），持续 --duration 秒。
+
+输出每种配置的读 / 写吞吐、延迟分位数，以及 "database is locked" 等错误数。
+
+用法：
+    python benchmarks/db_profile.py --readers 16 --writers 4 --duration 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILES = ("default", "production")
+USERS = 20
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(len(values) * q), len(values) - 1)] * 1000, 3)
+
+
+def run_worker(args):
+    """子进程：在当前目录（临时目录）的 app.db 上按 DB_PROFILE 运行负载"""
+    sys.path.insert(0, ROOT)
+    from sqlalchemy.exc import OperationalError
+    from app.core.database import SessionLocal, engine, read_engine
+    from app.api.message import conversation_query
+    from app.models.message import Message
+    from app.models.user import User
+
+    with SessionLocal() as db:
+        db.add_all([User(username=f"user{i}", hashed_password="x") for i in range(USERS)])
+        db.commit()
+        now = datetime.utcnow()
+        db.add_all([
+            Message(from_id=i % USERS + 1, to_id=(i * 7) % USERS + 1, content=f"history {i}",
+                    msg_type="text", created_at=now, is_read=False)
+            for i in range(args.seed)
+        ])
+        db.commit()
+
+    stop = threading.Event()
+    results = {"read": [], "write": []}
+    errors = {"read": 0, "write": 0}
+    lock = threading.Lock()
+
+    def reader(n: int):
+        latencies = []
+        while not stop.is_set():
+            a, b = n % USERS + 1, (n * 7) % USERS + 1
+            started = time.perf_counter()
+            try:
+                with SessionLocal() as db:
+                    db.execute(conversation_query(a, b, limit=20)).scalars().all()
+                latencies.append(time.perf_counter() - started)
+            except OperationalError:
+                with lock:
+                    errors["read"] += 1
+            n += 1
+        with lock:
+            results["read"].extend(latencies)
+
+    def writer(n: int):
+        latencies = []
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with SessionLocal() as db:
+                    db.add(Message(from_id=n % USERS + 1, to_id=(n * 3) % USERS + 1, content=f"message {n}",
+                                   msg_type="text", created_at=datetime.utcnow(), is_read=False))
+                    db.commit()
+                latencies.append(time.perf_counter() - started)
+            except OperationalError:
+                with lock:
+                    errors["write"] += 1
+            n += 1
+        with lock:
+            results["write"].extend(latencies)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    engine.dispose()
+    read_engine.dispose()
+
+    print(json.dumps({
+        "profile": os.environ["DB_PROFILE"],
+        "reads_per_s": round(len(results["read"]) / elapsed, 1),
+        "read_p50_ms": percentile(results["read"], 0.5),
+        "read_p99_ms": percentile(results["read"], 0.99),
+        "read_errors": errors["read"],
+        "writes_per_s": round(len(results["write"]) / elapsed, 1),
+        "write_p50_ms": percentile(results["write"], 0.5),
+        "write_p99_ms": percentile(results["write"], 0.99),
+        "write_errors": errors["write"],
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, default=16, help="读线程数")
+    parser.add_argument("--writers", type=int, default=4, help="写线程数")
+    parser.add_argument("--duration", type=float, default=10, help="每种配置的运行时间（秒）")
+    parser.add_argument("--seed", type=int, default=50000, help="预先写入的历史消息数")
+    parser.add_argument("--profile", choices=PROFILES, nargs="*", default=list(PROFILES), help="要测试的配置")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    results = []
+    for profile in args.profile:
+        with tempfile.TemporaryDirectory() as tmp:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker",
+                 "--readers", str(args.readers), "--writers", str(args.writers),
+                 "--duration", str(args.duration), "--seed", str(args.seed)],
+                cwd=tmp, env={**os.environ, "DB_PROFILE": profile},
+                capture_output=True, text=True, check=True,
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    header = list(results[0].keys())
+    print("\t".join(header))
+    for row in results:
+        print("\t".join(str(row[k]) for k in header))
+
+
+if __name__ == "__main__":
+    main()
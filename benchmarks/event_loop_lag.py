@@ -0,0 +1,132 @@
+"""
+事件循环延迟基准：对比 WebSocket 消息写库时同步 Session 与异步 Session 的影响
+
+模拟 N 个并发发送方，每个发送方循环执行 ws_chat 中的写库流程
+（add + commit + refresh），同时用一个探针协程每 1ms 醒来一次，
+记录实际唤醒时间与预期时间的差值，即事件循环延迟。
+
+用法：
+    python benchmarks/event_loop_lag.py --senders 50 --messages 40
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from app.models.user import Base, User
+from app.models.friend import Friend  # noqa: F401 确保表被创建
+from app.models.message import Message
+
+PROBE_INTERVAL = 0.001
+
+
+async def probe(lags: list, stop: asyncio.Event):
+    """每隔 PROBE_INTERVAL 醒来一次，记录超出预期的延迟（毫秒）"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append((loop.time() - start - PROBE_INTERVAL) * 1000)
+
+
+def new_message(i: int) -> Message:
+    return Message(
+        from_id=1,
+        to_id=2,
+        content=f"message {i}",
+        msg_type="text",
+        created_at=datetime.utcnow(),
+        is_read=False,
+    )
+
+
+async def sync_sender(SessionLocal, count: int):
+    """旧路径：在协程中直接使用同步 Session"""
+    for i in range(count):
+        db = SessionLocal()
+        try:
+            message = new_message(i)
+            db.add(message)
+            db.commit()
+            db.refresh(message)
+        finally:
+            db.close()
+        await asyncio.sleep(0)
+
+
+async def async_sender(AsyncSessionLocal, count: int):
+    """新路径：使用 AsyncSession（aiosqlite）"""
+    for i in range(count):
+        async with AsyncSessionLocal() as db:
+            message = new_message(i)
+            db.add(message)
+            await db.commit()
+            await db.refresh(message)
+
+
+async def run_case(name: str, sender, session_factory, senders: int, messages: int):
+    lags = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(lags, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(sender(session_factory, messages) for _ in range(senders)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe_task
+
+    lags.sort()
+    total = senders * messages
+    return {
+        "case": name,
+        "messages": total,
+        "elapsed_s": round(elapsed, 3),
+        "msg_per_s": round(total / elapsed, 1),
+        "probe_samples": len(lags),
+        "lag_p50_ms": round(statistics.median(lags), 3) if lags else None,
+        "lag_p99_ms": round(lags[int(len(lags) * 0.99) - 1], 3) if lags else None,
+        "lag_max_ms": round(lags[-1], 3) if lags else None,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--senders", type=int, default=50, help="并发发送方数量")
+    parser.add_argument("--messages", type=int, default=40, help="每个发送方发送的消息数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        with SessionLocal() as db:
+            db.add_all([User(username="a", hashed_password="x"), User(username="b", hashed_password="x")])
+            db.commit()
+
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+        AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+        results = [
+            await run_case("sync_session", sync_sender, SessionLocal, args.senders, args.messages),
+            await run_case("async_session", async_sender, AsyncSessionLocal, args.senders, args.messages),
+        ]
+        await async_engine.dispose()
+        engine.dispose()
+
+    header = list(results[0].keys())
+    print("\t".join(header))
+    for row in results:
+        print("\t".join(str(row[k]) for k in header))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+"""
+WebSocket 帧编码基准
+
+对比三种方式推送聊天消息、已读回执和上线通知的成本：
+- stdlib：原来的做法，每个接收方各调用一次 json.dumps
+- frame-json：app/core/frames.py 的 Frame，orjson 编码一次，所有接收方复用
+- frame-msgpack：同上，使用 MessagePack 子协议
+
+输出每帧编码耗时（单个接收方）、扇出给 N 个接收方的总编码耗时和每帧字节数。
+
+用法：
+    python benchmarks/frame_encoding.py --recipients 50 --rounds 20000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.frames import Frame  # noqa: E402
+
+NOW = datetime.now(timezone.utc).isoformat()
+
+FRAMES = {
+    "chat": {
+        "from_id": 1024,
+        "to_id": 2048,
+        "content": "今晚七点老地方见，记得带上次说的那本书 📚",
+        "msg_type": "mixed",
+        "image_url": "uploads/images/9f/9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08.jpg",
+        "image_name": "IMG_2041.jpg",
+        "thumbnail_url": "uploads/derived/thumb/9f/9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08.webp",
+        "preview_url": "uploads/derived/preview/9f/9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08.webp",
+        "created_at": NOW,
+        "id": 1234567,
+    },
+    "receipt": {
+        "msg_type": "read_receipt",
+        "from_id": 2048,
+        "to_id": 1024,
+        "message_ids": list(range(1234500, 1234520)),
+        "updated": 20,
+        "last_read_message_id": 1234519,
+    },
+    "presence": {
+        "msg_type": "user_status",
+        "user_id": 1024,
+        "status": "online",
+        "timestamp": NOW,
+    },
+}
+
+
+def per_frame_us(fn, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+def bench(name: str, payload: dict, recipients: int, rounds: int):
+    def stdlib_fanout():
+        for _ in range(recipients):
+            json.dumps(payload)
+
+    def frame_fanout(encode):
+        def run():
+            frame = Frame(payload)
+            for _ in range(recipients):
+                encode(frame)
+        return run
+
+    fanout_rounds = max(rounds // recipients, 1)
+    rows = [
+        ("stdlib", per_frame_us(lambda: json.dumps(payload), rounds),
+         per_frame_us(stdlib_fanout, fanout_rounds), len(json.dumps(payload).encode())),
+        ("frame-json", per_frame_us(lambda: Frame(payload).json(), rounds),
+         per_frame_us(frame_fanout(Frame.json), fanout_rounds), len(Frame(payload).json().encode())),
+        ("frame-msgpack", per_frame_us(lambda: Frame(payload).msgpack(), rounds),
+         per_frame_us(frame_fanout(Frame.msgpack), fanout_rounds), len(Frame(payload).msgpack())),
+    ]
+    return [
+        {"frame": name, "encoder": encoder, "encode_us": round(single, 2),
+         f"fanout_{recipients}_us": round(fanout, 2), "bytes": size}
+        for encoder, single, fanout, size in rows
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipients", type=int, default=50, help="扇出的接收方数量（例如好友数）")
+    parser.add_argument("--rounds", type=int, default=20000, help="每项测量的编码次数")
+    args = parser.parse_args()
+
+    results = []
+    for name, payload in FRAMES.items():
+        results.extend(bench(name, payload, args.recipients, args.rounds))
+
+    header = list(results[0].keys())
+    print("\t".join(header))
+    for row in results:
+        print("\t".join(str(row[k]) for k in header))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+上传文件下载基准：对比原来的 StaticFiles 挂载与 app/api/media.py 的缓存友好输出
+
+在临时目录生成一批图片大小的文件，分别用 uvicorn 启动两种 /uploads 服务，
+并发客户端依次执行：
+- cold：首次打开会话，完整下载全部文件
+- revisit：再次打开会话。客户端按浏览器的方式处理缓存：响应带 immutable 且在有效期内时
+  不发请求，否则带 If-None-Match 重新验证
+- range：按 Range 请求读取文件开头 64KB（例如渐进加载）
+
+输出每种场景的请求数、req/s 和实际传输的响应体字节数。
+
+用法：
+    python benchmarks/media_serving.py --files 200 --concurrency 32
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_app(kind: str):
+    """子进程中调用：构造只包含 /uploads 的应用"""
+    sys.path.insert(0, ROOT)
+    from fastapi import FastAPI
+
+    app = FastAPI()
+    if kind == "static":
+        from fastapi.staticfiles import StaticFiles
+
+        app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+    else:
+        from app.api import media
+
+        app.include_router(media.router, prefix="/uploads")
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_files(directory: str, count: int):
+    os.makedirs(os.path.join(directory, "uploads", "images"))
+    rng = random.Random(42)
+    urls = []
+    for i in range(count):
+        name = f"{i:064x}.png"
+        size = rng.randint(20 * 1024, 400 * 1024)
+        with open(os.path.join(directory, "uploads", "images", name), "wb") as f:
+            f.write(os.urandom(size))
+        urls.append(f"/uploads/images/{name}")
+    return urls
+
+
+def start_server(kind: str, cwd: str, port: int) -> subprocess.Popen:
+    code = (
+        "import sys, uvicorn; sys.path.insert(0, %r); "
+        "from benchmarks.media_serving import build_app; "
+        "uvicorn.run(build_app(%r), host='127.0.0.1', port=%d, log_level='warning')"
+    ) % (ROOT, kind, port)
+    proc = subprocess.Popen([sys.executable, "-c", code], cwd=cwd)
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{kind} server did not start")
+
+
+class BrowserCache:
+    """最简化的浏览器缓存：immutable + max-age 内直接命中，否则带 ETag 重新验证"""
+
+    def __init__(self):
+        self.entries = {}
+
+    def request_headers(self, url):
+        entry = self.entries.get(url)
+        if entry is None:
+            return {}, False
+        headers, stored_at = entry
+        cache_control = headers.get("cache-control", "")
+        if "immutable" in cache_control and "max-age=" in cache_control:
+            max_age = int(cache_control.split("max-age=")[1].split(",")[0])
+            if time.time() - stored_at < max_age:
+                return None, True
+        return ({"If-None-Match": headers["etag"]} if "etag" in headers else {}), False
+
+    def store(self, url, headers):
+        self.entries[url] = (headers, time.time())
+
+
+async def run_scenario(client, urls, concurrency, cache=None, headers=None):
+    queue = list(urls)
+    stats = {"requests": 0, "cache_hits": 0, "bytes": 0, "not_modified": 0}
+
+    async def worker():
+        while queue:
+            url = queue.pop()
+            request_headers = dict(headers or {})
+            if cache is not None:
+                conditional, hit = cache.request_headers(url)
+                if hit:
+                    stats["cache_hits"] += 1
+                    continue
+                request_headers.update(conditional)
+            response = await client.get(url, headers=request_headers)
+            stats["requests"] += 1
+            stats["bytes"] += len(response.content)
+            if response.status_code == 304:
+                stats["not_modified"] += 1
+            elif cache is not None and response.status_code == 200:
+                cache.store(url, response.headers)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stats["elapsed_s"] = round(elapsed, 3)
+    stats["req_per_s"] = round(stats["requests"] / elapsed, 1) if stats["requests"] else None
+    stats["mb"] = round(stats["bytes"] / 1024 / 1024, 2)
+    del stats["bytes"]
+    return stats
+
+
+async def bench(kind: str, port: int, urls, concurrency: int):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as client:
+        await run_scenario(client, urls[:concurrency], concurrency)  # 预热
+        cache = BrowserCache()
+        rows = [
+            {"server": kind, "scenario": "cold", **await run_scenario(client, urls, concurrency, cache)},
+            {"server": kind, "scenario": "revisit", **await run_scenario(client, urls, concurrency, cache)},
+            {"server": kind, "scenario": "range",
+             **await run_scenario(client, urls, concurrency, headers={"Range": "bytes=0-65535"})},
+        ]
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=200, help="文件数量")
+    parser.add_argument("--concurrency", type=int, default=32, help="并发请求数")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        urls = make_files(tmp, args.files)
+        for kind in ("static", "media"):
+            port = free_port()
+            proc = start_server(kind, tmp, port)
+            try:
+                results.extend(asyncio.run(bench(kind, port, urls, args.concurrency)))
+            finally:
+                proc.terminate()
+                proc.wait()
+
+    header = ["server", "scenario", "requests", "cache_hits", "not_modified", "elapsed_s", "req_per_s", "mb"]
+    print("\t".join(header))
+    for row in results:
+        print("\t".join(str(row[k]) for k in header))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,531 @@
+"""
+WebSocket 负载基准：单个应用进程能承载多少 /api/ws/chat 连接、每秒多少条消息，以及端到端投递延迟
+
+在临时目录中：
+1. 直接写库创建 N 个用户和好友关系（每人 --friends 个好友，按编号环形相邻），为每个用户签发 token
+2. 用 uvicorn 启动完整应用（app.main:app，单进程），DB_PROFILE、WS_SEND_QUEUE 等环境变量原样传入
+3. 由 --processes 个客户端进程共打开 M 个 WebSocket 连接（编号最小的 M 个用户），全部连上后同时开始
+4. 每个连接按开环的泊松过程发送帧，总速率为 --rate 帧/秒，按 --mix 的比例混合：
+   - chat：发给一个在线好友，内容中带计划发送时刻，接收方收到推送时计算端到端延迟
+   - read：对最近收到的一条消息发已读回执，原发送方收到 read_receipt 时计算延迟
+     （回执跨客户端进程时只计数，不计算延迟）
+   - heartbeat：心跳帧
+   延迟从计划发送时刻算起：服务端或客户端跟不上时延迟会如实变大，不会因为排队而少算
+5. 运行 --duration 秒后停止发送，等待剩余推送全部收到（最多 --drain 秒），收不到的计为未送达
+
+客户端与服务端须在同一台机器上（延迟用 CLOCK_MONOTONIC 计算）。
+服务端 CPU 占用和 RSS 取自 /proc（仅 Linux），统计区间为发送阶段；
+客户端 CPU 占用接近 100% × 进程数时，瓶颈在客户端，应增加 --processes。
+
+默认输出一行制表符分隔的结果；--output 把完整结果（含参数、git commit、/api/ws/metrics）
+作为一行 JSON 追加到文件，便于对比不同提交，--output - 输出到标准输出。
+
+用法：
+    python benchmarks/ws_load.py --users 1000 --connections 1000 --rate 2000 --duration 30
+    python benchmarks/ws_load.py --rate 5000 --processes 4 --codec msgpack --output ws_load.jsonl
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import msgpack
+import websockets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FRAME_TYPES = ("chat", "read", "heartbeat")
+SUBPROTOCOLS = {"json": "chat.json", "msgpack": "chat.msgpack"}
+# 同时进行的握手数，避免超出监听队列
+CONNECT_CONCURRENCY = 64
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def percentile(values: list, q: float):
+    """values 为微秒，返回毫秒"""
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(len(values) * q), len(values) - 1)] / 1000, 3)
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in FRAME_TYPES:
+            raise argparse.ArgumentTypeError(f"未知的帧类型: {name}")
+        mix[name] = float(weight)
+    if sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("--mix 的权重之和必须大于 0")
+    return mix
+
+
+def friend_indexes(index: int, users: int, friends: int) -> list:
+    """环形相邻的好友：前后各 friends / 2 个"""
+    half = max(friends // 2, 1)
+    return sorted({(index + k) % users for k in range(-half, half + 1) if k and (index + k) % users != index})
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+# ---------- 准备数据（子进程，在临时目录中执行） ----------
+
+def run_provision(args):
+    """创建用户和好友关系，输出 [[user_id, token], ...]（按编号顺序）"""
+    sys.path.insert(0, ROOT)
+    from app.core.database import SessionLocal, engine, read_engine
+    from app.core.security import create_access_token, get_password_hash
+    from app.models.friend import Friend
+    from app.models.user import User
+
+    hashed_password = get_password_hash("benchmark")
+    with SessionLocal() as db:
+        users = [User(username=f"bench{i}", hashed_password=hashed_password) for i in range(args.users)]
+        db.add_all(users)
+        db.commit()
+        ids = [user.id for user in users]
+        db.add_all([
+            Friend(user_id=ids[i], friend_id=ids[j], status="accepted")
+            for i in range(args.users)
+            for j in friend_indexes(i, args.users, args.friends)
+        ])
+        db.commit()
+    engine.dispose()
+    read_engine.dispose()
+
+    # token 有效期覆盖整个运行过程
+    expires = timedelta(seconds=args.duration + args.drain + 3600)
+    print(json.dumps([
+        [user_id, create_access_token({"sub": f"bench{i}"}, expires)] for i, user_id in enumerate(ids)
+    ]))
+
+
+# ---------- 客户端（子进程） ----------
+
+class Stats:
+    def __init__(self):
+        self.sent = {name: 0 for name in FRAME_TYPES}
+        # 接收方 user_id -> 发给它的 chat 和 read_receipt 帧数
+        self.sent_to = {}
+        # 没有在线好友或没有可回执的消息时跳过的帧
+        self.skipped = 0
+        self.received_chat = 0
+        self.received_receipts = 0
+        self.chat_latency = []
+        self.receipt_latency = []
+        self.errors = 0
+        self.disconnects = 0
+
+    def expect(self, user_id: int):
+        self.sent_to[user_id] = self.sent_to.get(user_id, 0) + 1
+
+    @property
+    def received(self) -> int:
+        return self.received_chat + self.received_receipts
+
+
+class Client:
+    def __init__(self, user_id: int, token: str, friends: list, codec: str):
+        self.user_id = user_id
+        self.token = token
+        self.friends = friends
+        self.codec = codec
+        self.websocket = None
+        # 最近收到的一条消息 (from_id, message_id)，用于发已读回执
+        self.last_message = None
+
+    async def connect(self, url: str):
+        self.websocket = await websockets.connect(
+            f"{url}/api/ws/chat/{self.token}",
+            subprotocols=[SUBPROTOCOLS[self.codec]],
+            max_size=None,
+            ping_interval=None,
+            open_timeout=60,
+        )
+
+    async def send(self, payload: dict):
+        if self.codec == "msgpack":
+            await self.websocket.send(msgpack.packb(payload))
+        else:
+            await self.websocket.send(json.dumps(payload))
+
+    async def receive_loop(self, stats: Stats, pending_receipts: dict):
+        try:
+            async for data in self.websocket:
+                now = time.monotonic_ns()
+                frame = msgpack.unpackb(data) if isinstance(data, bytes) else json.loads(data)
+                msg_type = frame.get("msg_type")
+                if msg_type == "read_receipt":
+                    stats.received_receipts += 1
+                    for message_id in frame.get("message_ids") or []:
+                        started = pending_receipts.pop((frame["from_id"], message_id), None)
+                        if started is not None:
+                            stats.receipt_latency.append((now - started) // 1000)
+                elif msg_type == "error":
+                    stats.errors += 1
+                elif frame.get("to_id") == self.user_id and frame.get("id") is not None:
+                    stats.received_chat += 1
+                    self.last_message = (frame["from_id"], frame["id"])
+                    started = int(frame["content"].split(" ", 1)[0])
+                    stats.chat_latency.append((now - started) // 1000)
+        except websockets.ConnectionClosed:
+            pass
+        stats.disconnects += 1
+
+    async def drive(self, rate: float, mix: dict, deadline: float, stats: Stats, pending_receipts: dict,
+                    message_size: int, rng: random.Random):
+        """开环发送：按泊松过程安排计划发送时刻，落后时立即补发"""
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        padding = "x" * message_size
+        scheduled = time.monotonic() + rng.expovariate(rate)
+        while scheduled < deadline:
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            scheduled_ns = int(scheduled * 1e9)
+            name = rng.choices(names, weights)[0]
+            try:
+                if name == "chat" and self.friends:
+                    to_id = rng.choice(self.friends)
+                    await self.send({"msg_type": "text", "to_id": to_id, "content": f"{scheduled_ns} {padding}"})
+                    stats.sent["chat"] += 1
+                    stats.expect(to_id)
+                elif name == "read" and self.last_message is not None:
+                    from_id, message_id = self.last_message
+                    self.last_message = None
+                    pending_receipts[(self.user_id, message_id)] = scheduled_ns
+                    await self.send({"msg_type": "read", "from_id": from_id, "message_ids": [message_id]})
+                    stats.sent["read"] += 1
+                    stats.expect(from_id)
+                elif name == "heartbeat":
+                    await self.send({"msg_type": "heartbeat"})
+                    stats.sent["heartbeat"] += 1
+                else:
+                    stats.skipped += 1
+            except websockets.ConnectionClosed:
+                return
+            scheduled += rng.expovariate(rate)
+
+
+async def run_clients(args, plan: dict):
+    clients = [Client(user_id, token, friends, args.codec) for user_id, token, friends in plan["clients"]]
+    stats = Stats()
+    # (已读方, 消息 id) -> 计划发送时刻；只记录本进程内发出的回执
+    pending_receipts = {}
+    loop = asyncio.get_running_loop()
+
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def connect(client):
+        async with semaphore:
+            await client.connect(plan["url"])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connect(client) for client in clients))
+    connect_s = time.perf_counter() - started
+    receivers = [asyncio.create_task(client.receive_loop(stats, pending_receipts)) for client in clients]
+
+    # 通知主进程已连接，等待统一开始
+    print("ready", flush=True)
+    await loop.run_in_executor(None, sys.stdin.readline)
+
+    cpu_started = os.times()
+    deadline = time.monotonic() + args.duration
+    rng = random.Random(plan["seed"])
+    rate = args.rate / args.connections
+    await asyncio.gather(*(
+        client.drive(rate, args.mix, deadline, stats, pending_receipts, args.message_size,
+                     random.Random(rng.random()))
+        for client in clients
+    ))
+    cpu_ended = os.times()
+
+    # 报告发给各用户的帧数，主进程汇总后告知本进程应收到的帧数
+    print(json.dumps(stats.sent_to), flush=True)
+    expected = int(await loop.run_in_executor(None, sys.stdin.readline))
+    drain_deadline = time.monotonic() + args.drain
+    while stats.received < expected and time.monotonic() < drain_deadline:
+        await asyncio.sleep(0.05)
+
+    print(json.dumps({
+        "connect_s": connect_s,
+        "sent": stats.sent,
+        "skipped": stats.skipped,
+        "received_chat": stats.received_chat,
+        "received_receipts": stats.received_receipts,
+        "chat_latency_us": stats.chat_latency,
+        "receipt_latency_us": stats.receipt_latency,
+        "errors": stats.errors,
+        "disconnects": stats.disconnects,
+        "cpu_s": (cpu_ended.user + cpu_ended.system) - (cpu_started.user + cpu_started.system),
+    }), flush=True)
+
+    # 保持连接，直到主进程读取完服务端指标
+    await loop.run_in_executor(None, sys.stdin.readline)
+    await asyncio.gather(*(client.websocket.close() for client in clients), return_exceptions=True)
+    for task in receivers:
+        task.cancel()
+
+
+def run_worker(args):
+    raise_fd_limit()
+    with open(args.plan) as f:
+        plan = json.load(f)
+    asyncio.run(run_clients(args, plan))
+
+
+# ---------- 服务端 ----------
+
+def start_server(cwd: str, port: int) -> subprocess.Popen:
+    code = (
+        "import resource, sys, uvicorn; sys.path.insert(0, %r); "
+        "soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE); "
+        "resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard)); "
+        "uvicorn.run('app.main:app', host='127.0.0.1', port=%d, log_level='warning', backlog=4096)"
+    ) % (ROOT, port)
+    proc = subprocess.Popen([sys.executable, "-c", code], cwd=cwd)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return proc
+        except OSError:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime、stime 为第 14、15 个字段，rsplit 后从第 3 个字段开始
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid: int, interval: float = 0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = rss_mb(pid)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, rss_mb(self.pid))
+
+
+# ---------- 主流程 ----------
+
+def bench(args, tmp: str) -> dict:
+    users = json.loads(subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--provision",
+         "--users", str(args.users), "--friends", str(args.friends),
+         "--duration", str(args.duration), "--drain", str(args.drain)],
+        cwd=tmp, capture_output=True, text=True, check=True,
+    ).stdout.strip().splitlines()[-1])
+
+    port = free_port()
+    server = start_server(tmp, port)
+    workers = []
+    plans = []
+    try:
+        rss_idle = rss_mb(server.pid)
+        for k in range(args.processes):
+            # 客户端按编号轮流分配给各进程
+            clients = [
+                [users[i][0], users[i][1],
+                 [users[j][0] for j in friend_indexes(i, args.users, args.friends) if j < args.connections]]
+                for i in range(k, args.connections, args.processes)
+            ]
+            plans.append(clients)
+            path = os.path.join(tmp, f"plan{k}.json")
+            with open(path, "w") as f:
+                json.dump({"url": f"ws://127.0.0.1:{port}", "seed": args.seed + k, "clients": clients}, f)
+            workers.append(subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "--worker", "--plan", path,
+                 "--connections", str(args.connections), "--rate", str(args.rate),
+                 "--mix", ",".join(f"{name}={weight}" for name, weight in args.mix.items()),
+                 "--duration", str(args.duration), "--drain", str(args.drain),
+                 "--message-size", str(args.message_size), "--codec", args.codec],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+            ))
+        for worker in workers:
+            if worker.stdout.readline().strip() != "ready":
+                raise RuntimeError("client worker failed to connect")
+        rss_connected = rss_mb(server.pid)
+
+        sampler = RssSampler(server.pid)
+        sampler.start()
+        cpu_started = cpu_seconds(server.pid)
+        for worker in workers:
+            worker.stdin.write("go\n")
+            worker.stdin.flush()
+        time.sleep(args.duration)
+        server_cpu = cpu_seconds(server.pid) - cpu_started
+        rss_end = rss_mb(server.pid)
+
+        owner = {user_id: k for k, plan in enumerate(plans) for user_id, _, _ in plan}
+        expected = [0] * args.processes
+        for worker in workers:
+            for user_id, count in json.loads(worker.stdout.readline()).items():
+                expected[owner[int(user_id)]] += count
+        for worker, count in zip(workers, expected):
+            worker.stdin.write(f"{count}\n")
+            worker.stdin.flush()
+        results = [json.loads(worker.stdout.readline()) for worker in workers]
+        sampler.stopped.set()
+        ws_metrics = httpx.get(f"http://127.0.0.1:{port}/api/ws/metrics", timeout=30).json()
+        for worker in workers:
+            worker.stdin.close()
+            worker.wait()
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.kill()
+        server.terminate()
+        server.wait()
+
+    chat_latency = [v for r in results for v in r["chat_latency_us"]]
+    receipt_latency = [v for r in results for v in r["receipt_latency_us"]]
+    sent = {name: sum(r["sent"][name] for r in results) for name in FRAME_TYPES}
+    received_chat = sum(r["received_chat"] for r in results)
+    return {
+        "connections": args.connections,
+        "connect_s": round(max(r["connect_s"] for r in results), 3),
+        "target_rate": args.rate,
+        "frames_per_s": round(sum(sent.values()) / args.duration, 1),
+        "chat_per_s": round(sent["chat"] / args.duration, 1),
+        "read_per_s": round(sent["read"] / args.duration, 1),
+        "heartbeat_per_s": round(sent["heartbeat"] / args.duration, 1),
+        "delivered_per_s": round(received_chat / args.duration, 1),
+        "chat_p50_ms": percentile(chat_latency, 0.5),
+        "chat_p95_ms": percentile(chat_latency, 0.95),
+        "chat_p99_ms": percentile(chat_latency, 0.99),
+        "chat_max_ms": percentile(chat_latency, 1.0),
+        "receipt_p50_ms": percentile(receipt_latency, 0.5),
+        "receipt_p95_ms": percentile(receipt_latency, 0.95),
+        "receipt_p99_ms": percentile(receipt_latency, 0.99),
+        "undelivered": sent["chat"] - received_chat,
+        "receipts_missing": sent["read"] - sum(r["received_receipts"] for r in results),
+        "skipped": sum(r["skipped"] for r in results),
+        "errors": sum(r["errors"] for r in results),
+        "disconnects": sum(r["disconnects"] for r in results),
+        "server_cpu_pct": round(server_cpu / args.duration * 100, 1),
+        "server_rss_idle_mb": round(rss_idle, 1),
+        "server_rss_peak_mb": round(max(sampler.peak, rss_end), 1),
+        "rss_per_conn_kb": round((rss_connected - rss_idle) * 1024 / args.connections, 1),
+        "client_cpu_pct": round(sum(r["cpu_s"] for r in results) / args.duration * 100, 1),
+        "ws_metrics": ws_metrics,
+    }
+
+
+TABLE_COLUMNS = [
+    "connections", "target_rate", "frames_per_s", "delivered_per_s",
+    "chat_p50_ms", "chat_p95_ms", "chat_p99_ms", "receipt_p50_ms", "receipt_p99_ms",
+    "undelivered", "errors", "server_cpu_pct", "server_rss_peak_mb", "rss_per_conn_kb", "client_cpu_pct",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="创建的用户数")
+    parser.add_argument("--friends", type=int, default=20, help="每个用户的好友数")
+    parser.add_argument("--connections", type=int, default=None, help="WebSocket 连接数（默认等于 --users）")
+    parser.add_argument("--rate", type=float, default=1000, help="所有连接合计每秒发送的帧数")
+    parser.add_argument("--mix", type=parse_mix, default="chat=80,read=15,heartbeat=5",
+                        help="chat / read / heartbeat 帧的比例")
+    parser.add_argument("--duration", type=float, default=20, help="发送阶段时长（秒）")
+    parser.add_argument("--drain", type=float, default=10, help="停止发送后最多等待剩余推送的时间（秒）")
+    parser.add_argument("--message-size", type=int, default=64, help="chat 消息内容的填充长度")
+    parser.add_argument("--codec", choices=list(SUBPROTOCOLS), default="json", help="WebSocket 帧编码")
+    parser.add_argument("--processes", type=int, default=1, help="客户端进程数")
+    parser.add_argument("--seed", type=int, default=42, help="随机数种子")
+    parser.add_argument("--output", help="把完整结果作为一行 JSON 追加到该文件，- 表示标准输出")
+    parser.add_argument("--provision", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--plan", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.connections is None:
+        args.connections = args.users
+    if not 0 < args.connections <= args.users:
+        parser.error("--connections 须在 1 到 --users 之间")
+
+    if args.provision:
+        run_provision(args)
+        return
+    if args.worker:
+        run_worker(args)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        result = bench(args, tmp)
+
+    if args.output:
+        commit, dirty = git_commit()
+        record = {
+            "commit": commit,
+            "dirty": dirty,
+            "time": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "db_profile": os.getenv("DB_PROFILE", "default"),
+            "args": {k: v for k, v in vars(args).items() if k not in ("provision", "worker", "plan", "output")},
+            **result,
+        }
+        line = json.dumps(record, ensure_ascii=False)
+        if args.output == "-":
+            print(line)
+            return
+        with open(args.output, "a") as f:
+            f.write(line + "\n")
+
+    print("\t".join(TABLE_COLUMNS))
+    print("\t".join(str(result[k]) for k in TABLE_COLUMNS))
+
+
+if __name__ == "__main__":
+    main()
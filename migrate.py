@@ -0,0 +1,60 @@
+"""
+数据库迁移：按版本顺序执行 app/migrations 中尚未执行的迁移
+
+每个迁移分批执行、每批都是短事务，执行期间应用可以正常读写；
+中断后重新执行会从上次的检查点继续。
+
+用法：
+    python migrate.py             # 执行全部待执行的迁移
+    python migrate.py status      # 查看各版本的状态
+    python migrate.py baseline    # 数据库由当前代码新建时，把全部版本记为已执行
+"""
+import os
+import sys
+import time
+
+from app.core.migrations import apply_migration, applied_versions, connect, mark_applied
+from app.migrations import MIGRATIONS
+
+def migrate_database(command="up"):
+    db_path = "app.db"
+
+    if not os.path.exists(db_path):
+        print("数据库文件不存在，将自动创建")
+        return
+
+    conn = connect(db_path)
+    try:
+        applied = applied_versions(conn)
+        pending = [migration for migration in MIGRATIONS if migration.version not in applied]
+
+        if command == "status":
+            for migration in MIGRATIONS:
+                state = f"已执行 {applied[migration.version]}" if migration.version in applied else "待执行"
+                print(f"{migration.version:03d} {migration.name}: {state}")
+            return
+
+        if command == "baseline":
+            mark_applied(conn, pending)
+            print(f"已记录 {len(pending)} 个版本")
+            return
+
+        if not pending:
+            print("没有待执行的迁移")
+            return
+        for migration in pending:
+            print(f"执行迁移 {migration.version:03d} {migration.name}")
+            started = time.monotonic()
+            apply_migration(conn, migration)
+            print(f"迁移 {migration.version:03d} 完成（{time.monotonic() - started:.1f} 秒）")
+    finally:
+        conn.close()
+
+    print("数据库迁移完成")
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "up"
+    if command not in ("up", "status", "baseline"):
+        print(__doc__)
+        sys.exit(1)
+    migrate_database(command)